@@ -2,6 +2,7 @@ __author__ = 'samantha'
 
 from sjasoft.uopmeta import oid
 import asyncio
+from sjasoft.utils.category import partition
 from sjasoft.uop import changeset as base
 
 def oid_matches(to_check, oid):
@@ -12,21 +13,32 @@ class NoModChanges(base.NoModChanges):
     async def db_not_dup(self, collection, data):
         return not await collection.exists(data)
 
+    async def db_not_dups(self, collection, items):
+        present = await collection.existing_associations([self.association_triple(i) for i in items])
+        return [i for i in items if self.association_triple(i) not in present]
+
     async def apply_to_db(self, collections):
         coll = self.user_collection(collections)
-        for item in self.inserted:
-            item = dict(item)
-            if self.db_not_dup(coll, item):
-                await coll.insert(**item)
-        for item in self.deleted:
-            item = dict(item)
-            await coll.remove(item)
+        to_insert = await self.db_not_dups(coll, [dict(item) for item in self.inserted])
+        if to_insert:
+            await coll.insert_many(to_insert)
+        to_delete = [dict(item) for item in self.deleted]
+        if to_delete:
+            await coll.remove_many(to_delete)
+        for item in to_delete:
             self.on_db_delete(item, collections)
 
     @classmethod
     async def delete_object_references(cls, collection, objid):
         await collection.remove(cls._object_db_filter(objid))
 
+    @classmethod
+    async def delete_objects_references(cls, collection, obj_ids):
+        obj_ids = list(obj_ids)
+        if obj_ids:
+            clauses = [{k: {'$in': obj_ids}} for k in cls._object_fields]
+            await collection.remove({'$or': clauses} if len(clauses) > 1 else clauses[0])
+
     @classmethod
     async def delete_class_references(cls, collection, clsid):
         await collection.remove(cls._class_db_filter(clsid))
@@ -72,12 +84,13 @@ class CrudChanges(base.CrudChanges):
 
     async def apply_to_db(self, collections):
         coll = getattr(collections, self.kind)
-        for k, v in self.inserted.items():
-            await coll.insert(**v)
-        for k, v in self.modified.items():
-            await coll.update_one(k, v)
+        if self.inserted:
+            await coll.insert_many(list(self.inserted.values()))
+        if self.modified:
+            await coll.update_many(self.modified)
+        if self.deleted:
+            await coll.remove_many(list(self.deleted))
         for k in self.deleted:
-            await coll.remove(k)
             await self.on_db_delete(k, collections)
 
     async def delete_from_collections(self, collections, key):
@@ -97,25 +110,26 @@ class ObjectChanges(CrudChanges):
         CrudChanges.delete(self, identifier, in_changeset)
 
     async def apply_to_db(self, collections):
-
-        colls = {}
-
-        async def collection(uuid):
-            cls_id = oid.oid_class(uuid)
-            if not cls_id in colls:
-                colls[cls_id] = await collections.class_extension(cls_id)
-            return colls[cls_id]
-
-        for k, v in self.inserted.items():
-            coll = await collection(k)
-            await coll.insert(**v)
-        for k, v in self.modified.items():
-            coll = await collection(k)
-            await coll.update({'_id': k}, v)
-        for k in self.deleted:
-            coll = await collection(k)
-            await coll.remove(k)
-            await self.on_db_delete(k, collections)
+        """
+        Applies object changes with one bulk operation per class extension
+        and per kind of change.
+        """
+        by_class = lambda ids: partition(ids, oid.oid_class).items()
+
+        for cls_id, ids in by_class(self.inserted):
+            coll = await collections.class_extension(cls_id)
+            await coll.insert_many([self.inserted[k] for k in ids])
+        for cls_id, ids in by_class(self.modified):
+            coll = await collections.class_extension(cls_id)
+            await coll.update_many({k: self.modified[k] for k in ids})
+        for cls_id, ids in by_class(self.deleted):
+            coll = await collections.class_extension(cls_id)
+            await coll.remove_many(ids)
+        if self.deleted:
+            await asyncio.gather(
+                TaggedChanges.delete_objects_references(collections.tagged, self.deleted),
+                GroupedChanges.delete_objects_references(collections.grouped, self.deleted),
+                RelatedChanges.delete_objects_references(collections.related, self.deleted))
 
     async def on_db_delete(self, uuid, collections):
         await asyncio.gather(
@@ -200,6 +214,12 @@ class QueryChanges(CrudChanges):
 class ClassChanges(CrudChanges):
     kind = 'classes'
 
+    async def apply_to_db(self, collections):
+        await super().apply_to_db(collections)
+        collections.forget_class_extensions(self.deleted)
+        collections.update_class_tables(classes=self)
+        if self.inserted or self.deleted:
+            await collections.class_set_changed()
 
     async def on_db_delete(self, key, collections):
         import re
@@ -218,7 +238,10 @@ class ClassChanges(CrudChanges):
 
 class AttributeChanges(CrudChanges):
     kind = 'attributes'
-    pass
+
+    async def apply_to_db(self, collections):
+        await super().apply_to_db(collections)
+        collections.update_class_tables(attributes=self)
 
     async def db_not_dup(self, collection, data):
         checked_data = dict(name=data['name'], type_id=data['type_id'])
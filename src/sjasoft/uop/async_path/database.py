@@ -34,6 +34,7 @@ from sjasoft.uop import interface as iface
 from sjasoft.utils.index import make_id
 import asyncio
 from sjasoft.uop import database as base
+from sjasoft.uop.constraints import ConstraintViolation
 
 logger = cw_logging.getLogger('uop.database')
 
@@ -99,16 +100,49 @@ class Database(base.Database):
         return self._collections
 
     async def ensure_database_info(self):
-        db_info = self.db_info()
+        db_info = await self.db_info()
         db = self.database_collection()
         if not db_info:
-            db_info =  await db.insert(_id=self._id, tenancy=self._tenancy)
+            try:
+                await db.insert(_id=self.db_info_id, tenancy=self._tenancy, class_set_version=0)
+            except ConstraintViolation:
+                pass  # inserted meanwhile through another Database on the store
+            db_info = await self.db_info()
+        if isinstance(db_info, dict):
+            self._class_set_version = db_info.get('class_set_version', 0)
         return db_info
 
+    def database_collection(self):
+        return self.collections._collections.get('databases')
+
+    async def ensured_database_collection(self):
+        if self.database_collection() is None:
+            await self.collections.ensure_basic_collections()  # a store opened again is not set up by open_db
+        return self.database_collection()
+
+    async def stored_class_set_version(self):
+        db = await self.ensured_database_collection()
+        info = await db.get(self.db_info_id) if db is not None else None
+        return info.get('class_set_version', 0) if info else 0
+
+    async def refresh_class_set_version(self):
+        self._class_set_version = max(self._class_set_version, await self.stored_class_set_version())
+
+    def ensure_extensions(self):
+        # begin_transaction cannot await the database info so apply_changes refreshes the version ahead of it
+        self._ensure_extensions_for(self.class_set_version())
+
+    async def bump_class_set_version(self):
+        await self.refresh_class_set_version()
+        self._class_set_version += 1
+        db = await self.ensured_database_collection()
+        if db is not None:
+            await db.update_one(self.db_info_id, {'class_set_version': self._class_set_version})
+
     async def db_info(self):
         if not self._db_info:
             db = self.database_collection()
-            self._db_info = await db.get(self._id)
+            self._db_info = await db.get(self.db_info_id)
         return self._db_info
 
     async def get_tenant_collections(self, tenant_id=None):
@@ -140,6 +174,17 @@ class Database(base.Database):
         changes['timestamp'] = time.time()
         coll = self.get_collection('changes')
         await coll.insert(**changes)
+        self.last_logged = changes['timestamp']
+        self.logged_times.append(changes['timestamp'])
+
+    async def latest_change_time(self):
+        coll = self.get_collection('changes')
+        found = await coll.find(only_cols=['timestamp'], order_by=['-timestamp'], limit=1)
+        return found[0] if found else None
+
+    async def change_times_since(self, epochtime):
+        coll = self.get_collection('changes')
+        return await coll.find({'timestamp': {'$gt': epochtime}}, only_cols=['timestamp'])
 
     async def changes_since(self, epochtime, tenant_id, client_id=None):
         client_id = client_id or 0
@@ -150,6 +195,8 @@ class Database(base.Database):
         return await changeset.ChangeSet.combine_changes(*changesets)
 
     async def apply_changes(self, changeset, collections):
+        if not self.in_long_transaction:
+            await self.refresh_class_set_version()
         self.begin_transaction()
         # premise is that changeset and dbs conjointly
         # no how to do this much much of the logic is
@@ -166,6 +213,8 @@ class Database(base.Database):
         await changeset.queries.apply_to_db(collections)
         await self.log_changes(changeset)
         self.commit()
+        self.data_versions(collections.tenant_id).bump(changeset)
+        self._bump_meta_version(changeset, collections.tenant_id)
 
     async def commit(self):
         await self._db.commit()
@@ -2,9 +2,12 @@ __author__ = 'samantha'
 
 from sjasoft.utils.index import make_id
 from functools import partial
+from sjasoft.utils.category import binary_partition
 from sjasoft.uop import interface as iface
 from sjasoft.uop import db_collection as base
-from sjasoft.uop.collections import uop_collection_names, meta_kinds, assoc_kinds, per_tenant_kinds
+from sjasoft.uop import paging
+from sjasoft.uop.collections import uop_collection_names, meta_kinds, assoc_kinds, per_tenant_kinds, \
+    cls_extension_field
 shared_collections = meta_kinds
 
 default_collection_names = dict(
@@ -35,18 +38,35 @@ class DatabaseCollections(base.DatabaseCollections):
             await col.drop()
 
     async def class_extension(self, cls_id):
-        cls = await self.classes.get(cls_id)
-        return await self.get_class_extension(cls)
+        known = self._extensions.get(cls_id)
+        if not known:
+            known = await self.get_class_extension(await self.classes.get(cls_id))
+        return known
+
+    async def class_set_changed(self):
+        await self._db.bump_class_set_version()
+
+    async def _recorded_extension(self, cls):
+        if self._tenant_id:
+            tenant = await self._db.get_tenant(self._tenant_id) or {}
+            name = (tenant.get('cls_extensions') or {}).get(cls['id'])
+            return await self._db.get_managed_collection(name) if name else None
+        known = cls.get('extension')
+        if not known and cls.get(cls_extension_field):
+            known = await self.get(cls[cls_extension_field])
+        return known
 
     async def get_class_extension(self, cls):
         cid = cls['id']
         known = self._extensions.get(cid)
         if not known:
-            if not self._tenant_id:
-                known = cls.get('extension')
+            known = await self._recorded_extension(cls)
             if not known:
-                known = await self._db.make_random_collection()
-                await self._save_class_extension(cls, known)
+                with self.instrumentation.timed('extensions.create'):
+                    known = await self._db.make_random_collection()
+                    await self._save_class_extension(cls, known)
+                self.instrumentation.event('extensions.created', cls_id=cid, cls_name=cls.get('name'),
+                                           collection=known.name, tenant_id=self._tenant_id)
             self._extensions[cid] = known
         return known
 
@@ -65,20 +85,19 @@ class DatabaseCollections(base.DatabaseCollections):
         return col
 
     async def _save_tenant_extensions(self, extensions):
-        await self._db.tenants().update_one(self._tenant_id, {'extensions': extensions})
+        await self._db.tenants().update_one(self._tenant_id, {'cls_extensions': extensions})
 
     async def _save_class_extension(self, cls, extension):
         cls['extension'] = extension
         cid = cls['id']
-        name = extension.name
         if self._tenant_id:
-            self._extensions[cid] = name
-            extension_names = {k: v['name'] for k, v in self._extensions.items()}
-            await self._save_tenant_extensions(extension_names)
+            self._extensions[cid] = extension
+            await self._save_tenant_extensions(self._extension_names())
         else:
-            cls['extension_name'] = extension.name
-            cls['extension'] = extension
-            await self.classes.update_one(cls['id'], {'extension_name': cls['extension_name']})
+            current = cls.get(cls_extension_field)
+            cls[cls_extension_field] = extension.name
+            if current != extension.name:
+                await self.classes.update_one(cid, {cls_extension_field: extension.name})
 
 
     async def ensure_basic_collections(self, col_map=None):
@@ -130,6 +149,33 @@ class DBCollection(base.DBCollection):
     async def insert(self, **fields):
         pass
 
+    async def insert_many(self, items):
+        return [await self.insert(**item) for item in items]
+
+    async def update_one(self, an_id, mods):
+        return await self.update({'_id': an_id}, mods)
+
+    async def update_many(self, mods_by_id):
+        for an_id, mods in mods_by_id.items():
+            await self.update_one(an_id, mods)
+
+    async def remove_many(self, keys):
+        criteria, ids = binary_partition(keys, lambda k: isinstance(k, dict))
+        if ids:
+            await self.remove({'_id': {'$in': ids}})
+        if criteria:
+            await self.remove(criteria[0] if len(criteria) == 1 else {'$or': criteria})
+
+    async def existing_associations(self, triples):
+        triples = {tuple(t) for t in triples}
+        if not triples:
+            return set()
+        fields = self.association_fields
+        values = [list({t[i] for t in triples if t[i] is not None}) for i in range(len(fields))]
+        criteria = {f: {'$in': v} for f, v in zip(fields, values) if v}
+        found = await self.find(criteria, only_cols=list(fields))
+        return {tuple(r.get(f) for f in fields) for r in found} & triples
+
     async def bulk_load(self, *ids):
         pass
 
@@ -143,6 +189,21 @@ class DBCollection(base.DBCollection):
                    order_by=None, limit=None, ids_only=False):
         return []
 
+    async def find_page(self, criteria=None, order_by=None, limit=100, continuation=None, only_cols=None):
+        fields = paging.sort_fields(order_by, self.key_fields)
+        fetched = paging.fetch_columns(only_cols, fields)
+        records = await self.find(paging.page_criteria(criteria, fields, continuation),
+                                  only_cols=fetched, order_by=fields, limit=limit)
+        return paging.page(records, only_cols, fetched, fields, limit)
+
+    async def find_iter(self, criteria=None, only_cols=None, order_by=None, batch_size=1000):
+        continuation = None
+        while True:
+            records, continuation = await self.find_page(criteria, order_by, batch_size, continuation, only_cols)
+            for record in records:
+                yield record
+            if continuation is None:
+                return
 
     async def all(self):
         return await self.find()
@@ -12,6 +12,9 @@ import re
 import asyncio
 from contextlib import asynccontextmanager
 from sjasoft.uop import db_interface as base
+from sjasoft.uop.cache import roleset_key
+from sjasoft.uop import meta_state
+from sjasoft.uop.async_path import group_commit
 from sjasoft.uop.exceptions import NoSuchObject
 
 @asynccontextmanager
@@ -19,9 +22,10 @@ async def changes(obj):
     changes = obj._changeset or changeset.ChangeSet()
     yield changes
     if not obj._changeset:
-        if obj._cache:
-            obj._cache.apply_changes(changes)
-        await obj._db.apply_changes(changes, obj._db.collections)
+        if obj._group_committer:
+            await obj._group_committer.submit(changes)
+        else:
+            await obj._apply_to_db(changes)
 
 
 async def get_tenant_interface(db, tenant_id):
@@ -46,9 +50,30 @@ class Interface(base.Interface):
     to only the users data is set up around the database.  This is very convenient for servers
     handling requests for multiple users.
     Similarly a cache should be shared across requests to a process.
+    Independent lookups are run concurrently through gather with at most
+    concurrency of them in flight.
     """
     _db = None
     _cache = None
+    _semaphore = None
+    concurrency = 16
+
+    @property
+    def limiter(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    async def gather(self, *awaitables):
+        """
+        Await awaitables concurrently, at most concurrency at a time.
+        :return: list of their results in order
+        """
+        async def limited(awaitable):
+            async with self.limiter:
+                return await awaitable
+
+        return await asyncio.gather(*[limited(a) for a in awaitables])
 
     async def ensure_collections(self):
         if not self._collections:
@@ -65,10 +90,35 @@ class Interface(base.Interface):
         return has_changes, changes
 
 
+    @property
+    def metacontext(self):
+        # a reload cannot be awaited here; update_metacontext reloads when another interface
+        # has changed the metadata
+        return self._context
+
     async def reload_metacontext(self):
+        versions = self._meta_versions()
         coll_meta = await self.raw_db.collections.metadata()
+        self._metadata = meta_state.MetaState(coll_meta, versions)
         self._context = MetaContext.from_data(coll_meta)
 
+    async def _changed_metadata(self, kind, component):
+        changed = meta_state.changed_ids(component)
+        return (await getattr(self.raw_db.collections, kind).find({'id': {'$in': changed}})) if changed else []
+
+    async def update_metacontext(self, changes, versions):
+        kinds = meta_state.changed_kinds(changes)
+        if not kinds:
+            return
+        if self._metadata is None or self._metadata.versions != versions:
+            await self.reload_metacontext()
+            return
+        for kind in kinds:
+            component = getattr(changes, kind)
+            self._metadata.patch(kind, component.deleted, await self._changed_metadata(kind, component))
+        self._metadata.versions = self._meta_versions()
+        self._context = MetaContext.from_data(self._metadata.metadata())
+
     async def update_metadata(self, metadata):
         """
         Modifies metadata, adding, modifying and deleting. The
@@ -77,14 +127,25 @@ class Interface(base.Interface):
         :param metadata: Basically a changeset of updates.
         :return: None
         """
+        versions = self._meta_versions()
         await self._db.apply_changes(metadata, self._db.collections)
-        self.reload_metacontext()
+        await self.update_metacontext(metadata, versions)
+
+    async def _apply_to_db(self, changes, collections=None):
+        versions = self._meta_versions()
+        await self._db.apply_changes(changes, collections or self._db.collections)
+        if self._cache:
+            self._cache.apply_changes(changes)
+        await self.update_metacontext(changes, versions)
+
+    def enable_group_commit(self, window=0.002, max_ops=500):
+        self._group_committer = group_commit.GroupCommitter(
+            self._apply_to_db, window=window, max_ops=max_ops, abort=self._db.abort)
 
     async def commit(self):
-        if self._changeset:
-            if self._cache:
-                self._cache.apply_changes(self._changeset)
-            await self._db.apply_changes(self._changeset, self._db.collections)
+        changes = self._changeset
+        if changes:
+            await self._apply_to_db(changes)
             self._changeset = None
 
     async def apply_changes(self, changes):
@@ -97,8 +158,7 @@ class Interface(base.Interface):
         :param transform_relative: specification of source metadata so ids can be mapped
         :return: None
         """
-        await self._db.apply_changes(changes, self._db.collections)
-        await self.reload_metacontext()
+        await self._apply_to_db(changes)
 
     async def changes_until(self, a_time):
         changes = self._db.get_collection('changes')
@@ -140,6 +200,39 @@ class Interface(base.Interface):
             return await coll.contains_id(object_id)
         return False
 
+    async def objects_ok(self, object_ids):
+        """
+        The subset of object_ids naming existing objects, checked with one
+        query per class extension with the extensions queried concurrently.
+        """
+        by_class = partition(set(object_ids), oid.oid_class)
+
+        async def existing(cls_id, ids):
+            return await self._existing_ids(await self.extension(cls_id), ids)
+
+        found = await self.gather(*[existing(c, ids) for c, ids in by_class.items() if self.class_ok(c)])
+        return set().union(*found)
+
+    async def _existing_ids(self, coll, ids):
+        ids = list(set(ids))
+        if not ids:
+            return set()
+        return set(await coll.find({'_id': {'$in': ids}}, only_cols=['_id']))
+
+    async def tags_ok(self, tag_ids):
+        """the subset of tag_ids naming existing tags, checked with one query"""
+        return await self._existing_ids(self.tags, tag_ids)
+
+    async def groups_ok(self, group_ids):
+        """the subset of group_ids naming existing groups, checked with one query"""
+        return await self._existing_ids(self.groups, group_ids)
+
+    async def group_items_ok(self, items):
+        """the subset of items that are groups or existing objects"""
+        items = list(items)
+        groups = await self.groups_ok(items)
+        return groups | await self.objects_ok([i for i in items if i not in groups])
+
     def class_short_form(self, class_id):
         cls = self.get_class(class_id)
         if cls:
@@ -211,103 +304,137 @@ class Interface(base.Interface):
 
     async def get_object_roles(self, uuid):
         "returns all role_ids that the object is subject in"
-        data = set(await self.related.distinct('role_id', criteria=dict(subject=uuid)))
-        data_rev = set(await self.related.distinct('role_id', criteria=dict(object_id=uuid)))
-        return data | data_rev
+        data, data_rev = await self.gather(
+            self.related.distinct('role_id', criteria=dict(subject=uuid)),
+            self.related.distinct('role_id', criteria=dict(object_id=uuid)))
+        return set(data) | set(data_rev)
 
     async def get_object_relationships(self, uuid):
         """dictionary of role_id to object_id set"""
         roles = await self.get_object_roles(uuid)
-        return dict([(r, await self.get_roleset(uuid, r)) for r in roles])
+        found = await self.bulk_rolesets([(uuid, r) for r in roles])
+        return {r: found[(uuid, r)] for r in roles}
 
     async def get_roleset(self, subject, role_id):
-        key = role_id + ":" + subject
-        res = self._cache and self._cache.get(key)
-        if not res:
-            role = await self.roles.get(role_id)
-            criteria = {'subject': subject, 'associated': role_id}
-            col = 'object_id'
-            if role['is_reversed']:
-                criteria = {'object_id': subject, 'associated': role['reverse_id']}
-                col = 'subject'
-            res = set(await self.related.find(criteria=criteria, only_cols=[col]))
-            if self._cache:
-                self._cache.set(key, res)
+        res = await self.get_rolesets([subject], role_id)
+        return res[subject]
+
+    async def get_rolesets(self, subjects, role_id):
+        """
+        Rolesets of subjects by role_id.  Those of a reversed role are cached under the reverse
+        key of its forward role, which is the key changes to the related records invalidate.
+        Results read while changes were applied are not cached.
+        """
+        role = await self.roles.get(role_id)
+        reversed_role = bool(role and role['is_reversed'])
+        key_role = role['reverse_id'] if reversed_role else role_id
+        res = {}
+        missing = []
+        for subject in subjects:
+            found = self._cache.get(roleset_key(subject, key_role, reversed_role)) if self._cache else None
+            if found is None:
+                missing.append(subject)
+            else:
+                res[subject] = set(found)
+        if missing:
+            stamps = [v.version for v in self._query_versions()]
+            criteria = {'subject': {'$in': missing}, 'associated': role_id}
+            key_col, col = 'subject', 'object_id'
+            if reversed_role:
+                criteria = {'object_id': {'$in': missing}, 'associated': key_role}
+                key_col, col = 'object_id', 'subject'
+            found = {subject: set() for subject in missing}
+            for rec in await self.related.find(criteria=criteria, only_cols=[key_col, col]):
+                found[rec[key_col]].add(rec[col])
+            if self._cache and stamps == [v.version for v in self._query_versions()]:
+                for subject, ids in found.items():
+                    self._cache.set(roleset_key(subject, key_role, reversed_role), set(ids))
+            res.update(found)
         return res
 
+    async def bulk_rolesets(self, pairs):
+        """
+        Rolesets of many (id, role_id) pairs with one query per distinct role
+        as reversed roles are stored under their forward role.
+        :return: dict of (id, role_id) pair to set of related ids
+        """
+        by_role = partition(pairs, lambda pair: pair[1], lambda pair: pair[0])
+        found = await self.gather(*[self.get_rolesets(ids, role_id) for role_id, ids in by_role.items()])
+        return {(an_id, role_id): ids
+                for role_id, sets in zip(by_role, found) for an_id, ids in sets.items()}
+
     async def modify_associated(self, kind, current, future, constructor, do_replace=False):
         future = set(future)
         async with changes(self) as chng:
-            insert = lambda x: chng.insert(kind, constructor(x))
-            delete = lambda x: chng.delete(kind, constructor(x))
-            map(insert, future - current)
+            for item in future - current:
+                chng.insert(kind, constructor(item))
             if do_replace:
-                map(delete, current - future)
+                for item in current - future:
+                    chng.delete(kind, constructor(item))
             return getattr(chng, kind).to_dict()
 
-    def add_object_groups(self, object_id, group_ids):
-        group_ids = filter(self.group_ok, group_ids)
-        return self.modify_associated(
-            'grouped', self.get_object_groups(object_id),
+    async def add_object_groups(self, object_id, group_ids):
+        group_ids, current = await self.gather(self.groups_ok(group_ids), self.get_object_groups(object_id))
+        return await self.modify_associated(
+            'grouped', set(current),
             group_ids, (lambda group_id: meta.Grouped(assoc_id=group_id, object_id=object_id)))
 
-    def set_object_groups(self, object_id, group_ids):
-        group_ids = filter(self.group_ok, group_ids)
-        return self.modify_associated(
-            'grouped', self.get_object_groups(object_id),
+    async def set_object_groups(self, object_id, group_ids):
+        group_ids, current = await self.gather(self.groups_ok(group_ids), self.get_object_groups(object_id))
+        return await self.modify_associated(
+            'grouped', set(current),
             group_ids, (lambda group_id: Grouped(group_id, object_id)), True)
 
     async def group_item_check(self, item):
-        return (await self.group_ok(item)) or (await self.object_ok(item))
+        return bool(await self.group_items_ok([item]))
 
     async def add_group_objects(self, group_id, object_ids):
-
-        object_ids = [o for o in object_ids if await self.group_item_check(o)]
+        object_ids, current = await self.gather(self.group_items_ok(object_ids), self.objects_in_group(group_id))
         return await self.modify_associated(
-            'grouped', self.objects_in_group(group_id),
+            'grouped', current,
             object_ids, (lambda object_id: Grouped(group_id, object_id)))
 
     async def set_group_objects(self, group_id, object_ids):
-        object_ids = [o for o in object_ids if await self.group_item_check(o)]
-        return self.modify_associated(
-            'grouped', await self.objects_in_group(group_id),
+        object_ids, current = await self.gather(self.group_items_ok(object_ids), self.objects_in_group(group_id))
+        return await self.modify_associated(
+            'grouped', current,
             object_ids, (lambda object_id: Grouped(group_id, object_id)), True)
 
     async def add_object_tags(self, object_id, tag_ids):
-        tag_ids = [t for t in tag_ids if await self.tag_ok(t)]
-        return self.modify_associated(
-            'tagged', self.get_object_tags(object_id),
+        tag_ids, current = await self.gather(self.tags_ok(tag_ids), self.get_object_tags(object_id))
+        return await self.modify_associated(
+            'tagged', current,
             tag_ids, (lambda tag_id: Tagged(tag_id, object_id)))
 
     async def set_object_tags(self, object_id, tag_ids):
-        tag_ids = [t for t in tag_ids if await self.tag_ok(t)]
-        return self.modify_associated(
-            'tagged', await self.get_object_tags(object_id),
+        tag_ids, current = await self.gather(self.tags_ok(tag_ids), self.get_object_tags(object_id))
+        return await self.modify_associated(
+            'tagged', current,
             tag_ids, (lambda tag_id: Tagged(tag_id, object_id)), True)
 
     async def add_tag_objects(self, tag_id, object_ids):
-        object_ids = [o for o in object_ids if await self.object_ok(o)]
-        return self.modify_associated(
-            'tagged', await self.get_tagset(tag_id),
+        object_ids, current = await self.gather(self.objects_ok(object_ids), self.get_tagset(tag_id))
+        return await self.modify_associated(
+            'tagged', current,
             object_ids, (lambda object_id: Tagged(tag_id, object_id)))
 
     async def set_tag_objects(self, tag_id, object_ids):
-        object_ids = filter(self.object_ok, object_ids)
-        return self.modify_associated(
-            'tagged', await self.get_tagset(tag_id),
-            object_ids, (lambda object_id: Tagged(tag_id, object_id)))
+        object_ids, current = await self.gather(self.objects_ok(object_ids), self.get_tagset(tag_id))
+        return await self.modify_associated(
+            'tagged', current,
+            object_ids, (lambda object_id: Tagged(tag_id, object_id)), True)
 
     async def add_object_related(self, subject, role_id, object_ids):
-        object_ids = [o for o in object_ids if await self.object_ok(o)]
+        object_ids, current = await self.gather(self.objects_ok(object_ids), self.get_roleset(subject, role_id))
         return await self.modify_associated(
-            'related', await self.get_roleset(subject, role_id),
+            'related', current,
             object_ids,
             (lambda object_id: Related(subject, role_id, object_id)))
 
     async def set_object_related(self, subject, role_id, object_ids):
-        object_ids = [o for o in object_ids if await self.object_ok(o)]
+        object_ids, current = await self.gather(self.objects_ok(object_ids), self.get_roleset(subject, role_id))
         return await self.modify_associated(
-            'related', await self.get_roleset(subject, role_id),
+            'related', current,
             object_ids,
             (lambda object_id: Related(subject, role_id, object_id)),
             True)
@@ -335,9 +462,10 @@ class Interface(base.Interface):
         :param uuid:  the object to find related objects for
         :return: set of object ids of related objects
         """
-        res = set(await self.related.find({'subject': uuid}, only_cols=['object_id']))
-        res.update(await self.related.find({'object_id': uuid}, only_cols=['subject']))
-        return res
+        objects, subjects = await self.gather(
+            self.related.find({'subject': uuid}, only_cols=['object_id']),
+            self.related.find({'object_id': uuid}, only_cols=['subject']))
+        return set(objects) | set(subjects)
 
     async def get_assocset(self, coll, an_id):
         res = self._cache and self._cache.get(an_id)
@@ -348,6 +476,16 @@ class Interface(base.Interface):
                 self._cache.set(an_id, res)
         return res
 
+    async def extension_bitmap(self, cls_id):
+        bitmaps = self._db.extension_bitmaps(self._tenant)
+        versions = self._query_versions()
+        found = bitmaps.get(cls_id, versions)
+        if found is None:
+            stamps = [v.version for v in versions]
+            coll = await self.extension(cls_id)
+            found = bitmaps.set(cls_id, stamps, await coll.ids_only())
+        return found
+
     async def get_tagset(self, tag_id):
         return await self.get_assocset(self.tagged, tag_id)
 
@@ -369,7 +507,7 @@ class Interface(base.Interface):
         Returns dict with tag_ids as keys and list objects having
         tag as value.
         """
-        tagsets = await asyncio.gather(*[self.get_tagset(t) for t in tags])
+        tagsets = await self.gather(*[self.get_tagset(t) for t in tags])
         res = zip(tags, [list(ts) for ts in tagsets])
         return dict(res)
 
@@ -387,7 +525,7 @@ class Interface(base.Interface):
         """
         Returns dict with group_ids as keys and list objects directly in group as value.
         """
-        sets = await asyncio.gather(*[self.get_tagset(t) for t in groups])
+        sets = await self.gather(*[self.get_groupset(g) for g in groups])
         res = zip(groups, [list(items) for items in sets])
         return dict(res)
 
@@ -402,18 +540,23 @@ class Interface(base.Interface):
         return {}
 
     async def objects_in_group(self, group_id, transitive=False):
+        """
+        Objects directly in the group or, if transitive, in it or any group within it.
+        Each level of contained groups is read concurrently.
+        """
         res = set()
-
-        async def do_group(a_group):
-            objs = await self.grouped.find({'associated': a_group})
-            groups, objects = binary_partition(objs, lambda x: x['is_group'])
-            objects = [x['object_id'] for x in objects]
-            res.update(objects)
-            if groups and transitive:
-                for group in groups:
-                    await do_group(group['object_id'])
-
-        await do_group(group_id)
+        seen = {group_id}
+        level = [group_id]
+        while level:
+            found = await self.gather(*[self.grouped.find({'associated': g}) for g in level])
+            level = []
+            for objs in found:
+                groups, objects = binary_partition(objs, lambda x: x['is_group'])
+                res.update(x['object_id'] for x in objects)
+                if transitive:
+                    inner = {g['object_id'] for g in groups} - seen
+                    seen |= inner
+                    level.extend(inner)
         return res
 
     async def get_object_groups(self, uuid, recursive=False):
@@ -577,12 +720,28 @@ class Interface(base.Interface):
 
     async def class_instances(self, name):
         cls = self.metaclass_named(name)
-        coll = self.extension(cls['_id'])
+        coll = await self.extension(cls['_id'])
         return await coll.find()
 
+    async def instances_satisfying_page(self, name, criteria=None, order_by=None, limit=100,
+                                        continuation=None, only_cols=None):
+        cls = self.metaclass_named(name)
+        coll = await self.extension(cls['_id'])
+        return await coll.find_page(criteria, order_by, limit, continuation, only_cols)
+
+    async def iter_class_instances(self, name, only_cols=None, batch_size=1000):
+        async for instance in self.iter_instances_satisfying(name, None, only_cols, batch_size):
+            yield instance
+
+    async def iter_instances_satisfying(self, name, criteria, only_cols=None, batch_size=1000):
+        cls = self.metaclass_named(name)
+        coll = await self.extension(cls['_id'])
+        async for instance in coll.find_iter(criteria, only_cols=only_cols, batch_size=batch_size):
+            yield instance
+
     async def class_instance_ids(self, name):
         cls = self.metaclass_named(name)
-        coll = self.extension(cls['_id'])
+        coll = await self.extension(cls['_id'])
         return await coll.ids_only()
 
 
@@ -613,7 +772,9 @@ class Interface(base.Interface):
         if not obj:
             coll = self.containing_collection(uuid)
             obj = await coll.get(uuid)
-        return obj
+            if obj and self._cache:
+                self._cache.set(uuid, obj)
+        return dict(obj) if obj else obj
 
     async def bulk_load(self, uuids, preserve_order=True):
         by_cls = partition(uuids, oid.oid_class)
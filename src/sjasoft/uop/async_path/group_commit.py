@@ -0,0 +1,77 @@
+import asyncio
+import inspect
+from sjasoft.uop import group_commit as base
+from sjasoft.uop.async_path import changeset
+
+
+class GroupCommitter(base.GroupCommitter):
+    """
+    Group commit for async Interfaces.  Callers are tasks of one event loop.  The leader
+    sleeps out the window, or until max_ops changes are queued, and awaits apply.  The
+    other callers await the future of their changes.
+    """
+    changeset_class = changeset.ChangeSet
+
+    def __init__(self, apply, window=0.002, max_ops=500, abort=None, clock=base.time.monotonic):
+        super().__init__(apply, window, max_ops, abort, clock)
+        self._full = None
+        self._async_lock = None
+
+    async def _call(self, fun, *args):
+        res = fun(*args)
+        if inspect.isawaitable(res):
+            res = await res
+        return res
+
+    async def submit(self, changes):
+        pending = base.Pending(changes)
+        pending.done = asyncio.get_running_loop().create_future()
+        self._enqueue(pending)
+        if self._leading:
+            if self._ops >= self.max_ops:
+                self._full.set()
+        else:
+            self._leading = True
+            self._full = asyncio.Event()
+            group = None
+            try:
+                if self._ops < self.max_ops:
+                    try:
+                        await asyncio.wait_for(self._full.wait(), self.window)
+                    except asyncio.TimeoutError:
+                        pass
+                group = self._take_group()
+                if self._async_lock is None:
+                    self._async_lock = asyncio.Lock()
+                async with self._async_lock:
+                    await self._commit(group)
+            except BaseException as e:
+                if group is None:
+                    group = self._take_group()
+                self._fail(group, e)
+                raise
+            finally:
+                for member in group:
+                    if not member.done.done():
+                        member.done.set_result(member.error)
+        error = await pending.done
+        if error is not None:
+            raise error
+
+    async def _commit(self, group):
+        try:
+            await self._call(self._apply, self.combined(group))
+            return
+        except Exception as e:
+            if self._abort:
+                await self._call(self._abort)
+            if len(group) == 1:
+                group[0].error = e
+                return
+        for member in group:
+            try:
+                await self._call(self._apply, member.changes)
+            except Exception as e:
+                member.error = e
+                if self._abort:
+                    await self._call(self._abort)
@@ -0,0 +1,77 @@
+import asyncio
+from contextlib import asynccontextmanager
+from sjasoft.uop import registry as base
+
+
+class InterfaceRegistry(base.InterfaceRegistry):
+    """
+    Registry of async Interfaces.  The factory and the changes log reads are awaited.
+    """
+
+    def __init__(self, db, factory, idle_seconds=600, check_interval=1.0, clock=base.time.monotonic):
+        super().__init__(db, factory, idle_seconds, check_interval, clock)
+        self._lock = asyncio.Lock()
+
+    async def _log_time(self):
+        return (await self._db.latest_change_time()) or 0
+
+    async def _foreign_change_time(self, now):
+        if self._checked_at is None or now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            self._note_change_times(await self._db.change_times_since(self._seen_stamp))
+        return self._foreign_stamp
+
+    async def _fresh_entry(self, tenant_id, now):
+        entry = self._entries.get(tenant_id)
+        foreign = await self._foreign_change_time(now)
+        self._forget_foreign_changes(tenant_id, entry)
+        if entry is not None and entry.stamp < foreign:
+            entry = None
+        if entry is None:
+            log_time = await self._log_time()
+            if self._seen_stamp is None:
+                self._seen_stamp = log_time
+            stamp = max(log_time, self._foreign_stamp)
+            fresh = base.RegistryEntry(await self._factory(self._db, tenant_id), stamp, now)
+            if tenant_id in self._entries:
+                fresh.refs = self._entries[tenant_id].refs
+            entry = self._entries[tenant_id] = fresh
+        entry.last_used = now
+        return entry
+
+    async def get(self, tenant_id=None):
+        async with self._lock:
+            now = self._clock()
+            self._sweep(now)
+            return (await self._fresh_entry(tenant_id, now)).interface
+
+    async def acquire(self, tenant_id=None):
+        async with self._lock:
+            now = self._clock()
+            self._sweep(now)
+            entry = await self._fresh_entry(tenant_id, now)
+            entry.refs += 1
+            return entry.interface
+
+    def release(self, tenant_id=None):
+        entry = self._entries.get(tenant_id)
+        if entry is not None:
+            entry.refs = max(entry.refs - 1, 0)
+            entry.last_used = self._clock()
+
+    @asynccontextmanager
+    async def using(self, tenant_id=None):
+        interface = await self.acquire(tenant_id)
+        try:
+            yield interface
+        finally:
+            self.release(tenant_id)
+
+    async def session(self, tenant_id=None):
+        return self._held_session(await self.acquire(tenant_id), tenant_id)
+
+    def invalidate(self, tenant_id=None):
+        self._entries.pop(tenant_id, None)
+
+    def clear(self):
+        self._entries.clear()
@@ -4,6 +4,7 @@ import asyncio
 from collections import defaultdict
 from sjasoft.uop.async_path import db_interface
 from sjasoft.uop import services as base
+from sjasoft.uop.async_path.registry import InterfaceRegistry
 
 
 class Services(base.Services):
@@ -16,6 +17,7 @@ class Services(base.Services):
 
     def __init__(self, db):
         self._db = db
+        self.interfaces = InterfaceRegistry(db, db_interface.get_tenant_interface)
 
     async def ensure_base_schema(self):
         await self.ensure_schema(base.core_schema)
@@ -81,8 +83,7 @@ class Services(base.Services):
         return await db_interface.get_tenant_interface(self._db, tenant_id=app_id)
 
     async def tenant_interface(self, tenant_id=None):
-        # TODO likely need mechanism to reuse tenant_interface for same uuid?
-        return await db_interface.get_tenant_interface(self._db, tenant_id=tenant_id)
+        return await self.interfaces.session(tenant_id)
 
     async def add_application(self, application_spec):
         app_name = application_spec['name']
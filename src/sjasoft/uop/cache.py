@@ -0,0 +1,188 @@
+"""
+Process wide cache for Interface.
+
+A UOPCache is shared by all the Interfaces of a process.  Each Interface sees it through a
+CacheNamespace for its tenant so tenants never see one another's entries while still sharing
+one size bound.  Entries are evicted least recently used first and optionally expire after
+a time to live.
+
+Entries are objects by id and rolesets (the ids related to a subject by a role) by
+roleset_key.  apply_changes invalidates exactly the entries a changeset touches where that is
+knowable from the changeset.  Deletes of objects, classes, roles, tags and groups also remove
+related records the changeset does not list so they invalidate the whole tenant namespace.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+_missing = object()
+
+namespace_flushing_kinds = ('objects', 'classes', 'roles', 'tags', 'groups')
+crud_change_kinds = ('objects', 'classes', 'attributes', 'roles', 'tags', 'groups', 'queries')
+
+
+def roleset_key(subject, role_id, reverse=False):
+    """
+    key of the ids related to subject by role_id or, if reverse, of the ids subject
+    is related to by role_id
+    """
+    return role_id + ("<:" if reverse else ":") + subject
+
+
+def changed_keys(changes):
+    """
+    Cache keys changes makes stale and whether the changes require the whole namespace be dropped.
+    A related record makes stale the roleset of its subject and the reverse roleset of its object,
+    the key under which the rolesets of a reversed role are cached.
+    :param changes: a ChangeSet
+    :return: set of keys, flush
+    """
+    keys = set()
+    flush = False
+    for kind in crud_change_kinds:
+        component = getattr(changes, kind, None)
+        if component is None:
+            continue
+        keys.update(component.inserted)
+        keys.update(component.modified)
+        keys.update(component.deleted)
+        if component.deleted and kind in namespace_flushing_kinds:
+            flush = True
+    related = getattr(changes, 'related', None)
+    if related is not None:
+        for item in list(related.inserted) + list(related.deleted):
+            data = dict(item)
+            role_id = data.get('assoc_id')
+            for field, reverse in (('subject_id', False), ('object_id', True)):
+                if data.get(field) and role_id:
+                    keys.add(roleset_key(data[field], role_id, reverse))
+    for kind in ('tagged', 'grouped'):  # association kinds of the older async changesets
+        component = getattr(changes, kind, None)
+        if component is not None and component.has_changes():
+            flush = True
+    return keys, flush
+
+
+class UOPCache(object):
+    """
+    Bounded LRU cache with optional ttl, per tenant namespaces and hit/miss counters.
+    """
+
+    def __init__(self, max_size=10000, ttl=None, clock=time.monotonic):
+        """
+        :param max_size: maximum number of entries over all namespaces
+        :param ttl: seconds an entry stays valid or None for no expiry
+        :param clock: source of the current time in seconds
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._namespaces = {}
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def namespace(self, tenant_id=None):
+        with self._lock:
+            space = self._namespaces.get(tenant_id)
+            if space is None:
+                space = self._namespaces[tenant_id] = CacheNamespace(self, tenant_id)
+            return space
+
+    def _key(self, tenant_id, key):
+        return tenant_id, self._generations.get(tenant_id, 0), key
+
+    def lookup(self, tenant_id, key, default=None):
+        with self._lock:
+            full_key = self._key(tenant_id, key)
+            entry = self._entries.get(full_key, _missing)
+            if entry is not _missing:
+                expires, value = entry
+                if expires is None or expires > self._clock():
+                    self._entries.move_to_end(full_key)
+                    self.hits += 1
+                    return value
+                del self._entries[full_key]
+            self.misses += 1
+            return default
+
+    def store(self, tenant_id, key, value):
+        with self._lock:
+            expires = (self._clock() + self.ttl) if self.ttl else None
+            full_key = self._key(tenant_id, key)
+            self._entries[full_key] = (expires, value)
+            self._entries.move_to_end(full_key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, tenant_id, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(self._key(tenant_id, key), None)
+
+    def flush(self, tenant_id):
+        """
+        Makes all entries of the tenant unreachable.  They are dropped as they age out of the LRU order.
+        """
+        with self._lock:
+            self._generations[tenant_id] = self._generations.get(tenant_id, 0) + 1
+
+    def invalidate(self, tenant_id, changes):
+        keys, flush = changed_keys(changes)
+        if flush:
+            self.flush(tenant_id)
+        else:
+            self.discard(tenant_id, *keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(size=len(self._entries), hits=self.hits, misses=self.misses,
+                        evictions=self.evictions)
+
+    # the unnamespaced protocol expected by Interface
+    def get(self, key, default=None):
+        return self.lookup(None, key, default)
+
+    def set(self, key, value):
+        self.store(None, key, value)
+
+    def delete(self, *keys):
+        self.discard(None, *keys)
+
+    def apply_changes(self, changes):
+        self.invalidate(None, changes)
+
+
+class CacheNamespace(object):
+    """
+    The entries of one tenant in a UOPCache
+    """
+
+    def __init__(self, cache, tenant_id):
+        self._cache = cache
+        self.tenant_id = tenant_id
+
+    def get(self, key, default=None):
+        return self._cache.lookup(self.tenant_id, key, default)
+
+    def set(self, key, value):
+        self._cache.store(self.tenant_id, key, value)
+
+    def delete(self, *keys):
+        self._cache.discard(self.tenant_id, *keys)
+
+    def clear(self):
+        self._cache.flush(self.tenant_id)
+
+    def apply_changes(self, changes):
+        self._cache.invalidate(self.tenant_id, changes)
@@ -1,6 +1,7 @@
 __author__ = 'samantha'
 
 from collections import defaultdict
+from sjasoft.utils.category import partition
 from sjasoft.uopmeta import oid
 from sjasoft.uopmeta import attr_info
 from sjasoft.uopmeta.schemas.meta import (kind_map, MetaContext, Schema, as_dict as meta_dict,
@@ -69,15 +70,24 @@ class NoModChanges(ChangeSetComponent):
     def db_not_dup(self, collection, data):
         return not collection.exists(data)
 
+    @staticmethod
+    def association_triple(data):
+        return data.get('subject_id'), data.get('assoc_id'), data.get('object_id')
+
+    def db_not_dups(self, collection, items):
+        """the items not already in collection found with one existence query"""
+        present = collection.existing_associations([self.association_triple(i) for i in items])
+        return [i for i in items if self.association_triple(i) not in present]
+
     def apply_to_db(self, collections):
         coll = self.user_collection(collections)
-        for item in self.inserted:
-            item = dict(item)
-            if self.db_not_dup(coll, item):
-                coll.insert(**item)
-        for item in self.deleted:
-            item = dict(item)
-            coll.remove(item)
+        to_insert = self.db_not_dups(coll, [dict(item) for item in self.inserted])
+        if to_insert:
+            coll.insert_many(to_insert)
+        to_delete = [dict(item) for item in self.deleted]
+        if to_delete:
+            coll.remove_many(to_delete)
+        for item in to_delete:
             self.on_db_delete(item, collections)
 
     def standardized(self, item):
@@ -196,6 +206,14 @@ class NoModChanges(ChangeSetComponent):
     def delete_object_references(cls, collection, objid):
         collection.remove(cls._object_db_filter(objid))
 
+    @classmethod
+    def delete_objects_references(cls, collection, obj_ids):
+        """removes references to any of obj_ids in one removal"""
+        obj_ids = list(obj_ids)
+        if obj_ids:
+            clauses = [{k: {'$in': obj_ids}} for k in cls._object_fields]
+            collection.remove({'$or': clauses} if len(clauses) > 1 else clauses[0])
+
     @classmethod
     def delete_class_references(cls, collection, clsid):
         collection.remove(cls._class_db_filter(clsid))
@@ -303,12 +321,13 @@ class CrudChanges(ChangeSetComponent):
 
     def apply_to_db(self, collections):
         coll = getattr(collections, self.kind)
-        for k, v in self.inserted.items():
-            coll.insert(**v)
-        for k, v in self.modified.items():
-            coll.update_one(k, v)
+        if self.inserted:
+            coll.insert_many(list(self.inserted.values()))
+        if self.modified:
+            coll.update_many(self.modified)
+        if self.deleted:
+            coll.remove_many(list(self.deleted))
         for k in self.deleted:
-            coll.remove(k)
             self.on_db_delete(k, collections)
 
     def delete_from_collections(self, collections, key):
@@ -350,25 +369,20 @@ class ObjectChanges(CrudChanges):
         in_changeset.related.delete_object(identifier)
 
     def apply_to_db(self, collections):
+        """
+        Applies object changes with one bulk operation per class extension
+        and per kind of change.
+        """
+        by_class = lambda ids: partition(ids, oid.oid_class).items()
 
-        colls = {}
-
-        def collection(uuid):
-            cls_id = oid.oid_class(uuid)
-            if not cls_id in colls:
-                colls[cls_id] = collections.class_extension(cls_id)
-            return colls[cls_id]
-
-        for k, v in self.inserted.items():
-            coll = collection(k)
-            coll.insert(**v)
-        for k, v in self.modified.items():
-            coll = collection(k)
-            coll.update({'id': k}, v)
-        for k in self.deleted:
-            coll = collection(k)
-            coll.remove(k)
-            self.db_delete_others(collections, k)
+        for cls_id, ids in by_class(self.inserted):
+            collections.class_extension(cls_id).insert_many([self.inserted[k] for k in ids])
+        for cls_id, ids in by_class(self.modified):
+            collections.class_extension(cls_id).update_many({k: self.modified[k] for k in ids})
+        for cls_id, ids in by_class(self.deleted):
+            collections.class_extension(cls_id).remove_many(ids)
+        if self.deleted:
+            RelatedChanges.delete_objects_references(collections.related, self.deleted)
 
     def on_db_delete(self, uuid, collections):
         collections.related.remove(
@@ -441,6 +455,13 @@ class QueryChanges(CrudChanges):
 class ClassChanges(CrudChanges):
     kind = 'classes'
 
+    def apply_to_db(self, collections):
+        super().apply_to_db(collections)
+        collections.forget_class_extensions(self.deleted)
+        collections.update_class_tables(classes=self)
+        if self.inserted or self.deleted:
+            collections.class_set_changed()
+
     def on_db_delete(self, key, collections):
         filter = lambda fld:{'$regex': {fld: f'^{key}\\.'}}
         obj_check = filter('object_id') 
@@ -463,7 +484,10 @@ class ClassChanges(CrudChanges):
 
 class AttributeChanges(CrudChanges):
     kind = 'attributes'
-    pass
+
+    def apply_to_db(self, collections):
+        super().apply_to_db(collections)
+        collections.update_class_tables(attributes=self)
 
     def db_not_dup(self, collection, data):
         checked_data = dict(name=data['name'], type_id=data['type_id'])
@@ -478,6 +502,7 @@ class ChangeSet(object):
         groups=GroupChanges,
         classes=ClassChanges,
         attributes=AttributeChanges,
+        related=RelatedChanges,
         queries=QueryChanges
     )
 
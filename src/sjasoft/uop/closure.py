@@ -0,0 +1,107 @@
+"""
+Materialized transitive closure of group containment.
+
+Groups contain other groups through related records of the contains_group role, subject the
+containing group and object the contained one.  A TransitiveClosure holds every group's
+descendants and ancestors so groups_in_group and groups_containing_group are single lookups
+instead of one related query per group per level.  The Database keeps one per tenant, built
+with one query on first use and then maintained from each changeset's related inserts and
+deletes.  Containment must stay acyclic so an insert that would close a cycle is rejected
+before anything is written.
+"""
+
+from collections import defaultdict
+from sjasoft.uop.constraints import ConstraintViolation
+
+
+class TransitiveClosure(object):
+    def __init__(self, edges=()):
+        """
+        :param edges: (parent, child) pairs
+        """
+        self._children = defaultdict(set)
+        self._parents = defaultdict(set)
+        self._descendants = defaultdict(set)
+        self._ancestors = defaultdict(set)
+        for parent, child in edges:
+            self.add(parent, child)
+
+    def descendants(self, node):
+        return set(self._descendants.get(node, ()))
+
+    def ancestors(self, node):
+        return set(self._ancestors.get(node, ()))
+
+    def creates_cycle(self, parent, child):
+        return parent == child or parent in self._descendants.get(child, ())
+
+    def add(self, parent, child):
+        if child in self._children.get(parent, ()):
+            return
+        if self.creates_cycle(parent, child):
+            raise ConstraintViolation('acyclic group containment', data={'parent': parent, 'child': child})
+        self._children[parent].add(child)
+        self._parents[child].add(parent)
+        above = self._ancestors[parent] | {parent}
+        below = self._descendants[child] | {child}
+        for node in above:
+            self._descendants[node] |= below
+        for node in below:
+            self._ancestors[node] |= above
+
+    def _reachable(self, start, links):
+        seen = set()
+        pending = list(links.get(start, ()))
+        while pending:
+            node = pending.pop()
+            if node not in seen:
+                seen.add(node)
+                pending.extend(links.get(node, ()))
+        return seen
+
+    def remove(self, parent, child):
+        if child not in self._children.get(parent, ()):
+            return
+        self._children[parent].discard(child)
+        self._parents[child].discard(parent)
+        for node in self._ancestors[parent] | {parent}:
+            self._descendants[node] = self._reachable(node, self._children)
+        for node in self._descendants[child] | {child}:
+            self._ancestors[node] = self._reachable(node, self._parents)
+
+    def check(self, added, removed=()):
+        """
+        Raise ConstraintViolation if adding the added edges after removing the
+        removed ones would make containment cyclic.  The closure is left unchanged.
+        """
+        added = [e for e in added if e[1] not in self._children.get(e[0], ())]
+        if not added:
+            return
+        if removed or len(added) > 1:
+            trial = TransitiveClosure(self.edges())
+            for edge in removed:
+                trial.remove(*edge)
+            for edge in added:
+                trial.add(*edge)
+        elif self.creates_cycle(*added[0]):
+            raise ConstraintViolation('acyclic group containment',
+                                      data={'parent': added[0][0], 'child': added[0][1]})
+
+    def update(self, added, removed=()):
+        for edge in removed:
+            self.remove(*edge)
+        for edge in added:
+            self.add(*edge)
+
+    def edges(self):
+        return [(parent, child) for parent, children in self._children.items() for child in children]
+
+
+def role_edges(items, role_id):
+    """(subject_id, object_id) pairs of the related items of role_id"""
+    res = []
+    for item in items:
+        data = dict(item)
+        if data.get('assoc_id') == role_id:
+            res.append((data['subject_id'], data['object_id']))
+    return res
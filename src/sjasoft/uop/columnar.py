@@ -0,0 +1,80 @@
+"""
+Column-wise evaluation of single attribute predicates over loaded objects.
+
+Query evaluation that already holds candidate object ids loads the candidates of each class
+in bulk and filters them here instead of testing one object at a time.  The attribute is
+projected into a column and the comparison applied to the whole column.  When numpy is
+installed and the column and comparison value are numeric the comparison is a single
+vector operation.  Otherwise the compiled criteria predicate is mapped over the column.
+"""
+
+from numbers import Number
+from sjasoft.uop import criteria as crit
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional
+    np = None
+
+vector_ops = {
+    'eq': lambda col, v: col == v,
+    'ne': lambda col, v: col != v,
+    'gt': lambda col, v: col > v,
+    'gte': lambda col, v: col >= v,
+    'lt': lambda col, v: col < v,
+    'lte': lambda col, v: col <= v,
+}
+
+
+float_exact = 2 ** 53  # larger ints do not survive conversion to float
+
+
+def is_numeric(value):
+    return isinstance(value, Number) and not isinstance(value, bool)
+
+
+def column(docs, attr_name, id_field='id'):
+    """
+    :param docs: object dicts
+    :param attr_name: attribute to project
+    :return: list of object ids, list of attribute values with criteria.missing where absent
+    """
+    ids = [d.get(id_field, d.get('_id')) for d in docs]
+    values = [d.get(attr_name, crit.missing) for d in docs]
+    return ids, values
+
+
+def _vector_mask(values, op, value):
+    """boolean numpy mask of values satisfying op or None if the column is not numeric"""
+    if np is None or op not in vector_ops or not is_numeric(value):
+        return None
+    if not all(is_numeric(v) or v is crit.missing or v is None for v in values):
+        return None
+    if any(isinstance(v, int) and abs(v) > float_exact for v in values + [value]):
+        return None
+    present = np.fromiter((is_numeric(v) for v in values), dtype=bool, count=len(values))
+    col = np.fromiter((v if is_numeric(v) else 0 for v in values), dtype=float, count=len(values))
+    mask = vector_ops[op](col, value)
+    if op == 'ne':
+        return mask | ~present
+    return mask & present
+
+
+def select(ids, values, op, value):
+    """
+    ids whose corresponding value satisfies op against value.
+    :param op: normalized operator name as in criteria.operator_names values
+    """
+    mask = _vector_mask(values, op, value)
+    if mask is not None:
+        return {i for i, ok in zip(ids, mask.tolist()) if ok}
+    test = crit.comparison(op, value)
+    return {i for i, v in zip(ids, values) if test(v)}
+
+
+def filter_objects(docs, attr_name, operator, value, id_field='id'):
+    """
+    Ids of the docs whose attr_name satisfies the criteria operator, e.g. '$gt', against value.
+    """
+    ids, values = column(docs, attr_name, id_field=id_field)
+    return select(ids, values, crit.operator_names[operator], value)
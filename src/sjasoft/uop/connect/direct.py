@@ -226,9 +226,11 @@ class DirectConnection(generic.GenericConnection):
     def delete_attribute(self, attr_id):
         return self.dbi.delete_attribute(attr_id)
 
-    def run_query(self, query_id=None, query=None):
+    def run_query(self, query_id=None, query=None, limit=None, continuation=None):
         the_query = self.dbi.queries.get(query_id) if query_id else query
-        return self.dbi.query(query)
+        if limit:
+            return self.dbi.query_page(the_query, limit, continuation)
+        return self.dbi.query(the_query)
 
     def bulk_load(self, ids, perserve_order=True):
         return self.dbi.bulk_load(ids, perserve_order)
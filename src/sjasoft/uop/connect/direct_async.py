@@ -187,9 +187,11 @@ class AsyncDBClient(direct.DirectConnection):
     async def delete_attribute(self, attr_id):
         return await self.dbi.delete_attribute(attr_id)
 
-    async def run_query(self, query_id=None, query=None):
+    async def run_query(self, query_id=None, query=None, limit=None, continuation=None):
         the_query = (await self.dbi.queries.get(query_id)) if query_id else query
-        return await self.dbi.query(query)
+        if limit:
+            return await self.dbi.query_page(the_query, limit, continuation)
+        return await self.dbi.query(the_query)
 
     async def bulk_load(self, ids, perserve_order=True):
         return await self.dbi.bulk_load(ids, perserve_order)
@@ -190,7 +190,11 @@ class GenericConnection():
     def delete_attribute(self, attr_id):
         pass
 
-    def run_query(self, query_id=None, query=None):
+    def run_query(self, query_id=None, query=None, limit=None, continuation=None):
+        """
+        ids satisfying the saved query or the query given.  With a limit the result
+        is a page (ids, continuation) continuing from continuation.
+        """
         pass
 
     def bulk_load(self, ids, items_only=True):
@@ -33,8 +33,8 @@ class WebConnection(generic.GenericConnection):
         res = self._session.get(self._make_url(*path))
         return res.json()
 
-    def post(self, *path, data):
-        res = self._session.post(self._make_url(*path), json=data)
+    def post(self, *path, data, **params):
+        res = self._session.post(self._make_url(*path), json=data, params=params or None)
         return res.json()
 
     def put(self, *path, data):
@@ -137,7 +137,7 @@ class WebConnection(generic.GenericConnection):
         return self.put('related-objects', object_id, role_id, data=object_ids)
 
     def set_related_objects(self, object_id, role_id, object_ids):
-        return self.post('related-objects', object_id, role_id, data=object_ids)wvbm 
+        return self.post('related-objects', object_id, role_id, data=object_ids)
 
     def get_tagged(self, tag_id):
         return self.get('tagged', tag_id)
@@ -229,16 +229,23 @@ class WebConnection(generic.GenericConnection):
     def delete_attribute(self, attr_id):
         return self.delete('tags', attr_id)
 
-    def run_query(self, query_id=None, query=None):
+    def run_query(self, query_id=None, query=None, limit=None, continuation=None):
         args = ['run_query']
+        params = {}
+        if limit:
+            params['limit'] = limit
+            if continuation:
+                params['continuation'] = continuation
         if query_id:
             args.append(query_id)
-            self.post(*args, data={})
+            res = self.post(*args, data={}, **params)
         elif query:
-            args.append(query)
-            return self.post(*args, data=query)
+            res = self.post(*args, data=query, **params)
         else:
             raise Exception('Either query_id or query must be specified')
+        if limit:
+            return res['ids'], res.get('continuation')
+        return res
 
     def bulk_load(self, ids):
         return self.post('bulk-load', data={'ids': ids})
@@ -0,0 +1,168 @@
+"""
+Backend neutral handling of the criteria dicts passed to DBCollection.find and friends.
+
+Criteria come in a few shapes that are used interchangeably across uop:
+    {field: value}                        equality, several keys are ANDed
+    {field: {'$gt': value, ...}}          field first, mongo style
+    {'$gt': {field: value}}               operator first, as built by query.Q
+    {'$and': [...]}, {'$or': [...]}       compound clauses
+    {'$not': criteria}                    negation
+
+normalize reduces all of these to a small tree of tuples:
+    ('and', [node...]), ('or', [node...]), ('not', node), ('cmp', field, op, value)
+which concrete adaptors can either evaluate directly (matcher) or translate.
+"""
+
+import re
+
+ALL = ('and', [])
+
+operator_names = {
+    '$eq': 'eq',
+    '$ne': 'ne',
+    '$neq': 'ne',
+    '$gt': 'gt',
+    '$gte': 'gte',
+    '$lt': 'lt',
+    '$lte': 'lte',
+    '$in': 'in',
+    '$nin': 'nin',
+    '$regex': 'regex',
+    '$exists': 'exists',
+}
+
+range_ops = ('gt', 'gte', 'lt', 'lte')
+
+missing = object()  # stands for a field absent from a document
+
+
+def field_name(name):
+    return 'id' if name == '_id' else name
+
+
+def _is_operator_dict(value):
+    return isinstance(value, dict) and value and all(
+        isinstance(k, str) and k.startswith('$') for k in value)
+
+
+def _compound(kind, nodes):
+    return nodes[0] if len(nodes) == 1 else (kind, nodes)
+
+
+def normalize(criteria):
+    """
+    Reduce a criteria dict to its normal tree form.
+    :param criteria: criteria dict or None (meaning everything)
+    :return: normalized node
+    """
+    if not criteria:
+        return ALL
+    nodes = []
+    for key, value in criteria.items():
+        if key == '$and':
+            nodes.append(_compound('and', [normalize(c) for c in value]))
+        elif key == '$or':
+            nodes.append(('or', [normalize(c) for c in value]))
+        elif key == '$not':
+            nodes.append(('not', normalize(value)))
+        elif key in operator_names:
+            op = operator_names[key]
+            nodes.extend(('cmp', field_name(f), op, v) for f, v in value.items())
+        elif _is_operator_dict(value):
+            for op_key, v in value.items():
+                if op_key not in operator_names:
+                    raise Exception(f'unknown criteria operator {op_key} in {criteria}')
+                nodes.append(('cmp', field_name(key), operator_names[op_key], v))
+        else:
+            nodes.append(('cmp', field_name(key), 'eq', value))
+    return _compound('and', nodes)
+
+
+def referenced_fields(node):
+    """set of fields a normalized criteria tests"""
+    kind = node[0]
+    if kind == 'cmp':
+        return {node[1]}
+    if kind == 'not':
+        return referenced_fields(node[1])
+    res = set()
+    for child in node[1]:
+        res |= referenced_fields(child)
+    return res
+
+
+def _regex(pattern):
+    return pattern if isinstance(pattern, re.Pattern) else re.compile(pattern)
+
+
+def _value_set(values):
+    values = list(values)
+    try:
+        return set(values)
+    except TypeError:
+        return values
+
+
+def _member(actual, values):
+    try:
+        return actual in values
+    except TypeError:
+        return any(actual == v for v in values)
+
+
+def comparison(op, value):
+    """predicate testing a field value, or missing, against value by op"""
+    def ordered(test):
+        def check(actual):
+            if actual is missing or actual is None:
+                return False
+            try:
+                return test(actual)
+            except TypeError:
+                return False
+        return check
+
+    if op == 'eq':
+        return lambda actual: (actual if actual is not missing else None) == value
+    if op == 'ne':
+        return lambda actual: (actual if actual is not missing else None) != value
+    if op == 'gt':
+        return ordered(lambda actual: actual > value)
+    if op == 'gte':
+        return ordered(lambda actual: actual >= value)
+    if op == 'lt':
+        return ordered(lambda actual: actual < value)
+    if op == 'lte':
+        return ordered(lambda actual: actual <= value)
+    if op == 'in':
+        values = _value_set(value)
+        return lambda actual: actual is not missing and _member(actual, values)
+    if op == 'nin':
+        values = _value_set(value)
+        return lambda actual: actual is missing or not _member(actual, values)
+    if op == 'regex':
+        pattern = _regex(value)
+        return lambda actual: isinstance(actual, str) and bool(pattern.search(actual))
+    if op == 'exists':
+        return lambda actual: (actual is not missing) == bool(value)
+    raise Exception(f'unsupported criteria operation {op}')
+
+
+def matcher(node):
+    """
+    Compile a normalized criteria into a predicate over dicts.
+    :param node: normalized criteria
+    :return: function of one dict returning truthiness of match
+    """
+    kind = node[0]
+    if kind == 'cmp':
+        _, field, op, value = node
+        test = comparison(op, value)
+        return lambda doc: test(doc.get(field, missing))
+    if kind == 'not':
+        inner = matcher(node[1])
+        return lambda doc: not inner(doc)
+    children = [matcher(c) for c in node[1]]
+    if kind == 'and':
+        return lambda doc: all(fn(doc) for fn in children)
+    return lambda doc: any(fn(doc) for fn in children)
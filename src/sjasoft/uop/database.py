@@ -21,8 +21,14 @@
 """
 
 from sjasoft.uop import db_collection as db_coll
+from collections import deque
 from sjasoft.uop.collections import uop_collection_names
+from sjasoft.uop.constraints import ConstraintViolation
 from sjasoft.uop import changeset
+from sjasoft.uop.query_cache import DataVersions, QueryResultCache
+from sjasoft.uop import meta_state
+from sjasoft.uop.closure import TransitiveClosure, role_edges
+from sjasoft.uop.idsets import IdInterner, ExtensionBitmaps
 from sjasoft.uopmeta.schemas import meta
 from sjasoft.utils import decorations
 from sjasoft.utils import cw_logging, index
@@ -46,6 +52,7 @@ class Database(object):
     database_by_id = {}
     _meta_id_tree = None
     db_info_collection = 'uop_database'
+    db_info_id = 'database_info'  # key of the info record, the same for every Database on a store
 
     _index = index.Index('database', 48)
 
@@ -89,6 +96,16 @@ class Database(object):
         self._users = None
         self._tenant_map = {}
         self._base_collections_collected = False
+        self._data_versions = {}
+        self._meta_versions = {}
+        self._group_closures = {}
+        self._id_interners = {}
+        self._extension_bitmaps = {}
+        self._class_set_version = 0
+        self._extensions_version = None
+        self.last_logged = None
+        self.logged_times = deque(maxlen=1000)  # timestamps of the changesets logged here, newest last
+        self.query_results = QueryResultCache()
         self.open_db()
 
     @property
@@ -198,12 +215,15 @@ class Database(object):
         return self.get_managed_collection(self.new_collection_name())
 
     def database_collection(self):
-        return self.collections._collections.get('databases')
+        collections = self.collections
+        if collections._collections.get('databases') is None:
+            collections.ensure_basic_collections()  # a store opened again is not set up by open_db
+        return collections._collections.get('databases')
 
     def db_info(self):
         if not self._db_info:
             db = self.database_collection()
-            self._db_info = db.get(self._id)
+            self._db_info = db.get(self.db_info_id)
         return self._db_info
 
     def has_tenants(self):
@@ -212,10 +232,39 @@ class Database(object):
     def ensure_database_info(self):
         db_info = self.db_info()
         db = self.database_collection()
+        if not db_info and db is not None:
+            try:
+                db.insert(id=self.db_info_id, tenancy=self._tenancy, class_set_version=0)
+            except ConstraintViolation:
+                pass  # inserted meanwhile through another Database on the store
+            db_info = self.db_info()
         if not db_info:
             db_info = meta.Database(tenancy=self._tenancy)
+        if isinstance(db_info, dict):
+            self._class_set_version = db_info.get('class_set_version', 0)
         return db_info
 
+    def class_set_version(self):
+        """count of changesets that added or removed classes, kept in the database info"""
+        return self._class_set_version
+
+    def stored_class_set_version(self):
+        """class set version in the database info, where other processes bump it as well"""
+        db = self.database_collection()
+        info = db.get(self.db_info_id) if db is not None else None
+        return info.get('class_set_version', 0) if info else 0
+
+    def refresh_class_set_version(self):
+        """take up class set changes other processes saved since this one last looked"""
+        self._class_set_version = max(self._class_set_version, self.stored_class_set_version())
+
+    def bump_class_set_version(self):
+        self.refresh_class_set_version()
+        self._class_set_version += 1
+        db = self.database_collection()
+        if db is not None:
+            db.update_one(self.db_info_id, {'class_set_version': self._class_set_version})
+
     def ensure_apps(self):
         pass
 
@@ -264,9 +313,17 @@ class Database(object):
         have an issue if there is an attempt to change database structure (e.g.,
         creating a new table) while a transaction is in progress.  This method
         should be called before entering a long transaction to avoid this problem.
+        Classes are only scanned when the class set version, re-read from the database info,
+        moved since the last time.
         :return:
         """
-        self.collections.ensure_class_extensions()
+        self.refresh_class_set_version()
+        self._ensure_extensions_for(self.class_set_version())
+
+    def _ensure_extensions_for(self, version):
+        if self._extensions_version != version:
+            self.collections.ensure_class_extensions()
+            self._extensions_version = version
 
     def start_long_transaction(self):
         pass
@@ -317,6 +374,19 @@ class Database(object):
                                    changes=changeset.to_dict())
         coll = self.get_collection('changes')
         coll.insert(**changes.dict())
+        self.last_logged = changes.timestamp
+        self.logged_times.append(changes.timestamp)
+
+    def latest_change_time(self):
+        """timestamp of the newest logged changeset or None"""
+        coll = self.get_collection('changes')
+        found = coll.find(only_cols=['timestamp'], order_by=['-timestamp'], limit=1)
+        return found[0] if found else None
+
+    def change_times_since(self, epochtime):
+        """timestamps of the changesets logged after epochtime"""
+        coll = self.get_collection('changes')
+        return coll.find({'timestamp': {'$gt': epochtime}}, only_cols=['timestamp'])
 
     def changes_since(self, epochtime, tenant_id, client_id=None):
         client_id = client_id or 0
@@ -349,7 +419,89 @@ class Database(object):
         meta = self.collections.metadata()
 
 
+    def data_versions(self, tenant_id=None):
+        """the DataVersions of the tenant used to validate cached query results"""
+        versions = self._data_versions.get(tenant_id)
+        if versions is None:
+            versions = self._data_versions.setdefault(tenant_id, DataVersions())
+        return versions
+
+    def id_interner(self, tenant_id=None):
+        """the IdInterner numbering the ids of the tenant for the IdSets of query evaluation"""
+        interner = self._id_interners.get(tenant_id)
+        if interner is None:
+            interner = self._id_interners.setdefault(tenant_id, IdInterner())
+        return interner
+
+    def extension_bitmaps(self, tenant_id=None):
+        """the ExtensionBitmaps of the tenant, over its IdInterner"""
+        bitmaps = self._extension_bitmaps.get(tenant_id)
+        if bitmaps is None:
+            bitmaps = self._extension_bitmaps.setdefault(
+                tenant_id, ExtensionBitmaps(self.id_interner(tenant_id)))
+        return bitmaps
+
+    def meta_version(self, tenant_id=None):
+        """count of changesets with metadata changes applied for the tenant"""
+        return self._meta_versions.get(tenant_id, 0)
+
+    def _bump_meta_version(self, changeset, tenant_id):
+        if meta_state.changed_kinds(changeset):
+            self._meta_versions[tenant_id] = self.meta_version(tenant_id) + 1
+
+    def forget_tenant_state(self, tenant_id=None):
+        """
+        Drop what was derived from the tenant's data once it has been changed through another
+        Database: cached query results, the metadata version, the group closure and the
+        extension bitmaps.
+        """
+        self.data_versions(tenant_id).bump()
+        self._meta_versions[tenant_id] = self.meta_version(tenant_id) + 1
+        self._group_closures.pop(tenant_id, None)
+        self._extension_bitmaps.pop(tenant_id, None)
+
+    def group_closure(self, collections):
+        """
+        The transitive closure of group containment for the tenant of collections,
+        loaded with one query on first use.
+        :return: contains_group role id, TransitiveClosure
+        """
+        tenant_id = collections.tenant_id
+        entry = self._group_closures.get(tenant_id)
+        if entry is None:
+            role_id = collections.roles.by_name.get('contains_group')
+            edges = collections.related.find({'assoc_id': role_id}, only_cols=['subject_id', 'object_id']) \
+                if role_id else []
+            closure = TransitiveClosure((e['subject_id'], e['object_id']) for e in edges)
+            entry = self._group_closures[tenant_id] = (role_id, closure)
+        return entry
+
+    def _checked_group_edges(self, changeset, collections):
+        """
+        Group containment edges the changeset adds and removes after checking they keep
+        containment acyclic, or None if it does not change containment.
+        """
+        related = changeset.related
+        if not (related.inserted or related.deleted):
+            return None
+        role_id, closure = self.group_closure(collections)
+        added = role_edges(related.inserted, role_id)
+        removed = role_edges(related.deleted, role_id)
+        if not (added or removed):
+            return None
+        closure.check(added, removed)
+        return closure, added, removed
+
+    def _update_group_closure(self, changeset, collections, group_edges):
+        if changeset.groups.deleted or changeset.roles.has_changes():
+            # group deletes remove containment records the changeset does not list
+            self._group_closures.pop(collections.tenant_id, None)
+        elif group_edges:
+            closure, added, removed = group_edges
+            closure.update(added, removed)
+
     def apply_changes(self, changeset, collections):
+        group_edges = self._checked_group_edges(changeset, collections)
         self.begin_transaction()
         changeset.attributes.apply_to_db(collections)
         changeset.classes.apply_to_db(collections)
@@ -361,6 +513,9 @@ class Database(object):
         changeset.queries.apply_to_db(collections)
         self.log_changes(changeset)
         self.commit()
+        self.data_versions(collections.tenant_id).bump(changeset)
+        self._bump_meta_version(changeset, collections.tenant_id)
+        self._update_group_closure(changeset, collections, group_edges)
 
     def really_commit(self):
         pass
@@ -1,15 +1,18 @@
 __author__ = 'samantha'
 
 from functools import partial
-from sjasoft.uop import tenant
+from sjasoft.utils.category import binary_partition
+from sjasoft.uop import tenant, paging
+from sjasoft.uop import instrumentation as instr
 from sjasoft.uop.collections import uop_collection_names, meta_kinds, assoc_kinds, per_tenant_kinds, cls_extension_field
 from sjasoft.uop.constraints import ConstraintViolation
 from collections import deque
-import datetime
 shared_collections = meta_kinds
+assoc_collection_names = {uop_collection_names[k] for k in assoc_kinds}
 
 
 class DatabaseCollections(object):
+    instrumentation = instr.default
 
     def __getattr__(self, name):
         return self._collections[name]
@@ -23,13 +26,19 @@ class DatabaseCollections(object):
 
         self._db = self._tenancy.database()
         self._tenant_condition = self._tenancy.with_tenant
+        self._class_table = None
+        self._attribute_table = None
+        self._class_names = None
+        self._expanded = {}
         self._extensions = self._get_extensions()
         self._other = {}
 
-
+    @property
+    def tenant_id(self):
+        return self._tenant_id
 
     def extension(self, cls):
-        return cls[cls_extension_field]
+        return cls.get(cls_extension_field)
 
     def set_extension(self, cls, val):
         if self.extension(cls) != val:
@@ -41,41 +50,48 @@ class DatabaseCollections(object):
         cls['extension'] = extension
 
     def _save_class_extension(self, cls, extension):
-        cls['extension'] = extension
-        if not self._tenant_id:
-            cls[cls_extension_field] = extension.name
         cid = cls['id']
-        current = self.extension(cls)
-        name = extension.name
-        renamed = current != name
         if self._tenant_id:
-            self._extensions[cid] = name
-            extension_names = {k: v['name'] for k, v in self._extensions.items()}
-            self._save_tenant_extensions(extension_names)
+            cls['extension'] = extension
+            self._extensions[cid] = extension
+            self._save_tenant_extensions(self._extension_names())
         else:
+            current = cls.get(cls_extension_field)
             self._set_class_extension(cls, extension)
-            if renamed:
-                cls[cls_extension_field] = name
-                self.classes.update_one(cls['id'], {cls_extension_field: name})
+            if current != extension.name:
+                self.classes.update_one(cid, {cls_extension_field: extension.name})
+
+    def _extension_names(self):
+        return {k: v.name for k, v in self._extensions.items()}
 
     def _save_tenant_extensions(self, extensions):
-        self._db.tenants().update_one(self._tenant_id, {'extensions': extensions})
+        self._db.tenants().update_one(self._tenant_id, {'cls_extensions': extensions})
 
-    def get_class_extension(self, cls, output=None):
+    def _recorded_extension(self, cls):
+        """
+        the extension recorded for cls, in the cls_extensions of the tenant or else in cls itself,
+        as the name saved in instance_collection once reloaded
+        """
+        if self._tenant_id:
+            tenant = self._db.get_tenant(self._tenant_id) or {}
+            name = (tenant.get('cls_extensions') or {}).get(cls['id'])
+            return self._db.get_managed_collection(name) if name else None
+        known = cls.get('extension')
+        if not known and cls.get(cls_extension_field):
+            known = self.get(cls[cls_extension_field])
+        return known
+
+    def get_class_extension(self, cls):
         cid = cls['id']
         known = self._extensions.get(cid)
         if not known:
-            if not self._tenant_id:
-                known = cls.get('extension')
+            known = self._recorded_extension(cls)
             if not known:
-                known = self._db.get_instance_collection(self.expanded_class(cls))
-                if output:
-                    print(cls['name'], known.name, file=output)
-                else:
-                    with open('extra_extension.txt', 'a') as f:
-                        print(cls['name'], known.name, file=f)
-
-                self._save_class_extension(cls, known)
+                with self.instrumentation.timed('extensions.create'):
+                    known = self._db.get_instance_collection(self.expanded_class(cls))
+                    self._save_class_extension(cls, known)
+                self.instrumentation.event('extensions.created', cls_id=cid, cls_name=cls.get('name'),
+                                           collection=known.name, tenant_id=self._tenant_id)
             self._extensions[cid] = known
         return known
 
@@ -90,7 +106,7 @@ class DatabaseCollections(object):
         changed = False
         if self._tenant_id:
             tenant = self._db.get_tenant(self._tenant_id)
-            db_extensions = tenant.get('cls_extensions')
+            db_extensions = tenant.get('cls_extensions') or {}
             changed = False
             for cls_id, coll_name in db_extensions.items():
                 coll = self._db.get_managed_collection(coll_name)
@@ -102,7 +118,7 @@ class DatabaseCollections(object):
                 res[cid] = self.get_class_extension(cls)
                 changed = True
         if changed and self._tenant_id:
-            self._save_tenant_extensions(res)
+            self._save_tenant_extensions({k: v.name for k, v in res.items()})
         return res
 
     def collection_name_map(self):
@@ -110,16 +126,16 @@ class DatabaseCollections(object):
         return {n: getattr(self, n).name for n in col_names}
 
     def ensure_class_extensions(self):
-        classes = self.classes.find()
-        with open('extensions.txt', 'a') as f:
-            print([(c['id'], c['name']) for c in classes], file=f)
-            print(datetime.datetime.now(), file=f)
-            for cls in classes:
-                if not cls['id'] in self._extensions:
-                    self.get_class_extension(cls, output=f)
-                    ext = self._extensions[cls['id']]
-                    print(cls['name'], ext.name, file=f)
-                    assert cls['id'] in self._extensions
+        with self.instrumentation.timed('extensions.ensure'):
+            classes = self.classes.find()
+            self._class_table = {c['id']: dict(c) for c in classes}
+            self._class_names = None
+            self._expanded.clear()
+            missing = [cls for cls in classes if cls['id'] not in self._extensions]
+            for cls in missing:
+                self.get_class_extension(cls)
+        self.instrumentation.event('extensions.ensured', instr.DEBUG, classes=len(classes),
+                                   created=len(missing), tenant_id=self._tenant_id)
 
     def ensure_basic_collections(self, col_map=None):
         """
@@ -177,26 +193,88 @@ class DatabaseCollections(object):
         for col in collections:
             col.drop()
 
+    def _class_tables(self):
+        """classes and attributes by id, read once and then kept by update_class_tables"""
+        if self._class_table is None:
+            self._class_table = {c['id']: dict(c) for c in self.classes.find()}
+        if self._attribute_table is None:
+            self._attribute_table = {a['id']: a for a in self.attributes.find()}
+        if self._class_names is None:
+            self._class_names = {c['name']: c for c in self._class_table.values()}
+        return self._class_names, self._attribute_table
+
     def expanded_class(self, cls):
-        by_name = {c['name']: c for c in self.classes.find()}
-        attrs = {a['id']:a for a in self.attributes.find()}
+        """
+        cls with the attrs of its superclasses prepended and the attribute records of all
+        of them as attributes.  Results are kept per class until a ClassChanges or
+        AttributeChanges touching the class or one of its superclasses is applied.
+        """
+        found = self._expanded.get(cls['id'])
+        if found is not None:
+            return found[1]
+        by_name, attrs = self._class_tables()
         expand_attrs = deque(cls['attrs'])
+        chain = {cls['id']}
         super = cls['superclass']
-        if not super:
-            return cls
-        while super:
-            s_cls = by_name[super]
-            expand_attrs.extendleft(s_cls['attrs'])
-            super = s_cls['superclass']
-        res = dict(cls)
-        res['attrs'] = list(expand_attrs)
-        res['attributes'] = [attrs[a] for a in expand_attrs]
+        res = cls
+        if super:
+            while super:
+                s_cls = by_name[super]
+                chain.add(s_cls['id'])
+                expand_attrs.extendleft(s_cls['attrs'])
+                super = s_cls['superclass']
+            res = dict(cls)
+            res['attrs'] = list(expand_attrs)
+            res['attributes'] = [attrs[a] for a in expand_attrs]
+        self._expanded[cls['id']] = (chain, set(expand_attrs), res)
         return res
 
+    def update_class_tables(self, classes=None, attributes=None):
+        """
+        Apply the changes of a ClassChanges and an AttributeChanges to the class and attribute
+        tables and drop the expanded classes they affect.
+        """
+        stale_classes, stale_attrs = set(), set()
+        if classes is not None:
+            self._class_names = None
+        for changes, table, stale in ((classes, self._class_table, stale_classes),
+                                      (attributes, self._attribute_table, stale_attrs)):
+            if changes is None:
+                continue
+            stale.update(changes.inserted, changes.modified, changes.deleted)
+            if table is None:
+                continue
+            for an_id, data in changes.inserted.items():
+                table[an_id] = dict(data)
+            for an_id, mods in changes.modified.items():
+                if an_id in table:
+                    table[an_id].update(mods)
+            for an_id in changes.deleted:
+                table.pop(an_id, None)
+        for cid, (chain, attr_ids, _) in list(self._expanded.items()):
+            if chain & stale_classes or attr_ids & stale_attrs:
+                del self._expanded[cid]
+
 
     def class_extension(self, cls_id):
-        cls = self.classes.get(cls_id)
-        return self.get_class_extension(cls)
+        """
+        The collection of the instances of cls_id.  The extensions of all classes are
+        registered by ensure_basic_collections so only a class not seen since, or deleted
+        by a ClassChanges, is looked up.
+        """
+        known = self._extensions.get(cls_id)
+        if not known:
+            known = self.get_class_extension(self.classes.get(cls_id))
+        return known
+
+    def class_set_changed(self):
+        """note classes were added or removed so extensions are checked on the next transaction"""
+        self._db.bump_class_set_version()
+
+    def forget_class_extensions(self, cls_ids):
+        """drop cls_ids from the registry of extensions so they are looked up again on next use"""
+        for cls_id in cls_ids:
+            self._extensions.pop(cls_id, None)
 
     def _collection_tenant_condition(self, name):
         # TODO (sja) this cannot work for database per tenant
@@ -342,6 +420,63 @@ class DBCollection(object):
     def insert(self, **fields):
         pass
 
+    def insert_many(self, items):
+        """
+        Insert several records.  Adaptors should override this to use a single
+        round trip to the underlying store.
+        :param items: sequence of record dicts
+        :return: list of inserted records
+        """
+        return [self.insert(**item) for item in items]
+
+    def update_one(self, an_id, mods):
+        return self.update({'id': an_id}, mods)
+
+    def update_many(self, mods_by_id):
+        """
+        Apply modifications to several records.
+        :param mods_by_id: dict of record id to modifications for that record
+        :return: None
+        """
+        for an_id, mods in mods_by_id.items():
+            self.update_one(an_id, mods)
+
+    def remove_many(self, keys):
+        """
+        Remove several records in at most two removals
+        :param keys: record ids and/or criteria dicts
+        :return: None
+        """
+        criteria, ids = binary_partition(keys, lambda k: isinstance(k, dict))
+        if ids:
+            self.remove({'id': {'$in': ids}})
+        if criteria:
+            self.remove(criteria[0] if len(criteria) == 1 else {'$or': criteria})
+
+    association_fields = ('subject_id', 'assoc_id', 'object_id')
+
+    @property
+    def key_fields(self):
+        """fields that together identify a record.  Associations have no id of their own."""
+        if self.name in assoc_collection_names:
+            return self.association_fields
+        return (self.ID_Field,)
+
+    def existing_associations(self, triples):
+        """
+        Find which of a batch of associations are already present with one query
+        :param triples: sequence of (subject_id, assoc_id, object_id) tuples
+        :return: set of the given triples that are already in the collection
+        """
+        triples = {tuple(t) for t in triples}
+        if not triples:
+            return set()
+        fields = self.association_fields
+        values = [list({t[i] for t in triples if t[i] is not None}) for i in range(len(fields))]
+        criteria = {f: {'$in': v} for f, v in zip(fields, values) if v}
+        found = self.find(criteria, only_cols=list(fields))
+        return {tuple(r.get(f) for f in fields) for r in found} & triples
+
     def bulk_load(self, *ids):
         pass
 
@@ -367,6 +502,33 @@ class DBCollection(object):
                    order_by=None, limit=None, ids_only=False):
         return []
 
+    def find_page(self, criteria=None, order_by=None, limit=100, continuation=None, only_cols=None):
+        """
+        One page of the records satisfying criteria in order_by order, ties broken by key_fields.
+        :param continuation: token returned with the previous page or None for the first page
+        :return: (records, continuation for the next page or None after the last page)
+        """
+        fields = paging.sort_fields(order_by, self.key_fields)
+        fetched = paging.fetch_columns(only_cols, fields)
+        records = self.find(paging.page_criteria(criteria, fields, continuation),
+                            only_cols=fetched, order_by=fields, limit=limit)
+        return paging.page(records, only_cols, fetched, fields, limit)
+
+    def find_iter(self, criteria=None, only_cols=None, order_by=None, batch_size=1000):
+        """
+        Iterate over the records satisfying criteria fetching batch_size records at a time.
+        This default reads successive pages so only one batch is in memory.  Adaptors with
+        server side cursors should override it.
+        :param only_cols: columns to return, a single column giving its values as in find
+        :return: iterator of records
+        """
+        continuation = None
+        while True:
+            records, continuation = self.find_page(criteria, order_by, batch_size, continuation, only_cols)
+            yield from records
+            if continuation is None:
+                return
+
     def all(self):
         return self.find()
 
@@ -402,7 +564,7 @@ class DBCollection(object):
         records in the collection
         :return: the mapping
         """
-        return {x['_id']: x for x in self.find()}
+        return {x[self.ID_Field]: x for x in self.find_iter()}
 
     def instances(self):
         return self.find()
@@ -1,10 +1,13 @@
 
 from sjasoft.uop import changeset
+from sjasoft.uop.cache import UOPCache, roleset_key
 from sjasoft.utils.category import binary_partition, partition
 from sjasoft.utils.tools import match_fields
 from sjasoft.web.url import is_url
-from sjasoft.utils.data import recurse_set
 from sjasoft.uop import query as query_module
+from sjasoft.uop.query_plan import QueryPlanner
+from sjasoft.uop import query_cache, paging, meta_state, group_commit
+from sjasoft.uop.hierarchy import Hierarchy
 from sjasoft.uopmeta.schemas.meta import MetaContext, Grouped, Tagged, \
     Related, kind_map, BaseModel, MetaQuery, ClassComponent, AttributeComponent, AndQuery, OrQuery
 
@@ -15,6 +18,7 @@ from sjasoft.uop.exceptions import NoSuchObject
 from collections import defaultdict
 from functools import reduce
 
+import copy
 import re
 import asyncio
 from contextlib import contextmanager
@@ -24,14 +28,9 @@ def as_dict(data):
         return data.dict()
     return dict(data)
 
-@contextmanager
 def changes(obj):
-    changes = obj._changeset or changeset.ChangeSet()
-    yield changes
-    if not obj._changeset:
-        if obj._cache:
-            obj._cache.apply_changes(changes)
-        obj._db.apply_changes(changes, obj._db.collections)
+    """the changes context of the Interface obj, see Interface.changes"""
+    return obj.changes()
 
 
 def get_tenant_interface(db, tenant_id):
@@ -47,6 +46,24 @@ def get_tenant_interface(db, tenant_id):
     return dbi
 
 
+class shared_state(object):
+    """
+    Interface attribute kept by the Interface its sessions were made from, so that all of
+    them read and maintain one value.
+    """
+
+    def __set_name__(self, owner, name):
+        self._name = '_shared' + name
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        return getattr(obj.__dict__.get('_origin', obj), self._name, None)
+
+    def __set__(self, obj, value):
+        setattr(obj.__dict__.get('_origin', obj), self._name, value)
+
+
 class Interface(object):
     """
     All the major externally facing functionality of UOP should be available here.
@@ -56,45 +73,145 @@ class Interface(object):
     Passing a user works well with this choice in that the tenantDatabase wrapper allowing access
     to only the tenants data is set up around the database.  This is very convenient for servers
     handling requests for multiple tenants.
-    Similarly a cache should be shared across requests to a process.
+    Similarly a cache should be shared across requests to a process.  A shared UOPCache
+    is used through the namespace of the interface's tenant.
+    Concurrent callers of one tenant should each use a session of a shared Interface.
     """
     _db = None
     _cache = None
+    _metadata = shared_state()
+    _context = shared_state()
+    _hierarchy = shared_state()
 
     def __init__(self, db, cache=None, tenant_id=None):
         self._db = db
         self._tenant = tenant_id
-        self._cache = cache
+        self._cache = cache.namespace(tenant_id) if isinstance(cache, UOPCache) else cache
         self._collections_ready = not tenant_id
         self._collections = None
         self._changeset = None
         self._metadata = None
         self._context = None
+        self._hierarchy = None
+        self._query_planner = QueryPlanner()
+        self._group_committer = None
+        self.fine_grained_query_cache = False
 
     @property
     def tenant_id(self):
         return self._tenant
 
+    def session(self):
+        """
+        A lightweight Interface for one caller.  It shares the collections, cache and
+        MetaContext of this Interface and its group committer, if enabled, but has its own
+        transaction state.  Enabling or disabling group commit on it affects only it.
+        """
+        res = object.__new__(type(self))
+        res.__dict__.update((k, v) for k, v in self.__dict__.items() if not k.startswith('_shared'))
+        res._origin = self.__dict__.get('_origin', self)
+        res._changeset = None
+        return res
+
     @contextmanager
     def changes(self):
         changes = self._changeset or changeset.ChangeSet()
         yield changes
         if not self._changeset:
-            if self._cache:
-                self._cache.apply_changes(changes)
-            self._db.apply_changes(changes, self._db.collections)
+            if self._group_committer:
+                self._group_committer.submit(changes)
+            else:
+                self._apply_to_db(changes)
+
+    def _apply_to_db(self, changes, collections=None):
+        versions = self._meta_versions()
+        self._db.apply_changes(changes, collections or self._db.collections)
+        if self._cache:
+            self._cache.apply_changes(changes)
+        self.update_metacontext(changes, versions)
+
+    def forget_cached_state(self):
+        """drop the cache entries and derived data of the tenant after a change made elsewhere"""
+        self._db.forget_tenant_state(self._tenant)
+        if self._cache is not None:
+            self._cache.clear()
+
+    def enable_group_commit(self, window=0.002, max_ops=500):
+        """
+        Apply the changes of writes made outside a transaction together with those of
+        concurrent writers, one combined changeset per window or per max_ops changes.
+        See group_commit.
+        """
+        self._group_committer = group_commit.GroupCommitter(
+            self._apply_to_db, window=window, max_ops=max_ops, abort=self._db.abort)
+
+    def disable_group_commit(self):
+        self._group_committer = None
 
     @property
     def metacontext(self):
+        if self._metadata is not None and self._metadata.versions != self._meta_versions():
+            self.reload_metacontext()
         return self._context
     
     def get_metadata(self):
         return self.raw_db.collections.metadata()
 
+    def hierarchy_for(self, metacontext=None):
+        """the Hierarchy of metacontext, by default the current one, made once per MetaContext"""
+        metacontext = metacontext or self.metacontext
+        if self._hierarchy is None or self._hierarchy.metacontext is not metacontext:
+            self._hierarchy = Hierarchy(metacontext)
+        return self._hierarchy
+
+    @property
+    def hierarchy(self):
+        return self.hierarchy_for()
+
+    def id_interner(self):
+        return self._db.id_interner(self._tenant)
+
+    def extension_bitmap(self, cls_id):
+        """IdBitmap of the ids of the instances of cls_id, read once per change to the class"""
+        bitmaps = self._db.extension_bitmaps(self._tenant)
+        versions = self._query_versions()
+        found = bitmaps.get(cls_id, versions)
+        if found is None:
+            stamps = [v.version for v in versions]
+            found = bitmaps.set(cls_id, stamps, self.extension(cls_id).ids_only())
+        return found
+
+    def _meta_versions(self):
+        return self._db.meta_version(self._tenant), self._db.meta_version(None)
+
     def reload_metacontext(self):
+        versions = self._meta_versions()
         coll_meta = self.get_metadata()
+        self._metadata = meta_state.MetaState(coll_meta, versions)
         self._context = MetaContext.from_data(coll_meta)
 
+    def _changed_metadata(self, kind, component):
+        changed = meta_state.changed_ids(component)
+        return getattr(self.raw_db.collections, kind).find({'id': {'$in': changed}}) if changed else []
+
+    def update_metacontext(self, changes, versions):
+        """
+        Bring the metacontext up to date with changes just applied, patching the
+        metadata they touch rather than reloading all of it.
+        :param versions: metadata versions read before the changes were applied
+        """
+        kinds = meta_state.changed_kinds(changes)
+        if not kinds:
+            return
+        if self._metadata is None or self._metadata.versions != versions:
+            self.reload_metacontext()
+            return
+        for kind in kinds:
+            component = getattr(changes, kind)
+            self._metadata.patch(kind, component.deleted, self._changed_metadata(kind, component))
+        self._metadata.versions = self._meta_versions()
+        self._context = MetaContext.from_data(self._metadata.metadata())
+
     def ensure_collections(self):
         if not self._collections:
             # here we should ensure collections correct for tenant
@@ -108,7 +225,6 @@ class Interface(object):
         has_changes = changes.has_changes()
         if has_changes:
             self.apply_changes(changes)
-            self.reload_metacontext()
         return has_changes, changes
 
 
@@ -149,8 +265,9 @@ class Interface(object):
         :param metadata: Basically a changeset of updates.
         :return: None
         """
+        versions = self._meta_versions()
         self._db.apply_changes(metadata, self.collections)
-        self.reload_metacontext()
+        self.update_metacontext(metadata, versions)
 
     def begin_transaction(self):
         """starts a changeset that will not be applied unitl commit"""
@@ -167,12 +284,10 @@ class Interface(object):
             self._db.end_long_transaction()
     
     def commit(self):
-        if self._changeset:
-            if self._cache:
-                self._cache.apply_changes(self._changeset)
-            self._db.apply_changes(self._changeset, self.collections)
+        changes = self._changeset
+        if changes:
+            self._apply_to_db(changes, self.collections)
         self.end_transaction()
-        self.reload_metacontext()
 
     def apply_changes(self, changes):
         '''
@@ -183,8 +298,7 @@ class Interface(object):
         :param changes:  the changeset of changes to apply
         :return: None
         '''
-        self._db.apply_changes(changes, self.collections)
-        self.reload_metacontext()
+        self._apply_to_db(changes, self.collections)
 
     def changes_until(self, a_time):
         changes = self._db.get_collection('changes')
@@ -280,6 +394,33 @@ class Interface(object):
             return coll.contains_id(object_id)
         return False
 
+    def objects_ok(self, object_ids):
+        """
+        The subset of object_ids naming existing objects, checked with one
+        query per class extension rather than one per id.
+        """
+        res = set()
+        for cls_id, ids in partition(set(object_ids), oid.oid_class).items():
+            if self.class_ok(cls_id):
+                res.update(self.extension(cls_id).ids_only({'_id': {'$in': list(ids)}}))
+        return res
+
+    def _existing_ids(self, coll, ids):
+        ids = list(set(ids))
+        return set(coll.ids_only({'_id': {'$in': ids}})) if ids else set()
+
+    def tags_ok(self, tag_ids):
+        return self._existing_ids(self.tags, tag_ids)
+
+    def groups_ok(self, group_ids):
+        return self._existing_ids(self.groups, group_ids)
+
+    def group_items_ok(self, items):
+        """the subset of items that are groups or existing objects"""
+        items = list(items)
+        groups = self.groups_ok(items)
+        return groups | self.objects_ok([i for i in items if i not in groups])
+
     def class_short_form(self, class_id):
         cls = self.get_class(class_id)
         if cls:
@@ -377,9 +518,10 @@ class Interface(object):
     def get_object_relationships(self, uuid):
         """dictionary of role_id to object_id set"""
         roles, reverse_roles = self.get_object_roles(uuid)
-        forward = dict([(r, self.get_roleset(uuid, r)) for r in roles])
-        reverse = dict([(r, self.get_roleset(uuid, r, True)) for r in reverse_roles])
-        return forward, reverse
+        forward = self.bulk_rolesets([(uuid, r) for r in roles])
+        reverse = self.bulk_rolesets([(uuid, r) for r in reverse_roles], reverse=True)
+        return ({r: forward[(uuid, r)] for r in roles},
+                {r: reverse[(uuid, r)] for r in reverse_roles})
 
     def get_related_objects(self, uuid):
         related, rev_related = self.get_object_relationships(uuid)
@@ -400,18 +542,48 @@ class Interface(object):
         return res
 
     def get_roleset(self, subject, role_id, reverse=False):
-        key = role_id + ":" + subject
-        res = self._cache and self._cache.get(key)
-        if not res:
-            role = self.roles.get(role_id)
-            criteria = {'subject_id': subject, 'assoc_id': role_id}
-            col = 'object_id'
-            if reverse:
-                criteria = {'object_id': subject, 'assoc_id': role_id}
-                col = 'subject_id'
-            res = set(self.related.find(criteria=criteria, only_cols=[col]))
-            if self._cache:
-                self._cache.set(key, res)
+        return self.get_rolesets([subject], role_id, reverse=reverse)[subject]
+
+    def get_rolesets(self, subjects, role_id, reverse=False):
+        """
+        Rolesets of several subjects for one role found with at most one query.
+        :param subjects: ids to get rolesets for
+        :param role_id: the role
+        :param reverse: whether subjects are the objects of the role rather than its subjects
+        :return: dict of subject to set of related ids
+        """
+        found = self.bulk_rolesets([(s, role_id) for s in subjects], reverse=reverse)
+        return {pair[0]: ids for pair, ids in found.items()}
+
+    def bulk_rolesets(self, pairs, reverse=False):
+        """
+        Rolesets of many (id, role_id) pairs.  Those not in the cache are found
+        with a single query on related and cached, including empty ones.
+        :param pairs: (id, role_id) pairs
+        :param reverse: whether the ids are the objects of the roles rather than their subjects
+        :return: dict of (id, role_id) pair to set of related ids, copies the caller may change
+        Results read while changes were applied are not cached.
+        """
+        res = {}
+        missing = defaultdict(set)
+        for an_id, role_id in pairs:
+            found = self._cache.get(roleset_key(an_id, role_id, reverse)) if self._cache else None
+            if found is None:
+                missing[role_id].add(an_id)
+            else:
+                res[(an_id, role_id)] = set(found)
+        if missing:
+            stamps = [v.version for v in self._query_versions()]
+            key_col, col = ('object_id', 'subject_id') if reverse else ('subject_id', 'object_id')
+            clauses = [{'assoc_id': role_id, key_col: {'$in': list(ids)}} for role_id, ids in missing.items()]
+            criteria = clauses[0] if len(clauses) == 1 else {'$or': clauses}
+            found = {(an_id, role_id): set() for role_id, ids in missing.items() for an_id in ids}
+            for rec in self.related.find(criteria=criteria, only_cols=[key_col, 'assoc_id', col]):
+                found[(rec[key_col], rec['assoc_id'])].add(rec[col])
+            if self._cache and stamps == [v.version for v in self._query_versions()]:
+                for (an_id, role_id), ids in found.items():
+                    self._cache.set(roleset_key(an_id, role_id, reverse), set(ids))
+            res.update(found)
         return res
 
     def modify_associated_with_role(self, role_id, an_id, desired, reverse=False, do_replace=False):
@@ -422,7 +594,7 @@ class Interface(object):
             
         to_add = desired - current
         to_remove = current - desired
-        with changes(self) as chng:
+        with self.changes() as chng:
             for obj in to_add:
                 chng.insert('related', related(obj))
             if do_replace:  
@@ -431,42 +603,51 @@ class Interface(object):
         return desired
     
     def modify_object_tags(self, object_id, tag_ids, do_replace=False):
+        """
+        Tag object_id with tag_ids and, if do_replace, untag it from its other tags.
+        Ids that name no tag are ignored, as in the async Interface.
+        """
         role_id = self.roles.by_name['tag_applies']
-        return self.modify_associated_with_role(role_id, object_id, tag_ids, do_replace=do_replace)
+        return self.modify_associated_with_role(role_id, object_id, self.tags_ok(tag_ids), do_replace=do_replace)
     
     def modify_object_groups(self, object_id, group_ids, do_replace=False):
+        """Put object_id in group_ids, ignoring ids that name no group"""
         role_id = self.roles.by_name['group_contains']
-        return self.modify_associated_with_role(role_id, object_id, group_ids, do_replace=do_replace)
+        return self.modify_associated_with_role(role_id, object_id, self.groups_ok(group_ids), do_replace=do_replace)
 
     def modify_tag_objects(self, tag_id, object_ids, do_replace=False, reverse=True):
+        """Apply tag_id to object_ids, ignoring ids that name no existing object"""
         role_id = self.roles.by_name['tag_applies']
-        return self.modify_associated_with_role(role_id, tag_id, object_ids, do_replace=do_replace, reverse=reverse)
+        return self.modify_associated_with_role(role_id, tag_id, self.objects_ok(object_ids),
+                                                do_replace=do_replace, reverse=reverse)
     
     def modify_group_objects(self, group_id, object_ids, do_replace=False, reverse=True):
+        """Put object_ids in group_id, ignoring ids that name neither a group nor an existing object"""
         role_id = self.roles.by_name['group_contains']
-        return self.modify_associated_with_role(role_id, group_id, object_ids, do_replace=do_replace, reverse=reverse)
+        return self.modify_associated_with_role(role_id, group_id, self.group_items_ok(object_ids),
+                                                do_replace=do_replace, reverse=reverse)
     
     def modify_object_related(self, fixed_id, role_id, object_ids, do_replace=False, reverse=False):
         return self.modify_associated_with_role(role_id, fixed_id, object_ids, do_replace=do_replace, reverse=reverse)
 
         
+    def group_closure(self):
+        """the TransitiveClosure of group containment maintained by the database"""
+        return self._db.group_closure(self.collections)[1]
+
     def groups_in_group(self, group_id):
-        """ get groups contained in group using relations instead of directly
+        """ get groups contained in group, directly or through other groups
         """
-        role_id = self.roles.by_name['contains_group']
-        func = lambda gid: self.get_roleset(gid, role_id)
-        return recurse_set(func(group_id), func)
+        return self.group_closure().descendants(group_id)
     
     def groups_containing_group(self, group_id):
-        """ get groups containing group using relations instead of directly
+        """ get groups containing group, directly or through other groups
         """
-        role_id = self.roles.by_name['contains_group']
-        func = lambda gid: self.get_roleset(gid, role_id, reverse=True)
-        return recurse_set(func(group_id), func)
+        return self.group_closure().ancestors(group_id)
 
 
     def group_item_check(self, item):
-        return (self.group_ok(item)) or (self.object_ok(item))
+        return bool(self.group_items_ok([item]))
 
 
     def get_all_related_by(self, role_id, reverse=False):
@@ -503,18 +684,18 @@ class Interface(object):
 
     def get_tagset(self, tag_id, recursive=False):
         role_id = self.roles.by_name['tag_applies']
-        tags = set(tag_id)
+        tags = {tag_id}
         if recursive:
-            tags.update(self.metacontext.subtags(tag_id))
-        sets = [self.get_roleset(tid, role_id) for tid in tags]
+            tags.update(self.hierarchy.closure('tags', tag_id))
+        sets = self.get_rolesets(tags, role_id).values()
         return reduce(lambda a, b: a | b, sets, set())
 
     def get_groupset(self, group_id, recursive=False):
         role_id = self.roles.by_name['group_contains']
-        groups = set(group_id)
+        groups = {group_id}
         if recursive:
             groups.update(self.groups_in_group(group_id))
-        sets = [self.get_roleset(gid, role_id) for gid in groups]
+        sets = self.get_rolesets(groups, role_id).values()
         return reduce(lambda a, b: a | b, sets, set())
 
 
@@ -535,7 +716,8 @@ class Interface(object):
         role_id = self.roles.by_name['group_contains']
         res = self.get_roleset(uuid, role_id, reverse=True)
         if recursive:
-            return recurse_set(res, lambda gid: self.groups_containing_group(gid))
+            closure = self.group_closure()
+            return res.union(*[closure.ancestors(gid) for gid in res])
         return res
 
     def tagsets(self, tags):
@@ -543,9 +725,9 @@ class Interface(object):
         Returns dict with tag_ids as keys and list objects having
         tag as value.
         """
-        tagsets = [self.get_tagset(t) for t in tags]
-        res = zip(tags, [list(ts) for ts in tagsets])
-        return dict(res)
+        role_id = self.roles.by_name['tag_applies']
+        tagsets = self.get_rolesets(tags, role_id)
+        return {t: list(tagsets[t]) for t in tags}
 
     def tag_neighbors(self, uuid):
         """
@@ -561,9 +743,9 @@ class Interface(object):
         """
         Returns dict with group_ids as keys and list objects directly in group as value.
         """
-        sets = [self.get_groupset(t) for t in groups]
-        res = zip(groups, [list(items) for items in sets])
-        return dict(res)
+        role_id = self.roles.by_name['group_contains']
+        sets = self.get_rolesets(groups, role_id)
+        return {g: list(sets[g]) for g in groups}
 
     def group_neighbors(self, uuid):
         """
@@ -577,10 +759,10 @@ class Interface(object):
 
     def objects_in_group(self, group_id, transitive=False):
         role_id = self.roles.by_name['group_contains']
-        groups = set(group_id)
+        groups = {group_id}
         if transitive:
             groups.update(self.groups_in_group(group_id))
-        sets = [self.get_roleset(gid, role_id) for gid in groups]
+        sets = self.get_rolesets(groups, role_id).values()
         return reduce(lambda a, b: a | b, sets, set())
 
 
@@ -606,7 +788,7 @@ class Interface(object):
         return self.meta_insert(query)
 
     def meta_insert(self, obj):
-        with changes(self) as chng:
+        with self.changes() as chng:
             data = self._ensure_dict(obj)
             kind = data.pop('kind', 'objects')
             chng.insert(kind, data)
@@ -619,12 +801,12 @@ class Interface(object):
         return meta
 
     def meta_modify(self, kind, an_id, **data):
-        with changes(self) as chng:
+        with self.changes() as chng:
             res = chng.modify(kind, an_id, data)
         return res or getattr(self, kind,{}).get(an_id)
 
     def meta_delete(self, kind, id_or_data):
-        with changes(self) as chng:
+        with self.changes() as chng:
             if not isinstance(id_or_data, str):
                 data = as_dict(id_or_data)
                 data.pop('kind', None)
@@ -776,6 +958,25 @@ class Interface(object):
     def instances_satisfying(self, name, criteria):
         return self.class_collection(name).find(criteria)
 
+    def instances_satisfying_page(self, name, criteria=None, order_by=None, limit=100,
+                                  continuation=None, only_cols=None):
+        """
+        A page of the instances of the named class satisfying criteria.
+        :param continuation: token returned with the previous page or None for the first page
+        :return: (instances, continuation for the next page or None after the last page)
+        """
+        return self.class_collection(name).find_page(criteria, order_by, limit, continuation, only_cols)
+
+    def iter_class_instances(self, name, only_cols=None, batch_size=1000):
+        """
+        Iterate over the instances of the named class without loading them all at once
+        :param batch_size: number of instances fetched from the database at a time
+        """
+        return self.class_collection(name).find_iter(only_cols=only_cols, batch_size=batch_size)
+
+    def iter_instances_satisfying(self, name, criteria, only_cols=None, batch_size=1000):
+        return self.class_collection(name).find_iter(criteria, only_cols=only_cols, batch_size=batch_size)
+
     def class_instance_ids(self, name):
         cls = self.metaclass_named(name)
         coll = self.extension(cls.id)
@@ -808,7 +1009,9 @@ class Interface(object):
         if not obj:
             coll = self.containing_collection(uuid)
             obj = coll.get(uuid)
-        return obj
+            if obj and self._cache:
+                self._cache.set(uuid, obj)
+        return dict(obj) if obj else obj
 
     def bulk_load(self, uuids, preserve_order=True):
         by_cls = partition(uuids, oid.oid_class)
@@ -844,6 +1047,52 @@ class Interface(object):
             else:
                 return q
 
-        evaluator = query_module.QueryEvaluator2(normalized_query(query), self,
-                                                self.metacontext)
-        return await evaluator()
+        return await self._cached_query(normalized_query(query))
+
+    async def query_page(self, query, limit=100, continuation=None):
+        """
+        A page of the ids satisfying query in id order.  The full result comes from the
+        query result cache while the data it depends on is unchanged.
+        :return: (ids, continuation for the next page or None after the last page)
+        """
+        return paging.page_ids(await self.query(query), limit, continuation)
+
+    async def run_saved_query(self, query_id):
+        """
+        Run a query saved in the queries collection.  Its plan is compiled on first
+        use and reused until the saved query changes.
+        :param query_id: id of the saved query
+        :return: list of uuids of objects satisfying the query
+        """
+        query = self.get_meta('queries', query_id)
+        if not query:
+            raise NoSuchObject(query_id)
+        return await self._cached_query(query)
+
+    def _query_versions(self):
+        versions = [self._db.data_versions(self._tenant)]
+        if self._tenant:
+            versions.append(self._db.data_versions(None))
+        return versions
+
+    async def _cached_query(self, query):
+        """
+        Evaluate query or return its cached result if no data it depends on has changed
+        since.  With fine_grained_query_cache set, results are only invalidated by changes
+        to the classes, tags, groups and roles the query references rather than by any change.
+        """
+        results = self._db.query_results
+        key = query_cache.canonical(query)
+        versions = self._query_versions()
+        found = results.get(self._tenant, key, versions)
+        if found is not None:
+            return copy.copy(found)
+        stamps = [v.version for v in versions]
+        dependencies = None
+        if self.fine_grained_query_cache:
+            dependencies = query_cache.query_dependencies(getattr(query, 'query', query), self.metacontext)
+        evaluator = query_module.QueryEvaluator2(query, self, self.metacontext,
+                                                planner=self._query_planner)
+        found = await evaluator()
+        results.set(self._tenant, key, stamps, dependencies, copy.copy(found))
+        return found
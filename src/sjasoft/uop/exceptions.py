@@ -2,3 +2,8 @@ class NoSuchObject(Exception):
     def __init__(self, uid):
         super().__init__('no object with uuid %s' % uid)
 
+
+
+class InvalidContinuation(Exception):
+    def __init__(self, token):
+        super().__init__('continuation %r does not continue this query' % token)
@@ -0,0 +1,136 @@
+"""
+Group commit of the changesets of concurrent writers.
+
+Outside a transaction every Interface write applies its own small ChangeSet, paying for a
+transaction, a change log entry and a commit each time.  A GroupCommitter collects the
+changesets submitted by concurrent callers.  The first caller to submit when no group is
+forming leads the group.  It waits up to window seconds, or until the group holds max_ops
+changes, then combines the group into one ChangeSet and applies it with one change log entry
+and one commit.  The other callers block until their group is applied, so every submit
+returns only once its changes are in the database.
+
+If the combined changeset fails, the database is rolled back with abort and the changesets
+of the group are applied one by one.  Each caller then sees only the error of its own changes.
+Should the group fail otherwise, e.g. because abort fails, every caller of the group sees that
+error and none is left waiting.
+Groups are applied one at a time.  The next group forms while the previous one is applied.
+"""
+
+import threading
+import time
+from sjasoft.uop import changeset
+
+
+def op_count(changes):
+    """number of inserts, modifications and deletes in a ChangeSet"""
+    count = 0
+    for kind in changes.change_types:
+        component = getattr(changes, kind)
+        count += len(component.inserted) + len(component.deleted) + len(getattr(component, 'modified', ()))
+    return count
+
+
+class Pending(object):
+    __slots__ = ('changes', 'done', 'error')
+
+    def __init__(self, changes):
+        self.changes = changes
+        self.done = False
+        self.error = None
+
+
+class GroupCommitter(object):
+    changeset_class = changeset.ChangeSet
+
+    def __init__(self, apply, window=0.002, max_ops=500, abort=None, clock=time.monotonic):
+        """
+        :param apply: callable applying one ChangeSet to the database
+        :param window: seconds a group stays open for more changesets
+        :param max_ops: number of changes at which a group is applied without waiting out the window
+        :param abort: callable rolling back a failed apply
+        """
+        self._apply = apply
+        self._abort = abort
+        self.window = window
+        self.max_ops = max_ops
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._commit_lock = threading.Lock()
+        self._queue = []
+        self._ops = 0
+        self._leading = False
+        self.submitted = 0
+        self.groups = 0
+
+    def combined(self, group):
+        if len(group) == 1:
+            return group[0].changes
+        return self.changeset_class.combine_changes(*[p.changes for p in group])
+
+    def _enqueue(self, pending):
+        self._queue.append(pending)
+        self._ops += op_count(pending.changes)
+        self.submitted += 1
+
+    def _take_group(self):
+        group, self._queue, self._ops = self._queue, [], 0
+        self._leading = False
+        self.groups += 1
+        return group
+
+    def submit(self, changes):
+        """apply changes as part of a group, returning once they are applied"""
+        pending = Pending(changes)
+        with self._cond:
+            self._enqueue(pending)
+            if self._leading:
+                self._cond.notify_all()
+                while not pending.done:
+                    self._cond.wait()
+            else:
+                self._leading = True
+                deadline = self._clock() + self.window
+                while self._ops < self.max_ops:
+                    remaining = deadline - self._clock()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                group = self._take_group()
+        if not pending.done:
+            try:
+                with self._commit_lock:
+                    self._commit(group)
+            except BaseException as e:
+                self._fail(group, e)
+                raise
+            finally:
+                with self._cond:
+                    for member in group:
+                        member.done = True
+                    self._cond.notify_all()
+        if pending.error is not None:
+            raise pending.error
+
+    def _fail(self, group, error):
+        """give error to the members of a group that failed without an error of their own"""
+        for member in group:
+            if member.error is None:
+                member.error = error
+
+    def _commit(self, group):
+        try:
+            self._apply(self.combined(group))
+            return
+        except Exception as e:
+            if self._abort:
+                self._abort()
+            if len(group) == 1:
+                group[0].error = e
+                return
+        for member in group:
+            try:
+                self._apply(member.changes)
+            except Exception as e:
+                member.error = e
+                if self._abort:
+                    self._abort()
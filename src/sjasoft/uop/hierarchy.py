@@ -0,0 +1,56 @@
+"""
+Closures of the tag, group and class hierarchies of a MetaContext.
+
+The subtags, subgroups and subclasses of an id are asked of the MetaContext once and kept as
+bitsets over an IdInterner.  Expanding several ids by their hierarchies is then a union or
+intersection of integers rather than a walk of each tree per query.  A Hierarchy is only valid
+for the MetaContext it was made from.  Interface.hierarchy_for makes a new one whenever its
+MetaContext is replaced.
+"""
+
+from sjasoft.uop.idsets import IdInterner
+
+closure_methods = dict(tags='subtags', groups='subgroups', classes='subclasses')
+
+
+class Hierarchy(object):
+    def __init__(self, metacontext, interner=None):
+        self.metacontext = metacontext
+        self.interner = interner or IdInterner()
+        self._closures = {}
+
+    def closure_bits(self, kind, an_id):
+        """
+        bitset of the ids below an_id in the hierarchy of kind
+        :param kind: 'tags', 'groups' or 'classes'
+        """
+        key = (kind, an_id)
+        bits = self._closures.get(key)
+        if bits is None:
+            below = getattr(self.metacontext, closure_methods[kind])(an_id)
+            bits = self._closures[key] = self.interner.bits(below or ())
+        return bits
+
+    def closure(self, kind, an_id):
+        return self.interner.ids(self.closure_bits(kind, an_id))
+
+    def union(self, kind, ids):
+        """ids below any of ids"""
+        bits = 0
+        for an_id in ids:
+            bits |= self.closure_bits(kind, an_id)
+        return self.interner.ids(bits)
+
+    def intersection(self, kind, ids):
+        """ids below all of ids"""
+        bits = None
+        for an_id in ids:
+            found = self.closure_bits(kind, an_id)
+            bits = found if bits is None else bits & found
+            if not bits:
+                break
+        return self.interner.ids(bits or 0)
+
+    def expanded(self, kind, ids):
+        """ids together with all ids below them"""
+        return set(ids) | self.union(kind, ids)
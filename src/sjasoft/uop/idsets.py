@@ -0,0 +1,356 @@
+"""
+Compact sets of ids.
+
+Ids in uop are strings.  An IdInterner assigns each id it sees a small dense integer so a set
+of ids can be held as the bits of a Python int.  Union and intersection of such bitsets are
+single integer operations however many ids they hold.
+
+An IdBitmap is a roaring style compressed set of such integers.  The integers are split by
+their high 16 bits into containers.  A container of few members is a sorted tuple of their low
+bits and a dense one is a 65536 bit int, so a set costs memory in proportion to its members
+rather than to its largest integer.  An IdBitmap may be negated, meaning every integer except
+its members.  Intersection, union and difference of negated and plain bitmaps are exact without
+knowing the universe they are taken from.  An IdSet is an IdBitmap read through an IdInterner
+so it can stand in for a set of ids.
+"""
+
+import bisect
+import threading
+
+array_max = 4096  # members above which a container is held as bits
+
+
+def popcount(bits):
+    return bits.bit_count()
+
+
+def _bits_of(container):
+    if isinstance(container, int):
+        return container
+    bits = 0
+    for low in container:
+        bits |= 1 << low
+    return bits
+
+
+def _array_of(bits):
+    res = []
+    while bits:
+        low = bits & -bits
+        res.append(low.bit_length() - 1)
+        bits ^= low
+    return tuple(res)
+
+
+def _normal(container):
+    """container in its cheaper representation"""
+    if isinstance(container, int):
+        return _array_of(container) if popcount(container) <= array_max else container
+    return _bits_of(container) if len(container) > array_max else container
+
+
+def _container_and(a, b):
+    if isinstance(a, int) and isinstance(b, int):
+        return _normal(a & b)
+    if isinstance(a, int):
+        a, b = b, a
+    if isinstance(b, int):
+        return tuple(low for low in a if b >> low & 1)
+    return tuple(sorted(set(a).intersection(b)))
+
+
+def _container_or(a, b):
+    if isinstance(a, int) or isinstance(b, int):
+        return _normal(_bits_of(a) | _bits_of(b))
+    return _normal(tuple(sorted(set(a).union(b))))
+
+
+def _container_sub(a, b):
+    if isinstance(a, int):
+        return _normal(a & ~_bits_of(b))
+    if isinstance(b, int):
+        return tuple(low for low in a if not b >> low & 1)
+    return tuple(sorted(set(a).difference(b)))
+
+
+def _and(left, right):
+    res = {}
+    for high in left.keys() & right.keys():
+        container = _container_and(left[high], right[high])
+        if container:
+            res[high] = container
+    return res
+
+
+def _or(left, right):
+    res = dict(left)
+    for high, container in right.items():
+        res[high] = _container_or(res[high], container) if high in res else container
+    return res
+
+
+def _sub(left, right):
+    res = {}
+    for high, container in left.items():
+        if high in right:
+            container = _container_sub(container, right[high])
+        if container:
+            res[high] = container
+    return res
+
+
+class IdBitmap(object):
+    __slots__ = ('_containers', 'negated')
+
+    def __init__(self, ints=(), negated=False):
+        lows = {}
+        for i in ints:
+            lows.setdefault(i >> 16, set()).add(i & 0xFFFF)
+        self._containers = {high: _normal(tuple(sorted(low))) for high, low in lows.items()}
+        self.negated = negated
+
+    @classmethod
+    def _made(cls, containers, negated):
+        res = cls.__new__(cls)
+        res._containers = containers
+        res.negated = negated
+        return res
+
+    def members(self):
+        """the integers held, which are those excluded when negated"""
+        for high in sorted(self._containers):
+            container = self._containers[high]
+            base = high << 16
+            for low in (_array_of(container) if isinstance(container, int) else container):
+                yield base | low
+
+    def member_count(self):
+        return sum(popcount(c) if isinstance(c, int) else len(c) for c in self._containers.values())
+
+    def _positive(self):
+        if self.negated:
+            raise ValueError('a negated IdBitmap has no finite members')
+
+    def __iter__(self):
+        self._positive()
+        return self.members()
+
+    def __len__(self):
+        self._positive()
+        return self.member_count()
+
+    def __bool__(self):
+        return self.negated or bool(self._containers)
+
+    def __contains__(self, i):
+        container = self._containers.get(i >> 16)
+        if container is None:
+            found = False
+        elif isinstance(container, int):
+            found = bool(container >> (i & 0xFFFF) & 1)
+        else:
+            low = i & 0xFFFF
+            index = bisect.bisect_left(container, low)
+            found = index < len(container) and container[index] == low
+        return found != self.negated
+
+    def __eq__(self, other):
+        if not isinstance(other, IdBitmap):
+            return NotImplemented
+        return self.negated == other.negated and self._containers == other._containers
+
+    def __invert__(self):
+        return self._made(self._containers, not self.negated)
+
+    def __and__(self, other):
+        mine, theirs = self._containers, other._containers
+        if self.negated and other.negated:
+            return self._made(_or(mine, theirs), True)
+        if self.negated:
+            return self._made(_sub(theirs, mine), False)
+        if other.negated:
+            return self._made(_sub(mine, theirs), False)
+        return self._made(_and(mine, theirs), False)
+
+    def __or__(self, other):
+        mine, theirs = self._containers, other._containers
+        if self.negated and other.negated:
+            return self._made(_and(mine, theirs), True)
+        if self.negated:
+            return self._made(_sub(mine, theirs), True)
+        if other.negated:
+            return self._made(_sub(theirs, mine), True)
+        return self._made(_or(mine, theirs), False)
+
+    def __sub__(self, other):
+        return self & ~other
+
+    def __repr__(self):
+        return '%sIdBitmap(%d members)' % ('~' if self.negated else '', self.member_count())
+
+
+class IdInterner(object):
+    def __init__(self):
+        self._index = {}
+        self._ids = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, an_id):
+        return an_id in self._index
+
+    def intern(self, an_id):
+        """the integer of an_id, assigning the next one if it has none yet"""
+        index = self._index.get(an_id)
+        if index is None:
+            with self._lock:
+                index = self._index.get(an_id)
+                if index is None:
+                    index = self._index[an_id] = len(self._ids)
+                    self._ids.append(an_id)
+        return index
+
+    def index_of(self, an_id):
+        """the integer of an_id or None if it has none"""
+        return self._index.get(an_id)
+
+    def id_of(self, index):
+        return self._ids[index]
+
+    def bits(self, ids):
+        """bitset of ids"""
+        res = 0
+        for an_id in ids:
+            res |= 1 << self.intern(an_id)
+        return res
+
+    def ids(self, bits):
+        """set of the ids in bitset bits"""
+        res = set()
+        while bits:
+            low = bits & -bits
+            res.add(self._ids[low.bit_length() - 1])
+            bits ^= low
+        return res
+
+    def bitmap(self, ids, negated=False):
+        return IdBitmap((self.intern(an_id) for an_id in ids), negated)
+
+
+class ExtensionBitmaps(object):
+    """
+    IdBitmap of the instance ids of each class of a tenant.  A bitmap is stamped with the
+    versions of the DataVersions it was read under and stays valid until a change to its
+    class is recorded in them.
+    """
+
+    def __init__(self, interner):
+        self.interner = interner
+        self._bitmaps = {}
+        self._lock = threading.Lock()
+
+    def get(self, cls_id, versions):
+        """the bitmap of cls_id if still valid under versions, else None"""
+        with self._lock:
+            entry = self._bitmaps.get(cls_id)
+            if entry is not None:
+                stamps, bitmap = entry
+                if all(v.valid(stamp, {('class', cls_id)}) for v, stamp in zip(versions, stamps)):
+                    return bitmap
+                del self._bitmaps[cls_id]
+            return None
+
+    def set(self, cls_id, stamps, ids):
+        """
+        :param stamps: version of each of the DataVersions read before ids were
+        :return: the bitmap of ids
+        """
+        bitmap = self.interner.bitmap(ids)
+        with self._lock:
+            self._bitmaps[cls_id] = (tuple(stamps), bitmap)
+        return bitmap
+
+    def clear(self):
+        with self._lock:
+            self._bitmaps.clear()
+
+
+class IdSet(object):
+    """
+    A set of ids held as an IdBitmap over an IdInterner.  Plain sets and NegatableSets
+    combined with an IdSet are converted to one over the same interner.
+    """
+
+    __slots__ = ('interner', 'bitmap')
+
+    def __init__(self, interner, ids=(), negated=False):
+        self.interner = interner
+        self.bitmap = ids if isinstance(ids, IdBitmap) else interner.bitmap(ids, negated)
+
+    @classmethod
+    def of(cls, interner, ids):
+        """ids as an IdSet, honoring the negation of NegatableSets"""
+        if isinstance(ids, IdSet) and ids.interner is interner:
+            return ids
+        if isinstance(ids, IdSet):
+            return cls(interner, ids.members(), ids.negated)
+        return cls(interner, ids or (), getattr(ids, 'negated', False))
+
+    @property
+    def negated(self):
+        return self.bitmap.negated
+
+    def members(self):
+        """the ids held, which are those excluded when negated"""
+        id_of = self.interner.id_of
+        return (id_of(i) for i in self.bitmap.members())
+
+    def __iter__(self):
+        self.bitmap._positive()
+        return self.members()
+
+    def __len__(self):
+        return len(self.bitmap)
+
+    def __bool__(self):
+        return bool(self.bitmap)
+
+    def __contains__(self, an_id):
+        index = self.interner.index_of(an_id)
+        return self.negated if index is None else index in self.bitmap
+
+    def __eq__(self, other):
+        if isinstance(other, IdSet):
+            return self.of(self.interner, other).bitmap == self.bitmap
+        if isinstance(other, (set, frozenset)) and not getattr(other, 'negated', False):
+            return not self.negated and set(self) == other
+        return NotImplemented
+
+    def __invert__(self):
+        return IdSet(self.interner, ~self.bitmap)
+
+    def _other(self, other):
+        return self.of(self.interner, other).bitmap
+
+    def __and__(self, other):
+        return IdSet(self.interner, self.bitmap & self._other(other))
+
+    def __or__(self, other):
+        return IdSet(self.interner, self.bitmap | self._other(other))
+
+    def __sub__(self, other):
+        return IdSet(self.interner, self.bitmap - self._other(other))
+
+    def __rand__(self, other):
+        return IdSet(self.interner, self._other(other) & self.bitmap)
+
+    def __ror__(self, other):
+        return IdSet(self.interner, self._other(other) | self.bitmap)
+
+    def __rsub__(self, other):
+        return IdSet(self.interner, self._other(other) - self.bitmap)
+
+    def __repr__(self):
+        return 'IdSet(%r)' % self.bitmap
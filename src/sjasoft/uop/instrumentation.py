@@ -0,0 +1,162 @@
+"""
+Leveled, buffered instrumentation events with counters and timings.
+
+Code on hot paths reports what it did through an Instrumentation instead of writing files or
+logging inline.  Recording an event only appends it to a bounded in-memory buffer and bumps
+counters so the caller never blocks on I/O.  Events below the level of the Instrumentation
+are counted but not buffered.  A daemon thread drains the buffer to the event sinks added,
+each a callable taking an Event, and passes counters and timings to the metrics sinks, each a
+callable taking (counters, timings).  flush does the same synchronously.
+
+default is the Instrumentation used where none is given, e.g. by DatabaseCollections.
+"""
+
+import logging
+import threading
+import time
+from collections import deque, namedtuple
+from contextlib import contextmanager
+
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+ERROR = logging.ERROR
+
+Event = namedtuple('Event', 'time level name fields')
+
+
+class Timing(object):
+    __slots__ = ('count', 'total', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def to_dict(self):
+        return dict(count=self.count, total=self.total, max=self.max)
+
+
+class Instrumentation(object):
+    def __init__(self, level=INFO, max_buffered=10000, flush_interval=1.0,
+                 clock=time.time, timer=time.perf_counter):
+        """
+        :param level: least level of the events buffered for sinks
+        :param max_buffered: events held before the oldest are dropped
+        :param flush_interval: seconds between drains by the background thread
+        """
+        self.level = level
+        self.flush_interval = flush_interval
+        self._clock = clock
+        self._timer = timer
+        self._buffer = deque(maxlen=max_buffered)
+        self._counters = {}
+        self._timings = {}
+        self._sinks = []
+        self._metrics_sinks = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def add_sink(self, sink):
+        """:param sink: callable receiving each buffered Event"""
+        self._sinks.append(sink)
+        self._ensure_thread()
+
+    def add_metrics_sink(self, sink):
+        """:param sink: callable receiving (counters, timings) dicts on every drain"""
+        self._metrics_sinks.append(sink)
+        self._ensure_thread()
+
+    def enabled_for(self, level):
+        return level >= self.level
+
+    def count(self, name, n=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def event(self, name, level=INFO, **fields):
+        """count an event of name and buffer it if level is enabled"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + 1
+            if self.enabled_for(level):
+                if len(self._buffer) == self._buffer.maxlen:
+                    self._counters['instrumentation.dropped'] = self._counters.get(
+                        'instrumentation.dropped', 0) + 1
+                self._buffer.append(Event(self._clock(), level, name, fields))
+
+    def record_time(self, name, seconds):
+        with self._lock:
+            timing = self._timings.get(name)
+            if timing is None:
+                timing = self._timings[name] = Timing()
+            timing.add(seconds)
+
+    @contextmanager
+    def timed(self, name):
+        start = self._timer()
+        try:
+            yield
+        finally:
+            self.record_time(name, self._timer() - start)
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def timings(self):
+        with self._lock:
+            return {k: v.to_dict() for k, v in self._timings.items()}
+
+    def drain(self):
+        """remove and return the buffered events"""
+        with self._lock:
+            events = list(self._buffer)
+            self._buffer.clear()
+        return events
+
+    def flush(self):
+        """deliver buffered events and current metrics to the sinks"""
+        with self._flush_lock:
+            events = self.drain()
+            for sink in list(self._sinks):
+                for event in events:
+                    sink(event)
+            if self._metrics_sinks:
+                counters, timings = self.counters(), self.timings()
+                for sink in list(self._metrics_sinks):
+                    sink(counters, timings)
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='uop-instrumentation', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logging.getLogger('uop.instrumentation').exception('instrumentation sink failed')
+
+
+def logging_sink(logger=None):
+    """event sink writing events to a logger at their level"""
+    logger = logger or logging.getLogger('uop.instrumentation')
+
+    def sink(event):
+        logger.log(event.level, '%s %s', event.name, event.fields)
+
+    return sink
+
+
+default = Instrumentation()
@@ -0,0 +1,125 @@
+"""
+Async flavor of the in-memory uop adaptor.  It shares stores with the sync adaptor so
+both see the same named databases.
+"""
+
+import asyncio
+from sjasoft.uop.async_path import database
+from sjasoft.uop import database as base
+from sjasoft.uop.async_path import db_collection as db_coll
+from sjasoft.uop import db_service
+from sjasoft.uop.collections import uop_collection_names
+from sjasoft.uop.memory import memoryuop
+
+
+class MemoryCollection(db_coll.DBCollection):
+
+    @property
+    def table(self):
+        return self._coll
+
+    def __contains__(self, an_id):
+        return self._coll.get(an_id) is not None
+
+    @property
+    def by_name(self):
+        return {d['name']: d['id'] for d in self._coll.find(only_cols=['id', 'name'])
+                if 'name' in d and 'id' in d}
+
+    def ensure_index(self, *fields, ordered=False):
+        for field in fields:
+            self._coll.add_index(field, ordered=ordered)
+
+    async def count(self, criteria=None):
+        return self._coll.count(self.modified_criteria(criteria or {}))
+
+    async def exists(self, criteria):
+        return (await self.count(criteria)) > 0
+
+    async def distinct(self, key, criteria):
+        return set(await self.find(criteria, only_cols=[key]))
+
+    async def find(self, criteria=None, only_cols=None,
+                   order_by=None, limit=None, ids_only=False):
+        if ids_only:
+            only_cols = [self.ID_Field]
+        return self._coll.find(self.modified_criteria(criteria or {}), only_cols=only_cols,
+                               order_by=order_by, limit=limit)
+
+    async def find_iter(self, criteria=None, only_cols=None, order_by=None, batch_size=1000):
+        found = self._coll.find_iter(self.modified_criteria(criteria or {}), only_cols=only_cols,
+                                     order_by=order_by, batch_size=batch_size)
+        for count, record in enumerate(found, 1):
+            yield record
+            if count % batch_size == 0:
+                await asyncio.sleep(0)  # let other tasks run between batches
+
+    async def get(self, instance_id):
+        if self._with_tenant({}):
+            return await super().get(instance_id)
+        return self._coll.get(instance_id)
+
+    async def insert(self, **fields):
+        return self._coll.insert(fields)
+
+    async def insert_many(self, items):
+        return self._coll.insert_many(items)
+
+    async def update_many(self, mods_by_id):
+        if self._with_tenant({}):
+            return await super().update_many(mods_by_id)
+        return self._coll.update_many(mods_by_id)
+
+    async def bulk_load(self, *ids):
+        if len(ids) == 1 and isinstance(ids[0], (list, tuple, set)):
+            ids = ids[0]
+        return await self.find({'id': {'$in': list(ids)}})
+
+    async def update(self, selector, mods, partial=True):
+        if not isinstance(selector, dict):
+            selector = {'id': selector}
+        if not partial:
+            return self._coll.replace_one(self.modified_criteria(selector), mods)
+        return self._coll.update(self.modified_criteria(selector), mods)
+
+    async def update_one(self, an_id, mods):
+        return await self.update({'id': an_id}, mods)
+
+    async def update_instance(self, an_id, **mods):
+        return await self.update_one(an_id, mods)
+
+    async def replace_one(self, an_id, data):
+        return self._coll.replace_one({'id': an_id}, data)
+
+    async def remove(self, dict_or_key):
+        criteria = dict_or_key if isinstance(dict_or_key, dict) else {'id': dict_or_key}
+        return self._coll.remove(self.modified_criteria(criteria))
+
+
+class MemoryUOP(memoryuop.MemoryStore, database.Database):
+    collection_class = MemoryCollection
+
+    def open_db(self, setup=None):
+        """
+        basic collections are set up on first await of ensure_basic_collections
+        rather than here as __init__ cannot await.
+        """
+        if self._database_new():
+            self._id = self._index.next()
+            self.database_by_id[self._id] = self
+
+    async def get_managed_collection(self, name, schema=None, tenant_modifier=None):
+        return self._wrapped(self.get_raw_collection(name), tenant_modifier)
+
+    async def get_standard_collection(self, kind, tenant_modifier=None, name=''):
+        name = name or uop_collection_names[kind]
+        return self._wrapped(self.get_raw_collection(name, kind), tenant_modifier)
+
+    async def get_instance_collection(self, cls):
+        return await self.get_managed_collection(self.random_collection_name())
+
+    async def commit(self):
+        base.Database.commit(self)
+
+
+db_service.DatabaseClass.register_db(MemoryUOP, 'memory', is_async=True)
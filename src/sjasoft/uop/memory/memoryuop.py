@@ -0,0 +1,168 @@
+"""
+In-memory uop adaptor.  Data lives in process wide named stores so several Database
+instances opened on the same name see the same data for the life of the process.
+Useful for profiling uop itself without a database server and as a small embedded store.
+
+Writes are visible immediately; transactions are accepted but abort does not roll back.
+"""
+
+from sjasoft.uop import database
+from sjasoft.uop import db_collection as db_coll
+from sjasoft.uop import db_service
+from sjasoft.uop.collections import uop_collection_names, meta_kinds
+from sjasoft.uop.memory.table import MemoryTable
+from sjasoft.utils import index
+
+stores = {}
+collection_kinds = {v: k for k, v in uop_collection_names.items()}
+
+
+def index_spec(kind):
+    """
+    (hashed, ordered) fields indexed by default for the standard collection of a kind
+    """
+    if kind == 'related':
+        return ('subject_id', 'assoc_id', 'object_id'), ()
+    if kind == 'changes':
+        return (), ('timestamp',)
+    if kind in meta_kinds or kind in ('tenants', 'users', 'schemas'):
+        return ('name',), ()
+    return (), ()
+
+
+class MemoryCollection(db_coll.DBCollection):
+
+    @property
+    def table(self):
+        return self._coll
+
+    def __contains__(self, an_id):
+        return self.contains_id(an_id)
+
+    @property
+    def by_name(self):
+        return {d['name']: d['id'] for d in self.find(only_cols=['id', 'name'])
+                if 'name' in d and 'id' in d}
+
+    def ensure_index(self, *fields, ordered=False):
+        for field in fields:
+            self._coll.add_index(field, ordered=ordered)
+
+    def count(self, criteria=None):
+        return self._coll.count(self.modified_criteria(criteria or {}))
+
+    def exists(self, criteria):
+        return self.count(criteria) > 0
+
+    def find(self, criteria=None, only_cols=None,
+             order_by=None, limit=None, ids_only=False):
+        if ids_only:
+            only_cols = [self.ID_Field]
+        return self._coll.find(self.modified_criteria(criteria or {}), only_cols=only_cols,
+                               order_by=order_by, limit=limit)
+
+    def find_iter(self, criteria=None, only_cols=None, order_by=None, batch_size=1000):
+        return self._coll.find_iter(self.modified_criteria(criteria or {}), only_cols=only_cols,
+                                    order_by=order_by, batch_size=batch_size)
+
+    def get(self, instance_id):
+        if self._with_tenant({}):
+            return super().get(instance_id)
+        return self._coll.get(instance_id)
+
+    def insert(self, **fields):
+        return self._coll.insert(fields)
+
+    def insert_many(self, items):
+        return self._coll.insert_many(items)
+
+    def update_many(self, mods_by_id):
+        if self._with_tenant({}):
+            return super().update_many(mods_by_id)
+        return self._coll.update_many(mods_by_id)
+
+    def bulk_load(self, *ids):
+        if len(ids) == 1 and isinstance(ids[0], (list, tuple, set)):
+            ids = ids[0]
+        return self.find({'id': {'$in': list(ids)}})
+
+    def update(self, selector, mods, partial=True):
+        if not isinstance(selector, dict):
+            selector = {'id': selector}
+        if not partial:
+            return self._coll.replace_one(self.modified_criteria(selector), mods)
+        return self._coll.update(self.modified_criteria(selector), mods)
+
+    def update_one(self, an_id, mods):
+        return self.update({'id': an_id}, mods)
+
+    def update_instance(self, an_id, **mods):
+        return self.update_one(an_id, mods)
+
+    def remove(self, dict_or_key):
+        criteria = dict_or_key if isinstance(dict_or_key, dict) else {'id': dict_or_key}
+        return self._coll.remove(self.modified_criteria(criteria))
+
+
+class MemoryStore(object):
+    """
+    Storage handling shared by the sync and async memory databases.
+    """
+    collection_class = MemoryCollection
+
+    @classmethod
+    def make_test_database(cls):
+        return cls(dbname=f'testdb_{index.make_id(32)}')
+
+    @classmethod
+    def make_named_database(cls, name):
+        return cls(dbname=name)
+
+    @classmethod
+    def existing_db_names(cls):
+        return list(stores)
+
+    @classmethod
+    def drop_named_database(cls, name):
+        stores.pop(name, None)
+
+    def __init__(self, dbname=None, **kwargs):
+        self._dbname = dbname or f'memory_{index.make_id(32)}'
+        self._tables = stores.setdefault(self._dbname, {})
+        super().__init__(**kwargs)
+
+    def drop_database(self):
+        stores.pop(self._dbname, None)
+        self._tables.clear()
+
+    def _db_has_collection(self, name):
+        return name in self._tables
+
+    def get_raw_collection(self, name, kind=None):
+        table = self._tables.get(name)
+        if table is None:
+            hashed, ordered = index_spec(kind or collection_kinds.get(name))
+            table = self._tables[name] = MemoryTable(name, hashed, ordered)
+        return table
+
+    def remove_collection(self, collection_name):
+        self._tables.pop(collection_name, None)
+
+    def _wrapped(self, table, tenant_modifier=None):
+        return self.collection_class(table, tenant_modifier=tenant_modifier)
+
+
+class MemoryUOP(MemoryStore, database.Database):
+
+    def get_managed_collection(self, name, schema=None, tenant_modifier=None):
+        return self._wrapped(self.get_raw_collection(name), tenant_modifier)
+
+    def get_standard_collection(self, kind, tenant_modifier=None, name=''):
+        name = name or uop_collection_names[kind]
+        return self._wrapped(self.get_raw_collection(name, kind), tenant_modifier)
+
+    def get_instance_collection(self, cls):
+        return self.get_managed_collection(self.random_collection_name())
+
+
+db_service.DatabaseClass.register_db(MemoryUOP, 'memory')
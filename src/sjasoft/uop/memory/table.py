@@ -0,0 +1,336 @@
+"""
+Raw in-memory storage used by the memory adaptor.  A MemoryTable plays the part a mongo collection
+or sql table plays for other adaptors: it holds documents and answers normalized criteria, using
+hash indexes for equality/membership tests and sorted indexes for range tests where it has them.
+"""
+
+import bisect
+import copy
+from sjasoft.uop import criteria as crit
+from sjasoft.uop.constraints import ConstraintViolation
+
+
+class HashIndex(object):
+    """value -> keys of the documents having that value for one field"""
+
+    def __init__(self, field):
+        self.field = field
+        self._keys = {}
+        self._values = {}
+
+    def add(self, key, doc):
+        value = doc.get(self.field)
+        try:
+            self._keys.setdefault(value, set()).add(key)
+        except TypeError:  # unhashable values are left to scanning
+            return
+        self._values[key] = value
+
+    def discard(self, key):
+        if key in self._values:
+            value = self._values.pop(key)
+            keys = self._keys.get(value)
+            keys.discard(key)
+            if not keys:
+                self._keys.pop(value)
+
+    def lookup(self, values):
+        res = set()
+        for value in values:
+            try:
+                res |= self._keys.get(value, set())
+            except TypeError:
+                return None
+        return res
+
+    def values(self):
+        return self._keys.keys()
+
+
+class SortedIndex(object):
+    """
+    Ordered values of one field.  The ordering is rebuilt lazily on the first
+    range lookup after a change so bulk loads do not pay for repeated insertion.
+    """
+
+    def __init__(self, field):
+        self.field = field
+        self._values = {}
+        self._ordered = None
+
+    def add(self, key, doc):
+        value = doc.get(self.field)
+        if value is not None:
+            self._values[key] = value
+            self._ordered = None
+
+    def discard(self, key):
+        if self._values.pop(key, None) is not None:
+            self._ordered = None
+
+    def _ensure_ordered(self):
+        if self._ordered is None:
+            try:
+                pairs = sorted((v, k) for k, v in self._values.items())
+            except TypeError:  # mixed value types cannot be ranged over
+                return None
+            self._ordered = ([p[0] for p in pairs], [p[1] for p in pairs])
+        return self._ordered
+
+    def range(self, op, value):
+        ordered = self._ensure_ordered()
+        if ordered is None:
+            return None
+        values, keys = ordered
+        try:
+            if op == 'gt':
+                return set(keys[bisect.bisect_right(values, value):])
+            if op == 'gte':
+                return set(keys[bisect.bisect_left(values, value):])
+            if op == 'lt':
+                return set(keys[:bisect.bisect_left(values, value)])
+            if op == 'lte':
+                return set(keys[:bisect.bisect_right(values, value)])
+        except TypeError:
+            return None
+
+
+def sort_documents(docs, order_by):
+    """
+    Sort documents by the given fields.  A field name prefixed with '-' sorts descending.
+    Documents missing a field sort after those having it in either direction.
+    """
+    for field in reversed(list(order_by)):
+        descending = field.startswith('-')
+        name = crit.field_name(field.lstrip('-'))
+        present = [d for d in docs if d.get(name) is not None]
+        absent = [d for d in docs if d.get(name) is None]
+        try:
+            present.sort(key=lambda d: d[name], reverse=descending)
+        except TypeError:
+            present.sort(key=lambda d: str(d[name]), reverse=descending)
+        docs[:] = present + absent
+    return docs
+
+
+def project(docs, only_cols):
+    """
+    Project documents to the given columns.  A single column gives a list of its values
+    as the rest of uop expects from find(..., only_cols=[col]).
+    """
+    if not only_cols:
+        return [dict(d) for d in docs]
+    cols = [crit.field_name(c) for c in only_cols]
+    if len(cols) == 1:
+        col = cols[0]
+        return [d[col] for d in docs if col in d]
+    return [{c: d[c] for c in cols if c in d} for d in docs]
+
+
+class MemoryTable(object):
+    def __init__(self, name, hashed=(), ordered=()):
+        self.name = name
+        self._rows = {}
+        self._next_key = 0
+        self._hashed = {}
+        self._ordered = {}
+        self.add_index('id')
+        for field in hashed:
+            self.add_index(field)
+        for field in ordered:
+            self.add_index(field, ordered=True)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def add_index(self, field, ordered=False):
+        field = crit.field_name(field)
+        indexes = self._ordered if ordered else self._hashed
+        if field not in indexes:
+            index = (SortedIndex if ordered else HashIndex)(field)
+            for key, doc in self._rows.items():
+                index.add(key, doc)
+            indexes[field] = index
+        return indexes[field]
+
+    def indexed_fields(self):
+        return set(self._hashed), set(self._ordered)
+
+    def _all_indexes(self):
+        return list(self._hashed.values()) + list(self._ordered.values())
+
+    def _index_doc(self, key, doc):
+        for index in self._all_indexes():
+            index.add(key, doc)
+
+    def _unindex_doc(self, key):
+        for index in self._all_indexes():
+            index.discard(key)
+
+    def _candidates(self, node):
+        """
+        Keys of documents that may satisfy node as found from indexes or None
+        if the node cannot be narrowed by the available indexes.
+        """
+        kind = node[0]
+        if kind == 'cmp':
+            _, field, op, value = node
+            if op == 'eq' and value is not None and field in self._hashed:
+                return self._hashed[field].lookup([value])
+            if op == 'in' and field in self._hashed:
+                return self._hashed[field].lookup(value)
+            if op in crit.range_ops and field in self._ordered:
+                return self._ordered[field].range(op, value)
+            return None
+        if kind == 'and':
+            found = [c for c in (self._candidates(n) for n in node[1]) if c is not None]
+            if not found:
+                return None
+            found.sort(key=len)
+            res = set(found[0])
+            for other in found[1:]:
+                res &= other
+                if not res:
+                    break
+            return res
+        if kind == 'or':
+            res = set()
+            for child in node[1]:
+                found = self._candidates(child)
+                if found is None:
+                    return None
+                res |= found
+            return res
+        return None
+
+    def _matching_keys(self, criteria):
+        node = crit.normalize(criteria)
+        candidates = self._candidates(node)
+        if candidates is None:
+            keys = list(self._rows)
+        else:
+            keys = sorted(candidates)
+        if node == crit.ALL:
+            return keys
+        test = crit.matcher(node)
+        return [k for k in keys if test(self._rows[k])]
+
+    def _id_key(self, an_id):
+        keys = self._hashed['id'].lookup([an_id])
+        return next(iter(keys)) if keys else None
+
+    def get(self, an_id):
+        key = self._id_key(an_id)
+        return dict(self._rows[key]) if key is not None else None
+
+    def find(self, criteria=None, only_cols=None, order_by=None, limit=None):
+        docs = [self._rows[k] for k in self._matching_keys(criteria)]
+        if order_by:
+            docs = sort_documents(docs, order_by)
+        if limit:
+            docs = docs[:limit]
+        return project(docs, only_cols)
+
+    def find_iter(self, criteria=None, only_cols=None, order_by=None, batch_size=1000):
+        """
+        Lazily produce what find would return.  Only the matching keys are gathered up
+        front; documents are copied and projected a batch at a time.
+        """
+        keys = self._matching_keys(criteria)
+        starts = range(0, len(keys), batch_size)
+        if order_by:
+            docs = sort_documents([self._rows[k] for k in keys], order_by)
+            batches = (docs[i:i + batch_size] for i in starts)
+        else:
+            batches = ([self._rows[k] for k in keys[i:i + batch_size] if k in self._rows] for i in starts)
+        for batch in batches:
+            yield from project(batch, only_cols)
+
+    def count(self, criteria=None):
+        if not criteria:
+            return len(self._rows)
+        return len(self._matching_keys(criteria))
+
+    def _prepared(self, doc):
+        doc = copy.deepcopy(dict(doc))
+        if '_id' in doc and 'id' not in doc:
+            doc['id'] = doc.pop('_id')
+        return doc
+
+    def _store(self, doc):
+        key = self._next_key
+        self._next_key += 1
+        self._rows[key] = doc
+        self._index_doc(key, doc)
+        return dict(doc)
+
+    def insert(self, doc):
+        return self.insert_many([doc])[0]
+
+    def insert_many(self, docs):
+        """insert all docs or, if any id is already present or repeated, none of them"""
+        docs = [self._prepared(d) for d in docs]
+        ids = [d['id'] for d in docs if d.get('id') is not None]
+        for an_id in ids:
+            if self._id_key(an_id) is not None:
+                raise ConstraintViolation('unique id', data={'id': an_id})
+        if len(set(ids)) != len(ids):
+            raise ConstraintViolation('unique id', data={'ids': ids})
+        return [self._store(d) for d in docs]
+
+    def _modify(self, key, changer):
+        self._unindex_doc(key)
+        doc = self._rows[key]
+        changer(doc)
+        self._index_doc(key, doc)
+
+    def update(self, criteria, mods):
+        mods = copy.deepcopy(dict(mods))
+        mods.pop('id', None)
+        mods.pop('_id', None)
+        keys = self._matching_keys(criteria)
+        for key in keys:
+            self._modify(key, lambda doc: doc.update(mods))
+        return len(keys)
+
+    def update_many(self, mods_by_id):
+        count = 0
+        for an_id, mods in mods_by_id.items():
+            key = self._id_key(an_id)
+            if key is not None:
+                mods = copy.deepcopy(dict(mods))
+                mods.pop('id', None)
+                mods.pop('_id', None)
+                self._modify(key, lambda doc: doc.update(mods))
+                count += 1
+        return count
+
+    def replace_one(self, criteria, data):
+        keys = self._matching_keys(criteria)
+        if not keys:
+            return 0
+        key = keys[0]
+        an_id = self._rows[key].get('id')
+        data = copy.deepcopy(dict(data))
+        data.pop('_id', None)
+        if an_id is not None:
+            data['id'] = an_id
+
+        def replace(doc):
+            doc.clear()
+            doc.update(data)
+
+        self._modify(key, replace)
+        return 1
+
+    def remove(self, criteria=None):
+        keys = self._matching_keys(criteria)
+        for key in keys:
+            self._unindex_doc(key)
+            self._rows.pop(key)
+        return len(keys)
+
+    def drop(self):
+        self._rows.clear()
+        self._hashed = {f: HashIndex(f) for f in self._hashed}
+        self._ordered = {f: SortedIndex(f) for f in self._ordered}
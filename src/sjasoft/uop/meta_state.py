@@ -0,0 +1,58 @@
+"""
+Incremental maintenance of an Interface's MetaContext.
+
+An Interface keeps the raw metadata records its MetaContext was built from.  After it applies
+a changeset only the metadata kinds the changeset touches are patched: deleted records are
+dropped and inserted or modified ones are re-read by id, so they carry whatever the database
+added on write.  A changeset without metadata changes leaves the context as it is.
+
+The Database counts metadata changes per tenant.  An Interface remembers the counts its records
+reflect.  If they moved other than by the interface's own changes, another interface changed
+the metadata and the records are reloaded in full.
+"""
+
+from sjasoft.uop.collections import meta_kinds
+
+
+def changed_kinds(changes):
+    """metadata kinds with changes in the changeset"""
+    res = []
+    for kind in meta_kinds:
+        component = getattr(changes, kind, None)
+        if component is not None and component.has_changes():
+            res.append(kind)
+    return res
+
+
+def changed_ids(component):
+    """ids of the records a CrudChanges component inserts or modifies"""
+    return list(component.inserted) + list(component.modified)
+
+
+def record_id(record):
+    return record.get('id', record.get('_id'))
+
+
+class MetaState(object):
+    """
+    Raw metadata records by kind and id together with the metadata versions they reflect
+    """
+
+    def __init__(self, metadata, versions):
+        self.records = {kind: {record_id(r): r for r in records} for kind, records in metadata.items()}
+        self.versions = versions
+
+    def metadata(self):
+        """the records in the form of Database.collections.metadata()"""
+        return {kind: list(records.values()) for kind, records in self.records.items()}
+
+    def patch(self, kind, deleted, found):
+        """
+        :param deleted: ids of deleted records
+        :param found: current records of the inserted and modified ids
+        """
+        records = self.records.setdefault(kind, {})
+        for an_id in deleted:
+            records.pop(an_id, None)
+        for record in found:
+            records[record_id(record)] = record
@@ -0,0 +1,122 @@
+"""
+Keyset (seek) pagination.
+
+A page is read in the caller's order extended by the fields identifying a record, its id
+or for associations the association triple, so the order is total.  The
+continuation token returned with a page encodes the order values of its last record.  The
+next page is read with criteria selecting only the records ordered after those values, so a
+page deep into a large extension costs what the first page does.  Records missing an order
+value sort after those having it in either direction, as the memory and sqlite adaptors
+order them.
+"""
+
+import base64
+import bisect
+import json
+from sjasoft.uop import criteria as crit
+from sjasoft.uop.exceptions import InvalidContinuation
+
+
+def sort_fields(order_by, key_fields):
+    """order_by with those of the key fields it does not already order by appended"""
+    fields = list(order_by or ())
+    ordered = field_names(fields)
+    fields.extend(k for k in key_fields if crit.field_name(k) not in ordered)
+    return fields
+
+
+def field_names(fields):
+    return [crit.field_name(f.lstrip('-')) for f in fields]
+
+
+def encode(fields, values):
+    data = json.dumps({'order_by': list(fields), 'after': list(values)}, default=str)
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def decode(token, fields):
+    """
+    :return: the order values encoded in token
+    :raises InvalidContinuation: if token is malformed or was made for a different order
+    """
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token.encode()))
+        after = data['after']
+        matches = data['order_by'] == list(fields) and len(after) == len(fields)
+    except (ValueError, TypeError, KeyError, AttributeError):
+        raise InvalidContinuation(token)
+    if not matches:
+        raise InvalidContinuation(token)
+    return after
+
+
+def after_criteria(fields, values):
+    """criteria selecting the records ordered after a record with the given order values"""
+    clauses = []
+    names = field_names(fields)
+    for i, (field, name, value) in enumerate(zip(fields, names, values)):
+        if value is None:  # nothing sorts after a missing value of this field
+            continue
+        prefix = dict(zip(names[:i], values[:i]))
+        op = '$lt' if field.startswith('-') else '$gt'
+        for after in ({name: {op: value}}, {name: None}):
+            clause = dict(prefix)
+            clause.update(after)
+            clauses.append(clause)
+    return {'$or': clauses} if clauses else {'id': {'$in': []}}
+
+
+def page_criteria(criteria, fields, continuation):
+    if not continuation:
+        return criteria or {}
+    after = after_criteria(fields, decode(continuation, fields))
+    return {'$and': [criteria, after]} if criteria else after
+
+
+def fetch_columns(only_cols, fields):
+    """columns to fetch so the order values of the last record of a page are known"""
+    if not only_cols:
+        return None
+    cols = [crit.field_name(c) for c in only_cols]
+    return cols + [n for n in field_names(fields) if n not in cols]
+
+
+def key_values(record, fields):
+    if not isinstance(record, dict):  # a single fetched column gives bare values
+        return [record]
+    return [record.get(n) for n in field_names(fields)]
+
+
+def projected(records, only_cols, fetched):
+    """records fetched with the fetched columns as find would give them for only_cols"""
+    if not only_cols or len(fetched) == len(only_cols):
+        return records
+    cols = [crit.field_name(c) for c in only_cols]
+    if len(cols) == 1:
+        col = cols[0]
+        return [r[col] for r in records if col in r]
+    return [{c: r[c] for c in cols if c in r} for r in records]
+
+
+def page(records, only_cols, fetched, fields, limit):
+    """
+    :param records: at most limit records read for the page
+    :return: (records projected to only_cols, continuation or None after the last page)
+    """
+    continuation = None
+    if limit and len(records) == limit:
+        continuation = encode(fields, key_values(records[-1], fields))
+    return projected(records, only_cols, fetched), continuation
+
+
+def page_ids(ids, limit, continuation=None):
+    """
+    A page of ids, such as the results of a query, in id order.
+    :return: (ids, continuation or None after the last page)
+    """
+    fields = ['id']
+    ordered = sorted(ids)
+    start = 0
+    if continuation:
+        start = bisect.bisect_right(ordered, decode(continuation, fields)[0])
+    return page(ordered[start:start + limit], None, None, fields, limit)
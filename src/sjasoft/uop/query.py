@@ -1,9 +1,15 @@
-from sjasoft.utils.category import binary_partition, identity_function as identity
+from sjasoft.utils.category import binary_partition, partition, identity_function as identity
+import asyncio
+import operator
 from collections import defaultdict
 from functools import reduce, partial
 from sjasoft.uopmeta.schemas import meta
 from sjasoft.uopmeta import oid
 from sjasoft.uop import utils
+from sjasoft.uop import columnar
+from sjasoft.uop.hierarchy import Hierarchy
+from sjasoft.uop.idsets import IdBitmap, IdSet
+from sjasoft.uop.query_plan import resolved
 from sjasoft.utils.cw_logging import getLogger
 
 logger = getLogger(__file__)
@@ -141,36 +147,59 @@ async def evaluate_classes(dbi, classes, to_filter=None):
 
 property_operations = ('$gt', '$lt', '$gte', '$lte', '$neq', '$eq')
 
+bitmap_threshold = 4096  # combined size of two id sets above which they are combined as IdSets
+
+
+def is_negated(ids):
+    return getattr(ids, 'negated', False)
+
 
 class NegatableSet(set):
+    """
+    A set of ids or, when negated, every id except those in it.  Combining with & and | is
+    exact whichever side is negated: ~a & b is b - a, ~a | b is ~(a - b), ~a & ~b is ~(a | b)
+    and ~a | ~b is ~(a & b).
+    """
+
     def __init__(self, items=None, negated=False):
         super().__init__(items or [])
         self._negated = negated
 
+    @property
+    def negated(self):
+        return self._negated
+
+    def __bool__(self):
+        return self._negated or len(self) > 0
+
     def __and__(self, other_set):
+        if isinstance(other_set, IdSet):
+            return NotImplemented
         self_negated = self._negated
-        other_negated = isinstance(other_set, NegatableSet) and other_set._negated
-        not_both = self_negated ^ other_negated
-        if not_both:
-            if other_negated:
-                return self - other_set
-            else:
-                return other_set - self
-        else:
-            raw = super().__and__(other_set)
-            return self.__class__(raw, self_negated)
+        other_negated = is_negated(other_set)
+        if self_negated and other_negated:
+            return self.__class__(set.union(self, other_set), True)
+        if self_negated:
+            return set(other_set).difference(self)
+        if other_negated:
+            return set(self).difference(other_set)
+        return self.__class__(set.intersection(self, other_set))
 
     def __or__(self, other_set):
+        if isinstance(other_set, IdSet):
+            return NotImplemented
         self_negated = self._negated
-        other_negated = isinstance(other_set, NegatableSet) and other_set._negated
-        not_both = self_negated ^ other_negated
-        if not_both:
-            # TODO think on whether there is a better way
-            logger.warn('ignoring to expensive not clause in OR concext')
-            return other_set if self._negated else self
-        else:
-            raw = super().__or__(other_set)
-            return self.__class__(raw, self._negated)
+        other_negated = is_negated(other_set)
+        if self_negated and other_negated:
+            return self.__class__(set.intersection(self, other_set), True)
+        if self_negated:
+            return self.__class__(set.difference(self, other_set), True)
+        if other_negated:
+            return self.__class__(set(other_set).difference(self), True)
+        return self.__class__(set.union(self, other_set))
+
+    __rand__ = __and__
+    __ror__ = __or__
 
     def filter(self, items, key=identity):
         keyed = {key(i): i for i in items}
@@ -183,10 +212,14 @@ class NegatableSet(set):
 
 class ComponentEvaluator:
     @classmethod
-    def evaluator(cls, component, in_context, object_ids=None):
-        return cls(component, in_context, object_ids)
+    def evaluator(cls, component, in_context, object_ids=None, class_context=None, path=()):
+        return cls(component, in_context, object_ids, class_context, path)
 
-    def __init__(self, component, in_context, object_ids=None, class_context=None):
+    def __init__(self, component, in_context, object_ids=None, class_context=None, path=()):
+        """
+        :param path: indexes of the clauses leading to component from the root of the query
+        """
+        self._path = path
         self._object_ids = object_ids
         self._class_filter = NegatableSet(class_context)
         self._in_context = in_context
@@ -205,6 +238,49 @@ class ComponentEvaluator:
     def metacontext(self):
         return self._in_context.metacontext
 
+    @property
+    def hierarchy(self):
+        return self._in_context.hierarchy
+
+    @property
+    def interner(self):
+        return self._in_context.interner
+
+    def combined(self, op, ids, other):
+        """
+        ids op other for op operator.and_ or operator.or_.  The two are combined as IdSets
+        when either already is one or they are large enough to be worth interning.
+        """
+        ids = set() if ids is None else ids
+        other = set() if other is None else other
+        interner = self.interner
+        if interner is not None and not isinstance(ids, IdSet) and not isinstance(other, IdSet):
+            if len(ids) + len(other) >= bitmap_threshold:
+                ids = IdSet.of(interner, ids)
+        return op(ids, other)
+
+    async def positive(self, ids, class_ids=None):
+        """
+        ids or, when they are negated, the instances of class_ids not excluded by them.
+        :param class_ids: classes the ids are drawn from, by default all concrete classes
+        """
+        if not is_negated(ids):
+            return ids
+        universe = await self._in_context.universe(class_ids)
+        return self.combined(operator.and_, universe, ids)
+
+    async def union_of(self, fun, items):
+        """union of the id sets fun gives for items"""
+        found = await asyncio.gather(*[fun(item) for item in items])
+        return reduce(partial(self.combined, operator.or_), found, set())
+
+    async def intersection_of(self, fun, items):
+        """intersection of the id sets fun gives for items"""
+        found = await asyncio.gather(*[fun(item) for item in items])
+        if not found:
+            return set()
+        return reduce(partial(self.combined, operator.and_), found)
+
     def get_named(self, kind, names):
         by_name = getattr(self.metacontext, kind).by_name
         return {by_name[n].id for n in names}
@@ -244,12 +320,12 @@ class ComponentEvaluator:
 
     async def evaluate_tags(self, component: meta.TagsComponent):
         eval_tag = lambda tag: self.dbi.get_tagset(tag)
-        tag_ids = [self.metacontext.tags.by_name[t][id] for t in component.names]
+        tag_ids = [self.metacontext.tags.by_name[t].id for t in component.names]
         raw = set()
         if component.application in ('any', 'none'):
-            raw = await utils.a_set_or(eval_tag, tag_ids)
+            raw = await self.union_of(eval_tag, tag_ids)
         elif component.application == 'all':
-            raw = await utils.a_set_and(eval_tag, tag_ids)
+            raw = await self.intersection_of(eval_tag, tag_ids)
         if component.application == 'none':
             return NegatableSet(raw, True)
         else:
@@ -257,14 +333,14 @@ class ComponentEvaluator:
 
     async def evaluate_groups(self, component: meta.GroupsComponent):
         eval_tag = lambda tag: self.dbi.get_groupset(tag)
-        group_ids = {self.metacontext.groups.by_name[t][id] for t in component.names}
+        group_ids = {self.metacontext.groups.by_name[t].id for t in component.names}
         raw = set()
         if component.application in ('any', 'none'):
-            group_ids = utils.set_or(self.metacontext.subgroups, group_ids)
-            raw = await utils.a_set_or(eval_tag, group_ids)
+            group_ids = self.hierarchy.union('groups', group_ids)
+            raw = await self.union_of(eval_tag, group_ids)
         elif component.application == 'all':
-            group_ids = utils.set_and(self.metacontext.subgroups, group_ids)
-            raw = await utils.a_set_and(eval_tag, group_ids)
+            group_ids = self.hierarchy.intersection('groups', group_ids)
+            raw = await self.intersection_of(eval_tag, group_ids)
         if component.application == 'none':
             return NegatableSet(raw, True)
         else:
@@ -283,8 +359,11 @@ class ComponentEvaluator:
 
     async def evaluate_or(self, component: meta.OrQuery):
         evaluator = partial(self.sub_eval, class_context=self._class_context)
-        fun = lambda child: evaluator(child)()
-        return utils.a_set_or(fun, component.components)
+        fun = lambda indexed: evaluator(indexed[1], path=self._path + (indexed[0],))()
+        found = await self.union_of(fun, list(enumerate(component.components)))
+        if self._class_context:
+            found = await self.positive(found, self._class_context)
+        return found
 
     def _combine_classes(self, class_specs: meta.List[meta.ClassComponent], is_and):
         """
@@ -308,7 +387,8 @@ class ComponentEvaluator:
         by_name = self._in_context.classes.by_name
         positive = set()
         negative = set()
-        all_subs = self.metacontext.subclasses(by_name['PersistentObject'].id)
+        hierarchy = self.hierarchy
+        all_subs = hierarchy.closure('classes', by_name['PersistentObject'].id)
         pos_specs, neg_specs = binary_partition(class_specs, lambda cs: cs.positive)
 
         def clsids(spec):
@@ -319,7 +399,7 @@ class ComponentEvaluator:
             cid = by_name[spec.cls_name].id
             res = {cid}
             if spec.include_subclasses:
-                res.update(self.metacontext.subclasses(cid))
+                res |= hierarchy.closure('classes', cid)
             return res
 
         res = set()
@@ -346,25 +426,34 @@ class ComponentEvaluator:
         return res
 
     async def evaluate_and(self, component: meta.AndQuery):
-        class_specs, non_class = binary_partition(component.components,
-                                                  lambda x: isinstance(x, meta.ClassComponent))
+        class_specs, non_class = binary_partition(enumerate(component.components),
+                                                  lambda x: isinstance(x[1], meta.ClassComponent))
         class_context = None
         if class_specs:
-            class_context = self._combine_classes(class_specs)
+            class_context = self._combine_classes([spec for _, spec in class_specs], True)
             if class_context is not None:
                 if not class_context:
                     return set()
+        if not non_class:
+            return await evaluate_classes(self.dbi, class_context) if class_context else set()
 
+        plan = getattr(self._in_context, 'plan', None)
+        if plan is not None:
+            non_class = plan.ordered(self._path, non_class)
         evaluator = partial(self.sub_eval, class_context=class_context)
-        first = non_class[0]
+        first_index, first = non_class[0]
         rest = non_class[1:]
-        obj_ids = await evaluator(first)()
+        obj_ids = await evaluator(first, path=self._path + (first_index,))()
         if obj_ids:
-            for child in rest:
-                ids = await evaluator(child, object_ids=obj_ids)()
-                obj_ids &= ids
+            for index, child in rest:
+                # only a positive result can narrow what the following clauses look at
+                candidates = None if is_negated(obj_ids) else obj_ids
+                ids = await evaluator(child, object_ids=candidates, path=self._path + (index,))()
+                obj_ids = self.combined(operator.and_, obj_ids, ids)
                 if not obj_ids:
                     return set()
+        if class_context:
+            obj_ids = await self.positive(obj_ids, class_context)
         return obj_ids
 
     async def evaluate_attribute(self, component: meta.AttributeComponent):
@@ -384,33 +473,34 @@ class ComponentEvaluator:
         :return:
         """
         cls_by_id = self._in_context.classes.by_id
+        dbi = self._in_context.dbi
 
         def check_class(clsid):
-            cls = cls_by_id(clsid)
-            if not cls.is_abstract:
+            cls = cls_by_id.get(clsid)
+            if cls and not cls.is_abstract:
                 return any(a.name == component.attr_name for a in cls.attributes)
 
-        expr = {component.operate: {component.attr_name: component.value}}
-        find_objects = lambda coll: coll.ids_only(expr)
         if self._object_ids:
-            by_id = defaultdict(list)
-            to_check = []
-            for o in self._object_ids:
-                by_id[oid.oid_class(o)].append(o)
-            for cid, oids in by_id.items():
-                to_check.extend(oids)
-            fun = component.obj_eval()
-            return utils.a_set_or(fun, to_check)
+            res = set()
+            for cid, oids in partition(self._object_ids, oid.oid_class).items():
+                if check_class(cid):
+                    coll = await dbi.extension(cid)
+                    objects = await coll.bulk_load(oids)
+                    res |= columnar.filter_objects(objects, component.attr_name, component.operate,
+                                                   component.value, id_field=coll.ID_Field)
+            return res
         else:
-            classes = []
-            test = lambda cls: check_class(cls.id) and not cls.is_abstract
+            expr = {component.operate: {component.attr_name: component.value}}
             if self._class_context:
-                cids = [check_class(cid) for cid in self._class_context]
+                cids = [cid for cid in self._class_context if check_class(cid)]
             else:
-                cids = [check_class(cid) for cid in self.metacontext.classes.by_id]
-            colls = [self._in_context.dbi.extension(cid) for cid in cids]
-            fun = lambda coll: coll.find(expr)
-            return await utils.a_set_or(fun, colls)
+                cids = [cid for cid in self.metacontext.classes.by_id if check_class(cid)]
+
+            async def find_ids(cid):
+                coll = await dbi.extension(cid)
+                return await coll.ids_only(expr)
+
+            return await self.union_of(find_ids, cids)
 
     async def __call__(self):
         component = self._component
@@ -430,20 +520,70 @@ class ComponentEvaluator:
 
 
 class QueryEvaluator2:
-    def __init__(self, query: meta.MetaQuery, dbi, metacontext: meta.MetaContext = None):
+    def __init__(self, query: meta.MetaQuery, dbi, metacontext: meta.MetaContext = None, planner=None):
+        """
+        :param planner: optional query_plan.QueryPlanner ordering AND clauses by estimated selectivity
+        """
         self._object_ids = set()
         self._metacontext = metacontext or dbi.metacontext
+        self._query_id = getattr(query, 'id', None)
         self._component = query.query
         self._dbi = dbi
+        self._planner = planner
+        self._hierarchy = None
+        self._interner = None
+        self._universes = {}
+        self.plan = None
 
     @property
     def metacontext(self):
         return self._metacontext
 
+    @property
+    def hierarchy(self):
+        if self._hierarchy is None:
+            for_context = getattr(self._dbi, 'hierarchy_for', None)
+            self._hierarchy = for_context(self._metacontext) if for_context else Hierarchy(self._metacontext)
+        return self._hierarchy
+
+    @property
+    def interner(self):
+        """the IdInterner of the tenant or None if the dbi keeps none"""
+        if self._interner is None:
+            id_interner = getattr(self._dbi, 'id_interner', None)
+            self._interner = id_interner() if id_interner else None
+        return self._interner
+
+    async def universe(self, class_ids=None):
+        """
+        The instances of class_ids, by default of all concrete classes.  Where the dbi keeps
+        ExtensionBitmaps they are the union of the cached bitmap of each class so no ids
+        are read or copied to evaluate a negation.
+        """
+        if class_ids is None:
+            class_ids = [cid for cid, cls in self._metacontext.classes.by_id.items() if not cls.is_abstract]
+        key = frozenset(class_ids)
+        found = self._universes.get(key)
+        if found is None:
+            extension_bitmap = getattr(self._dbi, 'extension_bitmap', None)
+            if extension_bitmap and self.interner is not None:
+                bitmap = IdBitmap()
+                for cid in key:
+                    bitmap = bitmap | await resolved(extension_bitmap(cid))
+                found = IdSet(self.interner, bitmap)
+            else:
+                found = await evaluate_classes(self._dbi, key)
+            self._universes[key] = found
+        return found
+
     @property
     def dbi(self):
         return self._dbi
 
-    def __call__(self):
+    async def __call__(self):
+        if self._planner:
+            self.plan = await self._planner.plan(self._query_id, self._component,
+                                                 self._dbi, self._metacontext)
         evaluator = ComponentEvaluator(self._component, in_context=self)
-        return evaluator()
+        result = await evaluator.positive(await evaluator())
+        return set(result) if isinstance(result, IdSet) else result
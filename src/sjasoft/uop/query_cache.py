@@ -0,0 +1,188 @@
+"""
+Caching of query results.
+
+Results are cached per tenant under the canonical form of the query and stamped with the
+tenant's data version at the time the query was evaluated.  Database.apply_changes bumps the
+version of the tenant for every changeset applied and records which dependencies the changeset
+touched.  A dependency is something a query clause reads:
+    ('class', cls_id)                    instances of a class, their existence and attributes
+    ('subject', role_id, subject_id)     the roleset of a subject, e.g. the objects having a tag
+    ('role', role_id)                    any association by the role
+    ('any', an_id)                       any association with an_id as subject or object
+A result cached without dependencies is valid only while the tenant's version is unchanged.
+A result cached with dependencies stays valid until one of them changes.  Metadata changes
+and object deletes, whose effects the changeset does not fully list, invalidate everything.
+"""
+
+import json
+import threading
+from collections import OrderedDict
+from sjasoft.uopmeta import oid
+from sjasoft.uopmeta.schemas import meta
+
+metadata_kinds = ('attributes', 'classes', 'roles', 'tags', 'groups', 'queries')
+
+
+def canonical(query):
+    if isinstance(query, meta.BaseModel):
+        query = query.dict()
+    return json.dumps(query, sort_keys=True, default=str)
+
+
+def changed_dependencies(changes):
+    """
+    :param changes: a ChangeSet
+    :return: set of dependencies changed or None if everything may have changed
+    """
+    for kind in metadata_kinds:
+        if getattr(changes, kind).has_changes():
+            return None
+    for kind in ('tagged', 'grouped'):  # association kinds of the older async changesets
+        component = getattr(changes, kind, None)
+        if component is not None and component.has_changes():
+            return None
+    objects = changes.objects
+    if objects.deleted:
+        return None
+    res = {('class', oid.oid_class(an_id)) for an_id in list(objects.inserted) + list(objects.modified)}
+    related = changes.related
+    for item in list(related.inserted) + list(related.deleted):
+        data = dict(item)
+        role_id = data.get('assoc_id')
+        res.add(('role', role_id))
+        res.add(('subject', role_id, data.get('subject_id')))
+        res.add(('any', data.get('subject_id')))
+        res.add(('any', data.get('object_id')))
+    return res
+
+
+def with_descendants(metacontext, method, ids):
+    """ids together with those below them by method, e.g. 'subgroups', of metacontext"""
+    res = set(ids)
+    below = getattr(metacontext, method, None)
+    if below is not None:
+        for an_id in ids:
+            res.update(below(an_id) or ())
+    return res
+
+
+def query_dependencies(component, metacontext):
+    """
+    Dependencies of a query component or None if they cannot be determined more
+    narrowly than the whole tenant's data.
+    """
+    role_id = lambda name: metacontext.roles.by_name[name].id
+    if isinstance(component, meta.TagsComponent):
+        if component.application == 'none':
+            return None
+        applies = role_id('tag_applies')
+        tag_ids = with_descendants(metacontext, 'subtags', [metacontext.tags.by_name[n].id for n in component.names])
+        return {('subject', applies, tag_id) for tag_id in tag_ids}
+    if isinstance(component, meta.GroupsComponent):
+        if component.application == 'none':
+            return None
+        contains = role_id('group_contains')
+        group_ids = with_descendants(metacontext, 'subgroups',
+                                     [metacontext.groups.by_name[n].id for n in component.names])
+        res = {('subject', contains, group_id) for group_id in group_ids}
+        res.add(('role', role_id('contains_group')))
+        return res
+    if isinstance(component, meta.RelatedTo):
+        if component.negated:
+            return None
+        if component.role:
+            return {('subject', role_id(component.role), component.obj_id)}
+        return {('any', component.obj_id)}
+    if isinstance(component, meta.AttributeComponent):
+        return {('class', cls.id) for cls in metacontext.classes.by_id.values()
+                if any(a.name == component.attr_name for a in cls.attributes)}
+    if isinstance(component, meta.ClassComponent):
+        cid = metacontext.classes.by_name[component.cls_name].id
+        res = {('class', cid)}
+        if component.include_subclasses:
+            res.update(('class', sub) for sub in metacontext.subclasses(cid))
+        return res
+    if isinstance(component, (meta.AndQuery, meta.OrQuery)):
+        res = set()
+        for child in component.components:
+            deps = query_dependencies(child, metacontext)
+            if deps is None:
+                return None
+            res |= deps
+        return res
+    return None
+
+
+class DataVersions(object):
+    """
+    Data version of one tenant and the version at which each dependency last changed
+    """
+
+    def __init__(self):
+        self.version = 0
+        self._everything = 0
+        self._changed = {}
+        self._lock = threading.Lock()
+
+    def bump(self, changes=None):
+        with self._lock:
+            self.version += 1
+            deps = changed_dependencies(changes) if changes is not None else None
+            if deps is None:
+                self._everything = self.version
+            else:
+                for dep in deps:
+                    self._changed[dep] = self.version
+
+    def valid(self, version, dependencies=None):
+        """whether a result computed at version with the given dependencies is still current"""
+        if dependencies is None:
+            return version == self.version
+        if self._everything > version:
+            return False
+        return all(self._changed.get(dep, 0) <= version for dep in dependencies)
+
+
+class QueryResultCache(object):
+    """
+    LRU of query results shared by the interfaces of a database
+    """
+
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, tenant_id, key, versions):
+        """
+        :param versions: DataVersions the result depends on, those of the tenant and
+        of any collections shared with it
+        :return: the cached result or None
+        """
+        with self._lock:
+            entry = self._entries.get((tenant_id, key))
+            if entry is not None:
+                stamps, dependencies, result = entry
+                if all(v.valid(stamp, dependencies) for v, stamp in zip(versions, stamps)):
+                    self._entries.move_to_end((tenant_id, key))
+                    self.hits += 1
+                    return result
+                del self._entries[(tenant_id, key)]
+            self.misses += 1
+            return None
+
+    def set(self, tenant_id, key, stamps, dependencies, result):
+        """
+        :param stamps: version of each of the DataVersions read before the result was computed
+        """
+        with self._lock:
+            self._entries[(tenant_id, key)] = (tuple(stamps), dependencies, result)
+            self._entries.move_to_end((tenant_id, key))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
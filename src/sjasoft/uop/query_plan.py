@@ -0,0 +1,176 @@
+"""
+Cost based ordering of the clauses of AND queries.
+
+ComponentEvaluator.evaluate_and evaluates its first non class clause and narrows the result by
+each following clause in turn, so it does the least work when the most selective clause comes
+first.  A QueryPlanner compiles a MetaQuery into a QueryPlan holding, for each AND clause in
+the query tree, the order in which to evaluate its children.  The order comes from cardinality
+estimates drawn from cheap counts on the related collection and on class extensions.  Plans are
+cached by query id so saved queries that are run repeatedly are planned once.
+"""
+
+import inspect
+import json
+from collections import OrderedDict
+from sjasoft.uopmeta.schemas import meta
+
+unbounded = float('inf')  # estimate for clauses that can only be evaluated negated
+
+attribute_selectivity = {
+    '$eq': 0.05,
+    '$neq': 1.0,
+    '$ne': 1.0,
+    '$gt': 0.33,
+    '$gte': 0.33,
+    '$lt': 0.33,
+    '$lte': 0.33,
+    '$regex': 0.25,
+}
+
+
+async def resolved(value):
+    """value or its result when it is awaitable so sync and async interfaces can be counted alike"""
+    return (await value) if inspect.isawaitable(value) else value
+
+
+def query_signature(query_body):
+    if isinstance(query_body, meta.BaseModel):
+        query_body = query_body.dict()
+    return json.dumps(query_body, sort_keys=True, default=str)
+
+
+class QueryPlan(object):
+    """
+    Evaluation order of the children of each AND clause keyed by the path of the clause,
+    the tuple of child indexes leading to it from the root of the query.
+    """
+
+    def __init__(self, signature, orders=None, estimates=None):
+        self.signature = signature
+        self.orders = orders or {}
+        self.estimates = estimates or {}
+
+    def ordered(self, path, indexed_components):
+        """
+        :param path: path of the AND clause
+        :param indexed_components: (index, component) pairs of children of the clause
+        :return: the pairs in planned order, unchanged if the clause was not planned
+        """
+        order = self.orders.get(path)
+        if not order:
+            return indexed_components
+        rank = {index: position for position, index in enumerate(order)}
+        return sorted(indexed_components, key=lambda pair: rank.get(pair[0], len(rank)))
+
+
+class CardinalityEstimator(object):
+    def __init__(self, dbi, metacontext, class_context=None):
+        self._dbi = dbi
+        self._metacontext = metacontext
+        self._class_context = class_context
+
+    def _meta_id(self, kind, name):
+        return getattr(self._metacontext, kind).by_name[name].id
+
+    async def _related_count(self, criteria):
+        return await resolved(self._dbi.related.count(criteria))
+
+    async def _assoc_counts(self, role_name, kind, names):
+        role_id = self._meta_id('roles', role_name)
+        ids = [self._meta_id(kind, n) for n in names]
+        return [await self._related_count({'subject_id': an_id, 'assoc_id': role_id}) for an_id in ids]
+
+    async def _associated(self, component, role_name, kind):
+        if component.application == 'none':
+            return unbounded
+        counts = await self._assoc_counts(role_name, kind, component.names)
+        if not counts:
+            return 0
+        return min(counts) if component.application == 'all' else sum(counts)
+
+    async def _related(self, component):
+        if component.negated:
+            return unbounded
+        if component.role:
+            role_id = self._meta_id('roles', component.role)
+            return await self._related_count({'subject_id': component.obj_id, 'assoc_id': role_id})
+        return await self._related_count(
+            {'$or': [{'subject_id': component.obj_id}, {'object_id': component.obj_id}]})
+
+    async def _attribute(self, component):
+        classes = self._metacontext.classes.by_id
+        cids = self._class_context or classes.keys()
+        total = 0
+        for cid in cids:
+            cls = classes.get(cid)
+            if cls and not cls.is_abstract and any(a.name == component.attr_name for a in cls.attributes):
+                coll = await resolved(self._dbi.extension(cid))
+                total += await resolved(coll.count({}))
+        return total * attribute_selectivity.get(component.operate, 1.0)
+
+    async def estimate(self, component):
+        if isinstance(component, meta.TagsComponent):
+            return await self._associated(component, 'tag_applies', 'tags')
+        if isinstance(component, meta.GroupsComponent):
+            return await self._associated(component, 'group_contains', 'groups')
+        if isinstance(component, meta.RelatedTo):
+            return await self._related(component)
+        if isinstance(component, meta.AttributeComponent):
+            return await self._attribute(component)
+        if isinstance(component, meta.AndQuery):
+            return min([await self.estimate(c) for c in component.components
+                        if not isinstance(c, meta.ClassComponent)], default=unbounded)
+        if isinstance(component, meta.OrQuery):
+            return sum([await self.estimate(c) for c in component.components])
+        return unbounded
+
+
+class QueryPlanner(object):
+    """
+    Compiles and caches QueryPlans.  A cached plan is reused while the query it was made
+    for is unchanged; plans only order work so a plan made from older counts stays correct.
+    """
+
+    def __init__(self, max_plans=256, estimator_class=CardinalityEstimator):
+        self.max_plans = max_plans
+        self.estimator_class = estimator_class
+        self._plans = OrderedDict()
+
+    async def compile(self, query_body, dbi, metacontext):
+        plan = QueryPlan(query_signature(query_body))
+        estimator = self.estimator_class(dbi, metacontext)
+
+        async def walk(component, path):
+            children = getattr(component, 'components', None) or []
+            for index, child in enumerate(children):
+                await walk(child, path + (index,))
+            if isinstance(component, meta.AndQuery):
+                estimates = {index: await estimator.estimate(child)
+                             for index, child in enumerate(children)
+                             if not isinstance(child, meta.ClassComponent)}
+                plan.orders[path] = sorted(estimates, key=lambda index: estimates[index])
+                plan.estimates[path] = estimates
+
+        await walk(query_body, ())
+        return plan
+
+    async def plan(self, query_id, query_body, dbi, metacontext):
+        """
+        The cached plan for query_id, compiling a new one when there is none or the query changed.
+        :param query_id: id of a saved query or None to key by the query itself
+        """
+        signature = query_signature(query_body)
+        key = query_id or signature
+        plan = self._plans.get(key)
+        if plan is None or plan.signature != signature:
+            plan = await self.compile(query_body, dbi, metacontext)
+            self._plans[key] = plan
+            while len(self._plans) > self.max_plans:
+                self._plans.popitem(last=False)
+        else:
+            self._plans.move_to_end(key)
+        return plan
+
+    def forget(self, *query_ids):
+        for query_id in query_ids:
+            self._plans.pop(query_id, None)
@@ -0,0 +1,160 @@
+"""
+Registry of tenant Interfaces, one per Services instance.
+
+Building an Interface maps the tenant's collections and loads its metadata.  A registry keeps
+one Interface per tenant so the requests served through its Services share it and repeated
+requests cost a dict lookup.  Each caller works through a session of the shared Interface, which has its own
+transaction state.  Entries are reference counted.  A session holds a reference until it is
+garbage.  An entry nobody holds is evicted once it has been idle for idle_seconds.
+
+Changes made through the registry's Database keep shared Interfaces current by themselves.
+Changes made through other Databases, in this process or another, only show in the changes
+log.  At most once per check_interval seconds the registry reads the timestamps logged since
+its last check.  Any its Database did not log mark a foreign change.  The Interfaces that
+predate it are rebuilt and the cache entries, query results, group closure and extension
+bitmaps of their tenants are dropped.
+"""
+
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+
+class RegistryEntry(object):
+    def __init__(self, interface, stamp, now):
+        self.interface = interface
+        self.stamp = stamp  # newest change log time the interface reflects
+        self.refs = 0
+        self.last_used = now
+
+
+class InterfaceRegistry(object):
+    def __init__(self, db, factory, idle_seconds=600, check_interval=1.0, clock=time.monotonic):
+        """
+        :param db: the Database the interfaces are for
+        :param factory: function of (db, tenant_id) making a ready Interface
+        :param idle_seconds: how long an unreferenced entry is kept after last use
+        :param check_interval: minimum seconds between reads of the changes log
+        :param clock: source of the current time in seconds
+        """
+        self._db = db
+        self._factory = factory
+        self.idle_seconds = idle_seconds
+        self.check_interval = check_interval
+        self._clock = clock
+        self._entries = {}
+        self._lock = threading.RLock()
+        self._checked_at = None
+        self._seen_stamp = None
+        self._foreign_stamp = 0
+        self._forgotten = {}  # tenant_id -> foreign change time its derived state was last dropped at
+        self._swept_at = clock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, tenant_id):
+        return tenant_id in self._entries
+
+    def _log_time(self):
+        return self._db.latest_change_time() or 0
+
+    def _note_change_times(self, stamps):
+        own = set(self._db.logged_times)
+        for stamp in stamps:
+            self._seen_stamp = max(self._seen_stamp, stamp)
+            if stamp not in own:
+                self._foreign_stamp = max(self._foreign_stamp, stamp)
+
+    def _foreign_change_time(self, now):
+        """time of the newest change logged by another process, read at most every check_interval"""
+        if self._checked_at is None or now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            self._note_change_times(self._db.change_times_since(self._seen_stamp))
+        return self._foreign_stamp
+
+    def _sweep(self, now):
+        if now - self._swept_at < self.idle_seconds / 4:
+            return
+        self._swept_at = now
+        for tenant_id, entry in list(self._entries.items()):
+            if entry.refs <= 0 and now - entry.last_used > self.idle_seconds:
+                del self._entries[tenant_id]
+
+    def _forget_foreign_changes(self, tenant_id, entry):
+        """drop the tenant's derived state if a foreign change happened since it was last dropped"""
+        if self._forgotten.get(tenant_id, 0) >= self._foreign_stamp:
+            return
+        self._forgotten[tenant_id] = self._foreign_stamp
+        if entry is not None:
+            entry.interface.forget_cached_state()
+        else:
+            self._db.forget_tenant_state(tenant_id)
+
+    def _fresh_entry(self, tenant_id, now):
+        entry = self._entries.get(tenant_id)
+        foreign = self._foreign_change_time(now)
+        self._forget_foreign_changes(tenant_id, entry)
+        if entry is not None and entry.stamp < foreign:
+            entry = None
+        if entry is None:
+            log_time = self._log_time()
+            if self._seen_stamp is None:
+                self._seen_stamp = log_time
+            stamp = max(log_time, self._foreign_stamp)
+            fresh = RegistryEntry(self._factory(self._db, tenant_id), stamp, now)
+            if tenant_id in self._entries:
+                fresh.refs = self._entries[tenant_id].refs
+            entry = self._entries[tenant_id] = fresh
+        entry.last_used = now
+        return entry
+
+    def get(self, tenant_id=None):
+        """the shared Interface of the tenant without taking a reference to it"""
+        with self._lock:
+            now = self._clock()
+            self._sweep(now)
+            return self._fresh_entry(tenant_id, now).interface
+
+    def acquire(self, tenant_id=None):
+        """the shared Interface of the tenant kept from eviction until released"""
+        with self._lock:
+            now = self._clock()
+            self._sweep(now)
+            entry = self._fresh_entry(tenant_id, now)
+            entry.refs += 1
+            return entry.interface
+
+    def release(self, tenant_id=None):
+        with self._lock:
+            entry = self._entries.get(tenant_id)
+            if entry is not None:
+                entry.refs = max(entry.refs - 1, 0)
+                entry.last_used = self._clock()
+
+    @contextmanager
+    def using(self, tenant_id=None):
+        interface = self.acquire(tenant_id)
+        try:
+            yield interface
+        finally:
+            self.release(tenant_id)
+
+    def _held_session(self, interface, tenant_id):
+        res = interface.session()
+        weakref.finalize(res, self.release, tenant_id)
+        return res
+
+    def session(self, tenant_id=None):
+        """a session of the tenant's shared Interface, holding the entry until it is garbage"""
+        return self._held_session(self.acquire(tenant_id), tenant_id)
+
+    def invalidate(self, tenant_id=None):
+        """drop the tenant's entry so its next use builds a new Interface"""
+        with self._lock:
+            self._entries.pop(tenant_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -2,6 +2,7 @@ __author__ = 'samantha'
 
 from collections import defaultdict
 from sjasoft.uop import db_interface
+from sjasoft.uop.registry import InterfaceRegistry
 from sjasoft.uopmeta.schemas.meta import core_schema, Tenant, User
 
 
@@ -11,6 +12,7 @@ class Services(object):
 
     def __init__(self, db):
         self._db = db
+        self.interfaces = InterfaceRegistry(db, db_interface.get_tenant_interface)
 
     def ensure_base_schema(self):
         self.ensure_schema(core_schema)
@@ -41,8 +43,8 @@ class Services(object):
         return self._db.has_tenants()
 
     def tenant_interface(self, tenant_id=None):
-        # TODO likely need mechanism to reuse tenant_interface for same uuid?
-        return db_interface.get_tenant_interface(self._db, tenant_id)
+        """a session of the tenant's Interface shared through this Services"""
+        return self.interfaces.session(tenant_id)
 
     def ensure_schema(self, a_schema):
         """
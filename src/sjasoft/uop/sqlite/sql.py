@@ -0,0 +1,115 @@
+"""
+Translation of normalized criteria (see sjasoft.uop.criteria) into parameterized sqlite SQL.
+
+Criteria are first reduced to a shape, the criteria with its values replaced by parameter
+markers, and the SQL text is cached per shape.  Identical shapes therefore produce identical
+statement text which sqlite3 keeps prepared in its statement cache.
+"""
+
+import json
+import re
+from functools import lru_cache
+from sjasoft.uop.criteria import field_name
+
+sql_ops = dict(eq='=', gt='>', gte='>=', lt='<', lte='<=')
+
+
+def quoted(name):
+    return '"%s"' % name.replace('"', '""')
+
+
+def column_expr(field, columns):
+    """SQL expression for a field, either a real column or a path into the json data"""
+    if field == 'id' or field in columns:
+        return quoted(field)
+    return "json_extract(data, '$.%s')" % quoted(field).replace("'", "''")
+
+
+def json_text(value):
+    return json.dumps(value, separators=(',', ':'), default=str)
+
+
+def sql_value(value):
+    if isinstance(value, (list, tuple, dict)):
+        return json_text(value)
+    return value
+
+
+def _param(op, value):
+    if op in ('in', 'nin'):
+        return json_text(list(value))
+    if op == 'regex':
+        return value.pattern if isinstance(value, re.Pattern) else value
+    return sql_value(value)
+
+
+def shape(node, params):
+    """
+    Shape of a normalized criteria with values moved into params in statement order
+    """
+    kind = node[0]
+    if kind == 'cmp':
+        _, field, op, value = node
+        if op == 'exists':
+            return ('cmp', field, op, bool(value))
+        if op in ('eq', 'ne') and value is None:
+            return ('cmp', field, op, None)
+        params.append(_param(op, value))
+        return ('cmp', field, op, '?')
+    if kind == 'not':
+        return ('not', shape(node[1], params))
+    return (kind, tuple(shape(c, params) for c in node[1]))
+
+
+@lru_cache(maxsize=1024)
+def shape_sql(a_shape, columns):
+    kind = a_shape[0]
+    if kind == 'cmp':
+        _, field, op, marker = a_shape
+        col = column_expr(field, columns)
+        if op == 'exists':
+            return f'{col} IS NOT NULL' if marker else f'{col} IS NULL'
+        if marker is None:
+            return f'{col} IS NULL' if op == 'eq' else f'{col} IS NOT NULL'
+        if op == 'ne':
+            return f'({col} IS NULL OR {col} != ?)'
+        if op == 'in':
+            return f'{col} IN (SELECT value FROM json_each(?))'
+        if op == 'nin':
+            return f'({col} IS NULL OR {col} NOT IN (SELECT value FROM json_each(?)))'
+        if op == 'regex':
+            return f'{col} REGEXP ?'
+        return f'{col} {sql_ops[op]} ?'
+    if kind == 'not':
+        return f'NOT ({shape_sql(a_shape[1], columns)})'
+    if not a_shape[1]:
+        return '1' if kind == 'and' else '0'
+    joiner = ' AND ' if kind == 'and' else ' OR '
+    return '(%s)' % joiner.join(shape_sql(c, columns) for c in a_shape[1])
+
+
+def where_clause(node, columns):
+    """
+    :param node: normalized criteria
+    :param columns: tuple of the real columns of the target table
+    :return: sql text, parameter list
+    """
+    params = []
+    return shape_sql(shape(node, params), columns), params
+
+
+@lru_cache(maxsize=256)
+def order_sql(order_by, columns):
+    if not order_by:
+        return ''
+    parts = []
+    for field in order_by:
+        direction = 'DESC' if field.startswith('-') else 'ASC'
+        col = column_expr(field_name(field.lstrip('-')), columns)
+        parts.append(f'({col} IS NULL), {col} {direction}')
+    return ' ORDER BY ' + ', '.join(parts)
+
+
+def regexp(pattern, value):
+    """implementation of the sqlite REGEXP operator"""
+    return value is not None and isinstance(value, str) and re.search(pattern, value) is not None
@@ -0,0 +1,386 @@
+"""
+SQLite uop adaptor on the standard library sqlite3 module.
+
+Every uop collection, including each class extension made by
+DatabaseCollections.get_class_extension, is its own table of
+    rowid, id, data (the json document) and any promoted columns.
+Promoted columns hold copies of fields that are queried constantly, e.g. the
+subject_id, assoc_id and object_id of uop_related, so they can be indexed directly.
+Other fields are reached through json_extract.
+"""
+
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from sjasoft.uop import database
+from sjasoft.uop import criteria as crit
+from sjasoft.uop import db_collection as db_coll
+from sjasoft.uop import db_service
+from sjasoft.uop.collections import uop_collection_names, meta_kinds
+from sjasoft.uop.constraints import ConstraintViolation
+from sjasoft.uop.memory.table import project
+from sjasoft.uop.sqlite import sql
+
+collection_kinds = {v: k for k, v in uop_collection_names.items()}
+db_suffix = '.sqlite'
+
+
+def table_spec(kind):
+    """
+    (promoted columns, indexes) for the standard collection of a kind where each index
+    is a tuple of columns
+    """
+    if kind == 'related':
+        return ('subject_id', 'assoc_id', 'object_id'), (('subject_id', 'assoc_id'), ('object_id', 'assoc_id'))
+    if kind == 'changes':
+        return ('timestamp',), (('timestamp',),)
+    if kind in meta_kinds or kind in ('tenants', 'users', 'schemas'):
+        return ('name',), (('name',),)
+    return (), ()
+
+
+class SqliteTable(object):
+    """
+    A sqlite table offering the same protocol as memory.table.MemoryTable
+    """
+
+    def __init__(self, db, name, columns=(), indexes=()):
+        self._db = db
+        self.name = name
+        self._qname = sql.quoted(name)
+        existing = self._existing_columns()
+        self.columns = tuple(columns) if existing is None else existing
+        if existing is None:
+            cols = ''.join(f', {sql.quoted(c)}' for c in self.columns)
+            self._execute(f'CREATE TABLE {self._qname} (rowid INTEGER PRIMARY KEY, '
+                          f'id TEXT UNIQUE, data TEXT NOT NULL{cols})')
+            for index_cols in indexes:
+                self.add_index(*index_cols)
+
+    def _execute(self, statement, params=()):
+        with self._db.lock:
+            return self._db.connection.execute(statement, params)
+
+    def _existing_columns(self):
+        info = self._execute(f'PRAGMA table_info({self._qname})').fetchall()
+        if not info:
+            return None
+        return tuple(r[1] for r in info if r[1] not in ('rowid', 'id', 'data'))
+
+    def __len__(self):
+        return self.count()
+
+    def add_index(self, *fields, ordered=False):
+        fields = [crit.field_name(f) for f in fields]
+        exprs = ', '.join(sql.column_expr(f, self.columns) for f in fields)
+        index_name = sql.quoted('ix_%s_%s' % (self.name, '_'.join(fields)))
+        self._execute(f'CREATE INDEX IF NOT EXISTS {index_name} ON {self._qname} ({exprs})')
+
+    def _where(self, criteria):
+        return sql.where_clause(crit.normalize(criteria), self.columns)
+
+    def _row_values(self, doc):
+        return [doc.get('id'), sql.json_text(doc)] + [sql.sql_value(doc.get(c)) for c in self.columns]
+
+    def get(self, an_id):
+        row = self._execute(f'SELECT data FROM {self._qname} WHERE id = ?', (an_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _select(self, criteria, only_cols, order_by, limit):
+        """
+        :return: select statement, its parameters and a function turning fetched rows into results
+        """
+        where, params = self._where(criteria)
+        order = sql.order_sql(tuple(order_by or ()), self.columns)
+        single = only_cols and len(only_cols) == 1 and crit.field_name(only_cols[0])
+        if single:
+            col = sql.column_expr(single, self.columns)
+            is_json = col.startswith('json_extract')
+            select = f'json_quote({col})' if is_json else col
+            where = f'{col} IS NOT NULL AND {where}'
+            decode = (lambda rows: [json.loads(r[0]) for r in rows]) if is_json else \
+                (lambda rows: [r[0] for r in rows])
+        else:
+            select = 'data'
+            decode = lambda rows: project([json.loads(r[0]) for r in rows], only_cols)
+        statement = f'SELECT {select} FROM {self._qname} WHERE {where}{order}'
+        if limit:
+            statement += ' LIMIT ?'
+            params = params + [limit]
+        return statement, params, decode
+
+    def find(self, criteria=None, only_cols=None, order_by=None, limit=None):
+        statement, params, decode = self._select(criteria, only_cols, order_by, limit)
+        return decode(self._execute(statement, params).fetchall())
+
+    def find_iter(self, criteria=None, only_cols=None, order_by=None, batch_size=1000):
+        """iterate over find results from a cursor fetching batch_size rows at a time"""
+        statement, params, decode = self._select(criteria, only_cols, order_by, None)
+        with self._db.lock:
+            cursor = self._db.connection.cursor()
+            cursor.execute(statement, params)
+        try:
+            while True:
+                with self._db.lock:
+                    rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                yield from decode(rows)
+        finally:
+            cursor.close()
+
+    def count(self, criteria=None):
+        where, params = self._where(criteria)
+        return self._execute(f'SELECT COUNT(*) FROM {self._qname} WHERE {where}', params).fetchone()[0]
+
+    def _prepared(self, doc):
+        doc = json.loads(sql.json_text(dict(doc)))
+        if '_id' in doc and 'id' not in doc:
+            doc['id'] = doc.pop('_id')
+        return doc
+
+    def insert(self, doc):
+        return self.insert_many([doc])[0]
+
+    def insert_many(self, docs):
+        """insert all docs in one executemany or, if any id is already present or repeated, none of them"""
+        docs = [self._prepared(d) for d in docs]
+        if not docs:
+            return docs
+        marks = ', '.join('?' for _ in range(len(self.columns) + 2))
+        cols = ''.join(f', {sql.quoted(c)}' for c in self.columns)
+        with self._db.lock:
+            conn = self._db.connection
+            conn.execute('SAVEPOINT uop_insert_many')
+            try:
+                conn.executemany(f'INSERT INTO {self._qname} (id, data{cols}) VALUES ({marks})',
+                                 [self._row_values(d) for d in docs])
+            except BaseException as e:
+                # undo the rows inserted before the failure, then pop the emptied savepoint
+                conn.execute('ROLLBACK TO uop_insert_many')
+                conn.execute('RELEASE uop_insert_many')
+                if isinstance(e, sqlite3.IntegrityError):
+                    raise ConstraintViolation('unique id', data={'ids': [d.get('id') for d in docs]})
+                raise
+            conn.execute('RELEASE uop_insert_many')
+        return docs
+
+    def _rewrite(self, criteria, changer, limit=None):
+        where, params = self._where(criteria)
+        statement = f'SELECT rowid, data FROM {self._qname} WHERE {where}'
+        if limit:
+            statement += ' LIMIT ?'
+            params = params + [limit]
+        changed = []
+        for rowid, data in self._execute(statement, params).fetchall():
+            doc = json.loads(data)
+            changer(doc)
+            changed.append(self._row_values(doc)[1:] + [rowid])
+        if changed:
+            sets = ', '.join(['data = ?'] + [f'{sql.quoted(c)} = ?' for c in self.columns])
+            with self._db.lock:
+                self._db.connection.executemany(
+                    f'UPDATE {self._qname} SET {sets} WHERE rowid = ?', changed)
+        return len(changed)
+
+    def update(self, criteria, mods):
+        mods = json.loads(sql.json_text(dict(mods)))
+        mods.pop('id', None)
+        mods.pop('_id', None)
+        return self._rewrite(criteria, lambda doc: doc.update(mods))
+
+    def update_many(self, mods_by_id):
+        """apply per id modifications reading the affected rows in one select"""
+        mods_by_id = {an_id: json.loads(sql.json_text(dict(mods))) for an_id, mods in mods_by_id.items()}
+        if not mods_by_id:
+            return 0
+
+        def change(doc):
+            mods = mods_by_id[doc['id']]
+            mods.pop('id', None)
+            mods.pop('_id', None)
+            doc.update(mods)
+
+        return self._rewrite({'id': {'$in': list(mods_by_id)}}, change)
+
+    def replace_one(self, criteria, data):
+        data = json.loads(sql.json_text(dict(data)))
+        data.pop('_id', None)
+
+        def replace(doc):
+            an_id = doc.get('id')
+            doc.clear()
+            doc.update(data)
+            if an_id is not None:
+                doc['id'] = an_id
+
+        return self._rewrite(criteria, replace, limit=1)
+
+    def remove(self, criteria=None):
+        where, params = self._where(criteria)
+        return self._execute(f'DELETE FROM {self._qname} WHERE {where}', params).rowcount
+
+    def drop(self):
+        self._execute(f'DELETE FROM {self._qname}')
+
+
+class SqliteCollection(db_coll.DBCollection):
+    """
+    A uop collection over a SqliteTable.  Criteria are passed on to the table,
+    which turns them into sql.
+    """
+
+    @property
+    def table(self):
+        return self._coll
+
+    def __contains__(self, an_id):
+        return self.contains_id(an_id)
+
+    @property
+    def by_name(self):
+        return {d['name']: d['id'] for d in self.find(only_cols=['id', 'name'])
+                if 'name' in d and 'id' in d}
+
+    def ensure_index(self, *fields, ordered=False):
+        self._coll.add_index(*fields, ordered=ordered)
+
+    def count(self, criteria=None):
+        return self._coll.count(self.modified_criteria(criteria or {}))
+
+    def exists(self, criteria):
+        return self.count(criteria) > 0
+
+    def find(self, criteria=None, only_cols=None,
+             order_by=None, limit=None, ids_only=False):
+        if ids_only:
+            only_cols = [self.ID_Field]
+        return self._coll.find(self.modified_criteria(criteria or {}), only_cols=only_cols,
+                               order_by=order_by, limit=limit)
+
+    def find_iter(self, criteria=None, only_cols=None, order_by=None, batch_size=1000):
+        return self._coll.find_iter(self.modified_criteria(criteria or {}), only_cols=only_cols,
+                                    order_by=order_by, batch_size=batch_size)
+
+    def get(self, instance_id):
+        if self._with_tenant({}):
+            return super().get(instance_id)
+        return self._coll.get(instance_id)
+
+    def insert(self, **fields):
+        return self._coll.insert(fields)
+
+    def insert_many(self, items):
+        return self._coll.insert_many(items)
+
+    def update_many(self, mods_by_id):
+        if self._with_tenant({}):
+            return super().update_many(mods_by_id)
+        return self._coll.update_many(mods_by_id)
+
+    def bulk_load(self, *ids):
+        if len(ids) == 1 and isinstance(ids[0], (list, tuple, set)):
+            ids = ids[0]
+        return self.find({'id': {'$in': list(ids)}})
+
+    def update(self, selector, mods, partial=True):
+        if not isinstance(selector, dict):
+            selector = {'id': selector}
+        if not partial:
+            return self._coll.replace_one(self.modified_criteria(selector), mods)
+        return self._coll.update(self.modified_criteria(selector), mods)
+
+    def update_instance(self, an_id, **mods):
+        return self.update_one(an_id, mods)
+
+    def remove(self, dict_or_key):
+        criteria = dict_or_key if isinstance(dict_or_key, dict) else {'id': dict_or_key}
+        return self._coll.remove(self.modified_criteria(criteria))
+
+
+class SqliteUOP(database.Database):
+
+    @classmethod
+    def db_path(cls, name):
+        return name if name.endswith(db_suffix) else name + db_suffix
+
+    @classmethod
+    def make_test_database(cls):
+        handle, path = tempfile.mkstemp(suffix=db_suffix, prefix='testdb_')
+        os.close(handle)
+        return cls(path=path)
+
+    @classmethod
+    def make_named_database(cls, name):
+        return cls(dbname=name)
+
+    @classmethod
+    def existing_db_names(cls):
+        return [f[:-len(db_suffix)] for f in os.listdir('.') if f.endswith(db_suffix)]
+
+    @classmethod
+    def drop_named_database(cls, name):
+        path = cls.db_path(name)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def __init__(self, dbname=None, path=None, **kwargs):
+        self._path = path or (self.db_path(dbname) if dbname else ':memory:')
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(self._path, isolation_level=None,
+                                          check_same_thread=False, cached_statements=512)
+        self.connection.create_function('regexp', 2, sql.regexp, deterministic=True)
+        self._tables = {}
+        super().__init__(**kwargs)
+
+    def drop_database(self):
+        self.connection.close()
+        if self._path != ':memory:' and os.path.exists(self._path):
+            os.remove(self._path)
+
+    def _db_has_collection(self, name):
+        found = self.connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone()
+        return found is not None
+
+    def get_raw_collection(self, name, kind=None):
+        table = self._tables.get(name)
+        if table is None:
+            columns, indexes = table_spec(kind or collection_kinds.get(name))
+            table = self._tables[name] = SqliteTable(self, name, columns, indexes)
+        return table
+
+    def remove_collection(self, collection_name):
+        self._tables.pop(collection_name, None)
+        with self.lock:
+            self.connection.execute(f'DROP TABLE IF EXISTS {sql.quoted(collection_name)}')
+
+    def get_managed_collection(self, name, schema=None, tenant_modifier=None):
+        return SqliteCollection(self.get_raw_collection(name), tenant_modifier=tenant_modifier)
+
+    def get_standard_collection(self, kind, tenant_modifier=None, name=''):
+        name = name or uop_collection_names[kind]
+        return SqliteCollection(self.get_raw_collection(name, kind), tenant_modifier=tenant_modifier)
+
+    def get_instance_collection(self, cls):
+        return self.get_managed_collection(self.random_collection_name())
+
+    def start_long_transaction(self):
+        with self.lock:
+            self.connection.execute('BEGIN')
+
+    def really_commit(self):
+        with self.lock:
+            if self.connection.in_transaction:
+                self.connection.execute('COMMIT')
+
+    def abort(self):
+        with self.lock:
+            if self.connection.in_transaction:
+                self.connection.execute('ROLLBACK')
+        super().abort()
+
+
+db_service.DatabaseClass.register_db(SqliteUOP, 'sqlite')
@@ -0,0 +1,65 @@
+from types import SimpleNamespace
+from sjasoft.uop.cache import UOPCache, roleset_key
+
+
+def crud(inserted=(), modified=(), deleted=()):
+    return SimpleNamespace(inserted={k: {} for k in inserted}, modified={k: {} for k in modified},
+                           deleted=set(deleted))
+
+
+def changes(related_inserted=(), **crud_changes):
+    res = SimpleNamespace(related=SimpleNamespace(inserted=set(related_inserted), deleted=set()))
+    for kind in ('objects', 'classes', 'attributes', 'roles', 'tags', 'groups', 'queries'):
+        setattr(res, kind, crud_changes.get(kind, crud()))
+    return res
+
+
+def test_lru_bound_and_counters():
+    cache = UOPCache(max_size=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.stats() == dict(size=2, hits=3, misses=1, evictions=1)
+
+
+def test_ttl():
+    now = [0]
+    cache = UOPCache(ttl=10, clock=lambda: now[0])
+    cache.set('a', 1)
+    now[0] = 5
+    assert cache.get('a') == 1
+    now[0] = 11
+    assert cache.get('a') is None
+
+
+def test_tenant_namespaces():
+    cache = UOPCache()
+    one, two = cache.namespace('t1'), cache.namespace('t2')
+    one.set('x', 1)
+    assert two.get('x') is None
+    two.set('x', 2)
+    one.clear()
+    assert one.get('x') is None and two.get('x') == 2
+
+
+def test_precise_invalidation():
+    cache = UOPCache()
+    cache.set('obj1', {'id': 'obj1'})
+    cache.set('obj2', {'id': 'obj2'})
+    cache.set(roleset_key('tag1', 'role'), {'obj1'})
+    cache.set(roleset_key('tag2', 'role'), {'obj2'})
+    cache.set(roleset_key('obj1', 'role', reverse=True), {'tag1'})
+    cache.set(roleset_key('obj1', 'role'), set())
+    related = (('subject_id', 'tag1'), ('assoc_id', 'role'), ('object_id', 'obj1'))
+    cache.apply_changes(changes([related], objects=crud(modified=['obj2'])))
+    assert cache.get(roleset_key('tag1', 'role')) is None
+    assert cache.get(roleset_key('obj1', 'role', reverse=True)) is None
+    assert cache.get(roleset_key('obj1', 'role')) == set()
+    assert cache.get('obj2') is None
+    assert cache.get('obj1') == {'id': 'obj1'}
+    assert cache.get(roleset_key('tag2', 'role')) == {'obj2'}
+    cache.apply_changes(changes(objects=crud(deleted=['obj1'])))
+    assert cache.get(roleset_key('tag2', 'role')) is None
@@ -0,0 +1,26 @@
+import pytest
+from sjasoft.uop.closure import TransitiveClosure
+from sjasoft.uop.constraints import ConstraintViolation
+
+
+def test_closure_follows_adds_and_removes():
+    closure = TransitiveClosure([('a', 'b'), ('b', 'c'), ('x', 'c')])
+    assert closure.descendants('a') == {'b', 'c'}
+    assert closure.ancestors('c') == {'a', 'b', 'x'}
+    closure.add('c', 'd')
+    assert closure.descendants('a') == {'b', 'c', 'd'} and closure.ancestors('d') == {'a', 'b', 'c', 'x'}
+    closure.remove('b', 'c')
+    assert closure.descendants('a') == {'b'}
+    assert closure.ancestors('d') == {'c', 'x'}
+
+
+def test_cycles_are_rejected():
+    closure = TransitiveClosure([('a', 'b'), ('b', 'c')])
+    with pytest.raises(ConstraintViolation):
+        closure.check([('c', 'a')])
+    with pytest.raises(ConstraintViolation):
+        closure.check([('c', 'd'), ('d', 'a')])
+    closure.check([('c', 'a')], removed=[('b', 'c')])
+    assert closure.descendants('a') == {'b', 'c'}
+    with pytest.raises(ConstraintViolation):
+        closure.add('b', 'b')
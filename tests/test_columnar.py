@@ -0,0 +1,22 @@
+from sjasoft.uop import columnar
+
+
+def objects():
+    docs = [dict(id=f'o{i}', rank=i) for i in range(10)]
+    docs.append(dict(id='none', rank=None))
+    docs.append(dict(id='absent'))
+    return docs
+
+
+def test_numeric_ranges():
+    docs = objects()
+    assert columnar.filter_objects(docs, 'rank', '$gt', 7) == {'o8', 'o9'}
+    assert columnar.filter_objects(docs, 'rank', '$lte', 1) == {'o0', 'o1'}
+    assert columnar.filter_objects(docs, 'rank', '$eq', 3) == {'o3'}
+    assert columnar.filter_objects(docs, 'rank', '$neq', 3) == {d['id'] for d in docs} - {'o3'}
+
+
+def test_mixed_column_falls_back():
+    docs = objects() + [dict(id='text', rank='high')]
+    assert columnar.filter_objects(docs, 'rank', '$gte', 9) == {'o9'}
+    assert columnar.filter_objects(docs, 'rank', '$regex', '^hi') == {'text'}
@@ -0,0 +1,86 @@
+from sjasoft.uop.db_collection import DatabaseCollections
+from sjasoft.uop.collections import cls_extension_field
+from sjasoft.uop.instrumentation import Instrumentation
+
+
+class Named(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class Table(object):
+    def __init__(self, *classes):
+        self.by_id = {c['id']: c for c in classes}
+        self.gets = 0
+
+    def get(self, cls_id):
+        self.gets += 1
+        return dict(self.by_id[cls_id])
+
+    def update_one(self, cls_id, mods):
+        self.by_id[cls_id].update(mods)
+
+    def find(self):
+        self.gets += 1
+        return [dict(c) for c in self.by_id.values()]
+
+
+class Store(object):
+    made = 0
+
+    def get_instance_collection(self, cls):
+        self.made += 1
+        return Named('ext%d' % self.made)
+
+    def get_managed_collection(self, name, tenant_modifier=None):
+        return Named(name)
+
+
+def collections_of(classes, attributes=None):
+    res = DatabaseCollections.__new__(DatabaseCollections)
+    res._tenant_id = None
+    res._db = Store()
+    res._extensions = {}
+    res._collections = dict(classes=classes, attributes=attributes or Table())
+    res._class_table = res._attribute_table = res._class_names = None
+    res._expanded = {}
+    res.instrumentation = Instrumentation()
+    return res
+
+
+def test_class_extension_is_registered_once():
+    classes = Table(dict(id='c1', name='C1', attrs=[], superclass=None))
+    collections = collections_of(classes)
+    first = collections.class_extension('c1')
+    assert collections.class_extension('c1') is first and classes.gets == 2
+    assert classes.by_id['c1'][cls_extension_field] == first.name
+    collections.forget_class_extensions(['c1'])
+    assert collections.class_extension('c1').name == first.name
+    assert classes.gets == 3 and collections._db.made == 1
+    assert [e.fields['collection'] for e in collections.instrumentation.drain()] == [first.name]
+
+
+class Changes(object):
+    def __init__(self, inserted=None, modified=None, deleted=()):
+        self.inserted = inserted or {}
+        self.modified = modified or {}
+        self.deleted = set(deleted)
+
+
+def test_expanded_classes_follow_class_changes():
+    classes = Table(dict(id='b', name='Base', attrs=['a1'], superclass=None),
+                    dict(id='d', name='Derived', attrs=['a2'], superclass='Base'))
+    attributes = Table(dict(id='a1', name='one'), dict(id='a2', name='two'))
+    collections = collections_of(classes, attributes)
+    derived = classes.by_id['d']
+    assert collections.expanded_class(derived)['attrs'] == ['a1', 'a2']
+    collections.expanded_class(derived)
+    assert classes.gets == attributes.gets == 1
+    collections.update_class_tables(
+        classes=Changes(inserted={'b2': dict(id='b2', name='Other', attrs=['a3'], superclass=None)},
+                        modified={'b': dict(attrs=['a1', 'a3'])}),
+        attributes=Changes(inserted={'a3': dict(id='a3', name='three')}))
+    expanded = collections.expanded_class(derived)
+    assert sorted(expanded['attrs']) == ['a1', 'a2', 'a3'] and expanded['attrs'][-1] == 'a2'
+    assert {a['name'] for a in expanded['attributes']} == {'one', 'two', 'three'}
+    assert classes.gets == attributes.gets == 1
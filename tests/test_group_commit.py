@@ -0,0 +1,176 @@
+import asyncio
+import threading
+from sjasoft.uop.changeset import ChangeSet
+from sjasoft.uop.db_interface import Interface
+from sjasoft.uop.group_commit import GroupCommitter, op_count
+from sjasoft.uop.async_path.group_commit import GroupCommitter as AsyncGroupCommitter
+
+
+class Objects(object):
+    def __init__(self, *ids):
+        self.inserted = {i: {'id': i} for i in ids}
+        self.modified = {}
+        self.deleted = set()
+
+
+class Changes(object):
+    change_types = ('objects',)
+
+    def __init__(self, *ids):
+        self.objects = Objects(*ids)
+
+    @classmethod
+    def combine_changes(cls, *changesets):
+        return cls(*[i for c in changesets for i in c.objects.inserted])
+
+
+class Store(object):
+    def __init__(self):
+        self.applied = []
+        self.aborts = 0
+
+    def apply(self, changes):
+        ids = list(changes.objects.inserted)
+        if 'bad' in ids:
+            raise ValueError('bad')
+        self.applied.append(ids)
+
+    def abort(self):
+        self.aborts += 1
+
+
+class BrokenStore(Store):
+    def abort(self):
+        raise ValueError('abort failed')
+
+
+class Committer(GroupCommitter):
+    changeset_class = Changes
+
+
+class AsyncCommitter(AsyncGroupCommitter):
+    changeset_class = Changes
+
+
+def submit_all(committer, names):
+    errors = {}
+
+    def submit(name):
+        try:
+            committer.submit(Changes(name))
+        except ValueError as e:
+            errors[name] = e
+
+    threads = [threading.Thread(target=submit, args=(n,), daemon=True) for n in names]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    return errors
+
+
+def test_concurrent_writes_are_applied_in_groups():
+    store = Store()
+    committer = Committer(store.apply, window=0.05, max_ops=500, abort=store.abort)
+    names = ['o%d' % i for i in range(20)]
+    assert submit_all(committer, names) == {}
+    assert sorted(i for ids in store.applied for i in ids) == sorted(names)
+    assert committer.groups == len(store.applied) < len(names)
+
+
+def test_a_failing_write_only_fails_its_caller():
+    store = Store()
+    committer = Committer(store.apply, window=0.05, max_ops=500, abort=store.abort)
+    errors = submit_all(committer, ['a', 'bad', 'b'])
+    assert list(errors) == ['bad'] and store.aborts >= 1
+    assert sorted(i for ids in store.applied for i in ids) == ['a', 'b']
+
+
+def test_a_failing_commit_fails_and_releases_every_caller():
+    store = BrokenStore()
+    committer = Committer(store.apply, window=0.05, max_ops=500, abort=store.abort)
+    errors = submit_all(committer, ['a', 'bad', 'b'])
+    assert sorted(errors) == ['a', 'b', 'bad']
+    assert all(str(e) == 'abort failed' for e in errors.values())
+
+
+def test_async_failing_commit_fails_every_caller():
+    store = BrokenStore()
+    committer = AsyncCommitter(store.apply, window=0.05, max_ops=500, abort=store.abort)
+
+    async def run():
+        return await asyncio.gather(*[committer.submit(Changes(n)) for n in ['a', 'bad', 'b']],
+                                    return_exceptions=True)
+
+    results = asyncio.run(asyncio.wait_for(run(), 1))
+    assert [str(r) for r in results] == ['abort failed'] * 3
+
+
+def test_async_group_fills_at_max_ops():
+    store = Store()
+    committer = AsyncCommitter(store.apply, window=10, max_ops=3, abort=store.abort)
+
+    async def run():
+        await asyncio.gather(*[committer.submit(Changes(n)) for n in 'xyz'])
+
+    asyncio.run(asyncio.wait_for(run(), 1))
+    assert store.applied == [['x', 'y', 'z']]
+
+
+def related_changes(*object_ids):
+    changes = ChangeSet()
+    for object_id in object_ids:
+        changes.insert('related', dict(subject_id='s.c', assoc_id='r', object_id=object_id))
+    return changes
+
+
+def test_related_changes_count_toward_max_ops():
+    assert op_count(related_changes('o1.c', 'o2.c', 'o3.c')) == 3
+
+
+def test_group_commit_keeps_related_changes():
+    applied = []
+    committer = GroupCommitter(applied.append, window=0.05, max_ops=500)
+    names = ['o%d.c' % i for i in range(5)]
+    threads = [threading.Thread(target=committer.submit, args=(related_changes(n),), daemon=True)
+               for n in names]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    assert len(applied) < len(names)
+    assert sorted(dict(r)['object_id'] for c in applied for r in c.related.inserted) == names
+
+
+class RecordingDB(object):
+    collections = None
+
+    def __init__(self):
+        self.applied = []
+
+    def apply_changes(self, changes, collections):
+        self.applied.append(changes)
+
+    def meta_version(self, tenant_id):
+        return 0
+
+    def abort(self):
+        pass
+
+
+def test_interface_writes_from_threads_are_committed_together():
+    db = RecordingDB()
+    dbi = Interface(db)
+    dbi.enable_group_commit(window=0.2)
+    names = ['o%d.c' % i for i in range(5)]
+
+    def write(name):
+        dbi.session().meta_insert(dict(kind='related', subject_id='s.c', assoc_id='r', object_id=name))
+
+    threads = [threading.Thread(target=write, args=(n,), daemon=True) for n in names]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    assert len(db.applied) == 1
+    assert sorted(dict(r)['object_id'] for r in db.applied[0].related.inserted) == names
@@ -0,0 +1,36 @@
+from sjasoft.uop.hierarchy import Hierarchy
+from sjasoft.uop.idsets import IdInterner
+
+
+class Context(object):
+    def __init__(self, tree):
+        self.tree = tree
+        self.calls = 0
+
+    def _below(self, an_id):
+        self.calls += 1
+        res = set()
+        for child in self.tree.get(an_id, ()):
+            res |= {child} | self._below(child)
+        return res
+
+    subtags = subgroups = subclasses = _below
+
+
+def test_interner_roundtrip():
+    interner = IdInterner()
+    bits = interner.bits(['a', 'b', 'c'])
+    assert interner.ids(bits & interner.bits(['b', 'c', 'd'])) == {'b', 'c'}
+    assert len(interner) == 4 and interner.id_of(interner.intern('c')) == 'c'
+
+
+def test_closures_are_computed_once():
+    context = Context({'t': ['t1', 't2'], 't1': ['t11'], 'u': ['t1', 'u1']})
+    hierarchy = Hierarchy(context)
+    assert hierarchy.closure('tags', 't') == {'t1', 't2', 't11'}
+    assert hierarchy.union('tags', ['t', 'u']) == {'t1', 't2', 't11', 'u1'}
+    calls = context.calls
+    assert hierarchy.intersection('tags', ['t', 'u']) == {'t1', 't11'}
+    assert hierarchy.closure('tags', 't') == {'t1', 't2', 't11'}
+    assert context.calls == calls
+    assert hierarchy.expanded('groups', ['t1']) == {'t1', 't11'}
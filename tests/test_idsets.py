@@ -0,0 +1,66 @@
+import random
+from sjasoft.uop.idsets import ExtensionBitmaps, IdBitmap, IdInterner, IdSet, array_max
+
+universe = set(range(0, 200000, 7)) | set(range(65536, 65536 + 5000))
+
+
+def members(bitmap):
+    return universe - set(bitmap.members()) if bitmap.negated else set(bitmap)
+
+
+def test_containers_switch_representation():
+    dense = IdBitmap(range(array_max + 1))
+    assert isinstance(dense._containers[0], int)
+    sparse = dense - IdBitmap(range(10, array_max + 1))
+    assert sparse._containers[0] == tuple(range(10))
+    assert 5 in sparse and 11 not in sparse and len(sparse) == 10
+
+
+def test_negation_algebra_is_exact():
+    rng = random.Random(3)
+    pool = sorted(universe)
+    for _ in range(20):
+        a = set(rng.sample(pool, rng.randrange(1, 6000)))
+        b = set(rng.sample(pool, rng.randrange(1, 6000)))
+        for a_neg in (False, True):
+            for b_neg in (False, True):
+                x, y = IdBitmap(a, a_neg), IdBitmap(b, b_neg)
+                xs, ys = members(x), members(y)
+                assert members(x & y) == xs & ys
+                assert members(x | y) == xs | ys
+                assert members(x - y) == xs - ys
+
+
+def test_id_set_mixes_with_plain_sets():
+    interner = IdInterner()
+    tagged = IdSet(interner, ['a', 'b', 'c'])
+    assert tagged & {'b', 'c', 'd'} == {'b', 'c'}
+    assert {'c', 'd'} | tagged == {'a', 'b', 'c', 'd'}
+    not_b = IdSet(interner, ['b'], negated=True)
+    assert tagged & not_b == {'a', 'c'}
+    either = not_b | {'b', 'x'}
+    assert either.negated and not list(either.members())
+    assert 'zzz' in not_b and 'b' not in not_b
+
+
+class Versions(object):
+    def __init__(self):
+        self.version = 0
+        self.changed = {}
+
+    def change(self, cls_id):
+        self.version += 1
+        self.changed[('class', cls_id)] = self.version
+
+    def valid(self, version, dependencies):
+        return all(self.changed.get(dep, 0) <= version for dep in dependencies)
+
+
+def test_extension_bitmaps_follow_class_changes():
+    versions = Versions()
+    bitmaps = ExtensionBitmaps(IdInterner())
+    bitmaps.set('c1', [versions.version], ['a', 'b'])
+    versions.change('c2')
+    assert len(bitmaps.get('c1', [versions])) == 2
+    versions.change('c1')
+    assert bitmaps.get('c1', [versions]) is None
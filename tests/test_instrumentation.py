@@ -0,0 +1,25 @@
+from sjasoft.uop.instrumentation import Instrumentation, DEBUG, INFO
+
+
+def test_events_are_leveled_and_buffered():
+    instrumentation = Instrumentation(level=INFO, max_buffered=2)
+    instrumentation.event('quiet', DEBUG)
+    for i in range(3):
+        instrumentation.event('loud', n=i)
+    events = instrumentation.drain()
+    assert [e.fields['n'] for e in events] == [1, 2]
+    assert instrumentation.counters() == {'quiet': 1, 'loud': 3, 'instrumentation.dropped': 1}
+
+
+def test_flush_delivers_events_and_metrics():
+    ticks = iter([1.0, 1.5])
+    instrumentation = Instrumentation(timer=lambda: next(ticks))
+    events, metrics = [], []
+    instrumentation._sinks.append(events.append)
+    instrumentation._metrics_sinks.append(lambda counters, timings: metrics.append((counters, timings)))
+    with instrumentation.timed('work'):
+        instrumentation.event('done', item='x')
+    instrumentation.flush()
+    assert [(e.name, e.fields) for e in events] == [('done', {'item': 'x'})]
+    assert metrics == [({'done': 1}, {'work': dict(count=1, total=0.5, max=0.5)})]
+    assert instrumentation.drain() == []
@@ -0,0 +1,279 @@
+import asyncio
+from types import SimpleNamespace
+from sjasoft.uop.memory.table import MemoryTable
+from sjasoft.uop.memory.memoryuop import MemoryCollection
+from sjasoft.uop.memory.async_memoryuop import MemoryCollection as AsyncMemoryCollection
+from sjasoft.uop.db_interface import Interface
+from sjasoft.uop.async_path.db_interface import Interface as AsyncInterface
+from sjasoft.uop.cache import UOPCache
+from sjasoft.uop.query_cache import DataVersions
+from sjasoft.uop.query import Q
+
+
+def related_table(count=30):
+    table = MemoryTable('related', hashed=('subject_id', 'assoc_id', 'object_id'), ordered=('rank',))
+    for i in range(count):
+        table.insert(dict(id=f'r{i}', subject_id=f's{i % 3}', assoc_id='a', object_id=f'o{i}', rank=i))
+    return table
+
+
+def test_equality_uses_indexes():
+    table = related_table()
+    found = table.find({'subject_id': 's1', 'assoc_id': 'a'}, only_cols=['object_id'])
+    assert found == [f'o{i}' for i in range(30) if i % 3 == 1]
+    assert table.count({'$in': {'object_id': ['o1', 'o2', 'nope']}}) == 2
+
+
+def test_range_and_order():
+    table = related_table()
+    assert table.find(Q.gt('rank', 26), only_cols=['rank']) == [27, 28, 29]
+    assert table.find({'rank': {'$gte': 3, '$lt': 5}}, only_cols=['id']) == ['r3', 'r4']
+    assert table.find(Q.lte('rank', 10), only_cols=['rank'], order_by=('-rank',), limit=2) == [10, 9]
+
+
+def test_compound_and_regex():
+    table = related_table()
+    either = table.find({'$or': [Q.eq('object_id', 'o1'), {'rank': {'$gt': 28}}]}, only_cols=['id'])
+    assert either == ['r1', 'r29']
+    assert table.find({'$regex': {'object_id': '^o2.$'}}, only_cols=['rank']) == list(range(20, 30))
+
+
+def test_modifications_reindex():
+    table = related_table()
+    assert table.update({'_id': 'r4'}, {'subject_id': 'moved'}) == 1
+    assert table.find({'subject_id': 'moved'}, only_cols=['id']) == ['r4']
+    assert table.remove(Q.lt('rank', 10)) == 10
+    assert table.count() == 20
+    assert table.get('r4') is None
+    table.replace_one({'id': 'r12'}, {'rank': 100})
+    assert table.find(Q.gt('rank', 99), only_cols=['id']) == ['r12']
+
+
+def test_bulk_insert_and_update():
+    table = related_table(3)
+    try:
+        table.insert_many([dict(id='r10', rank=10), dict(id='r1', rank=11)])
+    except Exception:
+        pass
+    assert table.get('r10') is None
+    table.insert_many([dict(id='r10', rank=10), dict(id='r11', rank=11)])
+    assert table.update_many({'r10': {'rank': 100}, 'r0': {'subject_id': 'bulk'}, 'nope': {}}) == 2
+    assert table.find(Q.gt('rank', 50), only_cols=['id']) == ['r10']
+    assert table.find({'subject_id': 'bulk'}, only_cols=['id']) == ['r0']
+
+
+def test_find_iter_batches():
+    table = related_table(10)
+    ids = list(table.find_iter(only_cols=['id'], batch_size=3))
+    assert ids == table.find(only_cols=['id'])
+    ranked = list(table.find_iter(Q.gte('rank', 5), order_by=['-rank'], batch_size=2))
+    assert [d['rank'] for d in ranked] == [9, 8, 7, 6, 5]
+
+
+class OneClassInterface(AsyncInterface):
+    """async Interface whose only class has its instances in a table"""
+
+    def __init__(self, table):
+        self._instances = AsyncMemoryCollection(table)
+
+    def metaclass_named(self, name):
+        return {'_id': 'cls'}
+
+    async def extension(self, cls_id):
+        return self._instances
+
+
+def test_async_iter_class_instances():
+    dbi = OneClassInterface(related_table(10))
+
+    async def ids():
+        return [i async for i in dbi.iter_class_instances('Related', only_cols=['id'], batch_size=3)]
+
+    assert asyncio.run(ids()) == [f'r{i}' for i in range(10)]
+
+
+def test_async_instances_satisfying_page():
+    dbi = OneClassInterface(related_table(10))
+
+    async def pages():
+        seen, continuation = [], None
+        while True:
+            page, continuation = await dbi.instances_satisfying_page(
+                'Related', {'subject_id': 's1'}, order_by=['-rank'], limit=2,
+                continuation=continuation, only_cols=['id'])
+            seen.extend(page)
+            if continuation is None:
+                return seen
+
+    assert asyncio.run(pages()) == ['r7', 'r4', 'r1']
+
+
+def test_sessions_share_metadata_but_not_transactions():
+    dbi = OneClassInterface(related_table(1))
+    dbi._changeset, dbi._context = None, 'context'
+    session = dbi.session()
+    session._changeset = 'changes'
+    assert dbi._changeset is None
+    assert session.session()._changeset is None
+    session._context = 'patched'
+    assert dbi._context == 'patched'
+    assert session._instances is dbi._instances
+
+
+class VersionsDB(object):
+    """database applying related changes to a table and keeping their data versions"""
+    collections = None
+
+    def __init__(self, table=None):
+        self.table = table
+        self.versions = DataVersions()
+        self.forgotten = []
+
+    def data_versions(self, tenant_id=None):
+        return self.versions
+
+    def meta_version(self, tenant_id=None):
+        return 0
+
+    def forget_tenant_state(self, tenant_id=None):
+        self.forgotten.append(tenant_id)
+
+    async def apply_changes(self, changes, collections):
+        for rec in changes.related.inserted:
+            self.table.insert(dict(subject=rec['subject_id'], associated=rec['assoc_id'], object_id=rec['object_id']))
+        for rec in changes.related.deleted:
+            self.table.remove(dict(subject=rec['subject_id'], associated=rec['assoc_id'], object_id=rec['object_id']))
+        self.versions.bump()
+
+
+class RelatedInterface(Interface):
+    """Interface whose related collection is a table"""
+
+    def __init__(self, table):
+        super().__init__(VersionsDB(), cache=UOPCache())
+        self._related = MemoryCollection(table)
+
+    @property
+    def related(self):
+        return self._related
+
+
+def test_cached_rolesets_are_copies():
+    dbi = RelatedInterface(related_table(6))
+    first = dbi.get_roleset('s0', 'a')
+    assert first == {'o0', 'o3'}
+    first.add('mine')
+    cached = dbi.get_roleset('s0', 'a')
+    assert cached == {'o0', 'o3'}
+    cached.clear()
+    assert dbi.bulk_rolesets([('s0', 'a')]) == {('s0', 'a'): {'o0', 'o3'}}
+
+
+def test_forgetting_cached_state_rereads_rolesets():
+    table = related_table(6)
+    dbi = RelatedInterface(table)
+    assert dbi.get_roleset('s0', 'a') == {'o0', 'o3'}
+    table.insert(dict(id='r6', subject_id='s0', assoc_id='a', object_id='o6', rank=6))  # as another process would
+    assert dbi.get_roleset('s0', 'a') == {'o0', 'o3'}
+    dbi.forget_cached_state()
+    assert dbi.get_roleset('s0', 'a') == {'o0', 'o3', 'o6'}
+    assert dbi._db.forgotten == [None]
+
+
+class AsyncRelatedInterface(AsyncInterface):
+    """async Interface whose related and roles collections are tables, likes reversed by liked_by"""
+
+    def __init__(self):
+        related, roles = MemoryTable('related'), MemoryTable('roles')
+        roles.insert(dict(id='likes', is_reversed=False))
+        roles.insert(dict(id='liked_by', is_reversed=True, reverse_id='likes'))
+        super().__init__(VersionsDB(related), cache=UOPCache())
+        self._related, self._roles = AsyncMemoryCollection(related), AsyncMemoryCollection(roles)
+
+    @property
+    def related(self):
+        return self._related
+
+    @property
+    def roles(self):
+        return self._roles
+
+    async def change_related(self, inserted=(), deleted=()):
+        records = lambda pairs: [dict(subject_id=s, assoc_id='likes', object_id=o) for s, o in pairs]
+        await self._apply_to_db(SimpleNamespace(related=SimpleNamespace(
+            inserted=records(inserted), deleted=records(deleted))))
+
+
+def test_async_reverse_rolesets_follow_relate_and_unrelate():
+    dbi = AsyncRelatedInterface()
+
+    async def reverse_rolesets():
+        await dbi.change_related(inserted=[('s1', 'o1')])
+        related = await dbi.get_roleset('o1', 'liked_by')
+        await dbi.change_related(deleted=[('s1', 'o1')])
+        return related, await dbi.get_roleset('o1', 'liked_by'), await dbi.get_roleset('s1', 'likes')
+
+    assert asyncio.run(reverse_rolesets()) == ({'s1'}, set(), set())
+
+
+def test_async_rolesets_read_during_changes_are_not_cached():
+    dbi = AsyncRelatedInterface()
+    find = dbi.related.find
+
+    async def find_during_change(*args, **kwargs):
+        found = await find(*args, **kwargs)
+        dbi.related.find = find
+        await dbi.change_related(inserted=[('s1', 'o1')])  # applied while the read was in flight
+        return found
+
+    async def rolesets():
+        dbi.related.find = find_during_change
+        return await dbi.get_roleset('s1', 'likes'), await dbi.get_roleset('s1', 'likes')
+
+    assert asyncio.run(rolesets()) == (set(), {'o1'})
+
+
+class AssociatingInterface(RelatedInterface):
+    """Interface recording the ids it would associate instead of applying changes"""
+
+    def __init__(self):
+        super().__init__(related_table(0))
+        tags, groups = MemoryTable('tags'), MemoryTable('groups')
+        tags.insert(dict(id='t1'))
+        groups.insert(dict(id='g1'))
+        self._tags, self._groups = MemoryCollection(tags), MemoryCollection(groups)
+        self.associated = []
+
+    @property
+    def roles(self):
+        return SimpleNamespace(by_name=dict(tag_applies='applies', group_contains='contains'))
+
+    @property
+    def tags(self):
+        return self._tags
+
+    @property
+    def groups(self):
+        return self._groups
+
+    def class_ok(self, cls_id):
+        return False
+
+    def modify_associated_with_role(self, role_id, an_id, desired, reverse=False, do_replace=False):
+        self.associated.append((role_id, an_id, set(desired)))
+
+
+def test_associating_ignores_ids_of_nothing():
+    dbi = AssociatingInterface()
+    dbi.modify_object_tags('o1', ['t1', 'missing'])
+    dbi.modify_object_groups('o1', ['g1', 'missing'])
+    dbi.modify_group_objects('g2', ['g1', 'missing'])
+    dbi.modify_tag_objects('t1', ['missing'])
+    assert dbi.associated == [('applies', 'o1', {'t1'}), ('contains', 'o1', {'g1'}),
+                              ('contains', 'g2', {'g1'}), ('applies', 't1', set())]
+
+
+def test_group_items_ok_reads_a_generator_once():
+    dbi = AssociatingInterface()
+    dbi.objects_ok = lambda ids: {i for i in ids if i == 'o1'}
+    assert dbi.group_items_ok(i for i in ['g1', 'o1', 'missing']) == {'g1', 'o1'}
@@ -0,0 +1,29 @@
+from types import SimpleNamespace
+from sjasoft.uop import meta_state
+
+
+def component(inserted=(), modified=(), deleted=()):
+    inserted, modified, deleted = dict.fromkeys(inserted, {}), dict.fromkeys(modified, {}), set(deleted)
+    return SimpleNamespace(inserted=inserted, modified=modified, deleted=deleted,
+                           has_changes=lambda: bool(inserted or modified or deleted))
+
+
+def changes(**components):
+    kinds = ('objects', 'classes', 'attributes', 'roles', 'tags', 'groups', 'queries')
+    return SimpleNamespace(**{k: components.get(k, component()) for k in kinds})
+
+
+def test_changed_kinds_ignores_objects():
+    assert meta_state.changed_kinds(changes(objects=component(inserted=['c.1']))) == []
+    assert meta_state.changed_kinds(changes(tags=component(deleted=['t1']))) == ['tags']
+
+
+def test_patch_replaces_only_changed_records():
+    state = meta_state.MetaState({'tags': [dict(id='t1', name='one'), dict(id='t2', name='two')],
+                                  'roles': [dict(id='r1', name='role')]}, (0, 0))
+    tags = component(inserted=['t3'], modified=['t1'], deleted=['t2'])
+    assert meta_state.changed_ids(tags) == ['t3', 't1']
+    state.patch('tags', tags.deleted, [dict(id='t1', name='uno'), dict(id='t3', name='three')])
+    data = state.metadata()
+    assert sorted(t['name'] for t in data['tags']) == ['three', 'uno']
+    assert data['roles'] == [dict(id='r1', name='role')]
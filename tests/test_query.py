@@ -1,4 +1,10 @@
+import asyncio
+from types import SimpleNamespace
 from sjasoft.uopmeta.schemas import meta
+from sjasoft.uop.query_plan import CardinalityEstimator, QueryPlanner
+from sjasoft.uop import query_cache
+from sjasoft.uop.query import QueryEvaluator2
+from sjasoft.uop.idsets import ExtensionBitmaps, IdInterner
 
 
 def check_persist(qc):
@@ -47,3 +53,125 @@ def test_persist():
     check_persist(or_m)
 
 
+
+
+class SizedEstimator(CardinalityEstimator):
+    sizes = dict(tags=500, related=3, attr=40)
+
+    async def estimate(self, component):
+        if isinstance(component, meta.TagsComponent):
+            return self.sizes['tags']
+        if isinstance(component, meta.RelatedTo):
+            return self.sizes['related']
+        return self.sizes['attr']
+
+
+def test_plan_orders_most_selective_first():
+    tags = meta.TagsComponent(names=['foo'], application='any')
+    related = meta.RelatedTo(obj_id='332302e_432efa', role='whatever')
+    attr = meta.AttributeComponent(attr_name='foo', operate='$gte', value=3)
+    cls = meta.ClassComponent(cls_name='Person')
+    query = meta.AndQuery(components=[tags, cls, attr, related])
+    planner = QueryPlanner(estimator_class=SizedEstimator)
+    plan = asyncio.run(planner.plan('q1', query, None, None))
+    assert plan.orders[()] == [3, 2, 0]
+    ordered = plan.ordered((), [(0, tags), (2, attr), (3, related)])
+    assert [c for _, c in ordered] == [related, attr, tags]
+    assert asyncio.run(planner.plan('q1', query, None, None)) is plan
+
+
+def related_changes(*triples, **crud):
+    none = lambda: SimpleNamespace(inserted={}, modified={}, deleted=set(),
+                                   has_changes=lambda: False)
+    res = SimpleNamespace(**{k: none() for k in query_cache.metadata_kinds + ('objects',)})
+    res.related = SimpleNamespace(deleted=set(), inserted={
+        (('subject_id', s), ('assoc_id', r), ('object_id', o)) for s, r, o in triples})
+    return res
+
+
+def test_query_results_follow_dependencies():
+    versions = query_cache.DataVersions()
+    results = query_cache.QueryResultCache()
+    tagged = {('subject', 'applies', 'tag1')}
+    results.set(None, 'q1', [versions.version], tagged, {'a'})
+    results.set(None, 'q2', [versions.version], None, {'b'})
+    versions.bump(related_changes(('tag2', 'applies', 'x')))
+    assert results.get(None, 'q1', [versions]) == {'a'}
+    assert results.get(None, 'q2', [versions]) is None
+    versions.bump(related_changes(('tag1', 'applies', 'x')))
+    assert results.get(None, 'q1', [versions]) is None
+
+
+def test_group_dependencies_include_subgroups():
+    named = lambda name: SimpleNamespace(id=name)
+    context = SimpleNamespace(roles=SimpleNamespace(by_name={'group_contains': named('contains'),
+                                                             'contains_group': named('nested'),
+                                                             'tag_applies': named('applies')}),
+                              groups=SimpleNamespace(by_name={'g': named('g')}),
+                              tags=SimpleNamespace(by_name={'t': named('t')}),
+                              subgroups=lambda gid: {'g1', 'g11'} if gid == 'g' else set(),
+                              subtags=lambda tid: {'t1'} if tid == 't' else set())
+    groups = query_cache.query_dependencies(meta.GroupsComponent(names=['g'], application='any'), context)
+    assert {d for d in groups if d[0] == 'subject'} == {('subject', 'contains', g) for g in ('g', 'g1', 'g11')}
+    tags = query_cache.query_dependencies(meta.TagsComponent(names=['t'], application='all'), context)
+    assert tags == {('subject', 'applies', 't'), ('subject', 'applies', 't1')}
+
+
+class UniverseDbi(object):
+    instances = dict(c1=['a', 'b', 'c'], c2=['d'])
+
+    def __init__(self):
+        self.bitmaps = ExtensionBitmaps(IdInterner())
+        self.versions = query_cache.DataVersions()
+        self.reads = 0
+
+    def id_interner(self):
+        return self.bitmaps.interner
+
+    def extension_bitmap(self, cls_id):
+        found = self.bitmaps.get(cls_id, [self.versions])
+        if found is None:
+            self.reads += 1
+            found = self.bitmaps.set(cls_id, [self.versions.version], self.instances[cls_id])
+        return found
+
+    tagsets = dict(t={'a'}, t1={'a', 'b'})
+    related = dict(x={'a', 'b'}, nothing=set())
+
+    async def get_tagset(self, tag_id):
+        return set(self.tagsets[tag_id])
+
+    async def get_related_objects(self, obj_id):
+        return set(self.related[obj_id])
+
+
+def universe_context():
+    named = lambda name: SimpleNamespace(id=name)
+    return SimpleNamespace(tags=SimpleNamespace(by_name={'t': named('t'), 't1': named('t1')}),
+                           classes=SimpleNamespace(by_id={
+                               'c1': SimpleNamespace(is_abstract=False),
+                               'c2': SimpleNamespace(is_abstract=False),
+                               'base': SimpleNamespace(is_abstract=True)}))
+
+
+def test_not_in_or_is_resolved_against_class_instances():
+    context = universe_context()
+    query = SimpleNamespace(query=meta.OrQuery(components=[
+        meta.TagsComponent(names=['t'], application='any'),
+        meta.RelatedTo(obj_id='x', negated=True)]))
+    dbi = UniverseDbi()
+    assert asyncio.run(QueryEvaluator2(query, dbi, context)()) == {'a', 'c', 'd'}
+    assert asyncio.run(QueryEvaluator2(query, dbi, context)()) == {'a', 'c', 'd'}
+    assert dbi.reads == 2
+
+
+def test_and_does_not_depend_on_the_order_of_negated_clauses():
+    context = universe_context()
+    not_related = lambda: meta.RelatedTo(obj_id='nothing', negated=True)
+    tagged = lambda: meta.TagsComponent(names=['t1'], application='any')
+    run = lambda *components: asyncio.run(QueryEvaluator2(
+        SimpleNamespace(query=meta.AndQuery(components=list(components))), UniverseDbi(), context)())
+    assert run(not_related(), tagged()) == {'a', 'b'}
+    assert run(tagged(), not_related()) == {'a', 'b'}
+    assert run(not_related(), not_related()) == {'a', 'b', 'c', 'd'}
+    assert run(meta.RelatedTo(obj_id='x', negated=True), not_related(), tagged()) == set()
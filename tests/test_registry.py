@@ -0,0 +1,131 @@
+import gc
+from sjasoft.uop.registry import InterfaceRegistry
+
+
+class FakeDB(object):
+    def __init__(self):
+        self.times = []
+        self.logged_times = []
+        self.forgotten = []
+
+    def log(self, stamp, own=False):
+        self.times.append(stamp)
+        if own:
+            self.logged_times.append(stamp)
+
+    def latest_change_time(self):
+        return max(self.times) if self.times else None
+
+    def change_times_since(self, epochtime):
+        return [t for t in self.times if t > epochtime]
+
+    def forget_tenant_state(self, tenant_id=None):
+        self.forgotten.append(tenant_id)
+
+
+class FakeInterface(object):
+    def __init__(self, db, tenant_id):
+        self.db = db
+        self.tenant_id = tenant_id
+
+    def session(self):
+        return FakeSession(self)
+
+    def forget_cached_state(self):
+        self.db.forget_tenant_state(self.tenant_id)
+
+
+class FakeSession(object):
+    def __init__(self, shared):
+        self.shared = shared
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_registry():
+    db, clock, made = FakeDB(), Clock(), []
+
+    def factory(a_db, tenant_id):
+        made.append(tenant_id)
+        return FakeInterface(a_db, tenant_id)
+
+    return db, clock, made, InterfaceRegistry(db, factory, idle_seconds=60, check_interval=1.0, clock=clock)
+
+
+def test_interfaces_are_shared_per_tenant():
+    db, clock, made, registry = make_registry()
+    assert registry.get('t1') is registry.get('t1')
+    assert registry.get('t2') is not registry.get('t1')
+    assert made == ['t1', 't2']
+
+
+def test_idle_unreferenced_entries_are_evicted():
+    db, clock, made, registry = make_registry()
+    registry.acquire('held')
+    registry.get('idle')
+    clock.now = 100
+    registry.get('other')
+    assert 'held' in registry and 'idle' not in registry
+    registry.release('held')
+    clock.now = 200
+    registry.get('other')
+    assert 'held' not in registry
+
+
+def test_sessions_hold_their_entry():
+    db, clock, made, registry = make_registry()
+    session = registry.session('t1')
+    assert session.shared is registry.get('t1')
+    assert registry.session('t1') is not session
+    clock.now = 100
+    registry.get('other')
+    assert 't1' in registry
+    del session
+    gc.collect()
+    clock.now = 200
+    registry.get('other')
+    assert 't1' not in registry
+
+
+def test_foreign_changes_rebuild_interfaces():
+    db, clock, made, registry = make_registry()
+    first = registry.get('t1')
+    db.log(5, own=True)  # a change made through this process
+    clock.now = 2
+    assert registry.get('t1') is first
+    db.log(7)  # a change logged by another process
+    clock.now = 2.5
+    assert registry.get('t1') is first  # not rechecked within check_interval
+    clock.now = 4
+    assert registry.get('t1') is not first
+    assert made == ['t1', 't1']
+
+
+def test_foreign_change_followed_by_own_change_is_seen():
+    db, clock, made, registry = make_registry()
+    first = registry.get('t1')
+    db.log(6)
+    db.log(7, own=True)
+    clock.now = 2
+    assert registry.get('t1') is not first
+
+
+def test_foreign_changes_drop_derived_state_once_per_tenant():
+    db, clock, made, registry = make_registry()
+    registry.get('t1')
+    db.log(5, own=True)
+    clock.now = 2
+    registry.get('t1')
+    assert db.forgotten == []
+    db.log(7)
+    clock.now = 4
+    registry.get('t1')
+    registry.get('t2')  # no entry yet but its state may predate the change
+    registry.get('t1')
+    assert db.forgotten == ['t1', 't2']
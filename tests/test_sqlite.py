@@ -0,0 +1,134 @@
+import sqlite3
+import pytest
+from sjasoft.uop import criteria
+from sjasoft.uop import changeset
+from sjasoft.uop import db_collection as db_coll
+from sjasoft.uop.sqlite import sql
+from sjasoft.uop.sqlite.sqliteuop import SqliteUOP
+from sjasoft.uop.query import Q
+
+
+def test_shapes_share_sql():
+    columns = ('subject_id', 'assoc_id', 'object_id')
+    sql1, params1 = sql.where_clause(criteria.normalize({'subject_id': 'a', 'assoc_id': 'r'}), columns)
+    sql2, params2 = sql.where_clause(criteria.normalize({'subject_id': 'b', 'assoc_id': 's'}), columns)
+    assert sql1 == sql2
+    assert params1 == ['a', 'r'] and params2 == ['b', 's']
+    in_sql, in_params = sql.where_clause(criteria.normalize(Q.gt('rank', 3)), columns)
+    assert 'json_extract' in in_sql and in_params == [3]
+
+
+def test_related_roundtrip():
+    db = SqliteUOP.make_test_database()
+    try:
+        related = db.get_standard_collection('related')
+        for i in range(10):
+            related.insert(subject_id=f's{i % 2}', assoc_id='r', object_id=f'o{i}')
+        assert set(related.find({'subject_id': 's0', 'assoc_id': 'r'}, only_cols=['object_id'])) == \
+            {'o0', 'o2', 'o4', 'o6', 'o8'}
+        related.remove({'object_id': {'$in': ['o0', 'o2']}})
+        assert related.count({'subject_id': 's0'}) == 3
+        plan = db.connection.execute(
+            'EXPLAIN QUERY PLAN SELECT data FROM uop_related WHERE object_id = ? AND assoc_id = ?',
+            ('o1', 'r')).fetchall()
+        assert 'USING INDEX' in plan[0][-1]
+    finally:
+        db.drop_database()
+
+
+def test_find_page_continues_in_order():
+    db = SqliteUOP.make_test_database()
+    try:
+        related = db.get_standard_collection('related')
+        for i in range(25):
+            related.insert(subject_id=f's{i % 4}', assoc_id='r', object_id=f'o{i:02}')
+        seen, continuation = [], None
+        while True:
+            page, continuation = related.find_page({'assoc_id': 'r'}, order_by=['-subject_id'], limit=7,
+                                                   continuation=continuation, only_cols=['object_id'])
+            seen.extend(page)
+            if continuation is None:
+                break
+        assert seen == related.find({'assoc_id': 'r'}, only_cols=['object_id'], order_by=['-subject_id', 'id'])
+        assert len(set(seen)) == 25
+    finally:
+        db.drop_database()
+
+
+def test_transactions_check_extensions_only_after_class_set_changes():
+    db = SqliteUOP.make_test_database()
+    other = SqliteUOP(path=db._path)  # as another process would open the store
+    try:
+        ensured = []
+        db.collections.ensure_class_extensions = lambda: ensured.append(db.class_set_version())
+        for _ in range(2):
+            db.begin_transaction()
+            db.commit()
+        assert ensured == [db.class_set_version()]
+        db.collections.class_set_changed()
+        db.begin_transaction()
+        db.commit()
+        assert ensured == [0, 1]
+        other.collections.class_set_changed()
+        assert other.class_set_version() == 2
+        db.begin_transaction()
+        db.commit()
+        assert ensured == [0, 1, 2]
+    finally:
+        other.connection.close()
+        db.drop_database()
+
+
+def test_failed_insert_many_inserts_nothing():
+    db = SqliteUOP.make_test_database()
+    try:
+        related = db.get_standard_collection('related')
+
+        def refuse(an_id):
+            if an_id == 'r3':
+                raise ValueError(an_id)
+
+        db.connection.create_function('refuse', 1, refuse)
+        db.connection.execute('CREATE TRIGGER refuse_r3 BEFORE INSERT ON uop_related '
+                              'BEGIN SELECT refuse(NEW.id); END')
+        with pytest.raises(sqlite3.OperationalError):
+            related.insert_many([dict(id=f'r{i}', subject_id='s', assoc_id='a', object_id=f'o{i}')
+                                 for i in range(5)])
+        assert related.count() == 0 and not db.connection.in_transaction
+    finally:
+        db.drop_database()
+
+
+def test_tenant_keeps_class_instances_across_class_changes():
+    db = SqliteUOP.make_test_database()
+    try:
+        db.ensure_basic_collections()
+        db.tenants().insert(id='t1', name='t1')
+        collections = db_coll.DatabaseCollections(db, tenant_id='t1')
+        collections.ensure_basic_collections()
+        collections.classes.insert(id='c1', name='Thing', attrs=[], superclass=None, tenant_id='t1')
+        collections.class_extension('c1').insert(id='o1.c1', name='one')
+        changes = changeset.ChangeSet()
+        changes.classes.modify('c1', {'description': 'changed'})
+        changes.classes.apply_to_db(collections)
+        assert collections.class_extension('c1').find(only_cols=['id']) == ['o1.c1']
+        collections.forget_class_extensions(['c1'])  # as a new process would, from the tenant record
+        assert collections.class_extension('c1').find(only_cols=['id']) == ['o1.c1']
+    finally:
+        db.drop_database()
+
+
+def test_forgetting_tenant_state_drops_what_was_derived_from_it():
+    db = SqliteUOP.make_test_database()
+    try:
+        versions = db.data_versions('t1')
+        stamp, meta_version = versions.version, db.meta_version('t1')
+        bitmaps = db.extension_bitmaps('t1')
+        db._group_closures['t1'] = ('contains_group', 'closure')
+        db.forget_tenant_state('t1')
+        assert not versions.valid(stamp)
+        assert db.meta_version('t1') == meta_version + 1
+        assert 't1' not in db._group_closures
+        assert db.extension_bitmaps('t1') is not bitmaps
+    finally:
+        db.drop_database()